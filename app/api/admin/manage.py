@@ -61,6 +61,9 @@ class TokenInfo(BaseModel):
     status: str
     tags: List[str] = []
     note: str = ""
+    inflight: int = 0
+    cooldown: float = 0
+    health: Optional[Dict[str, Any]] = None
 
 
 class TokenListResponse(BaseModel):
@@ -265,6 +268,9 @@ async def list_tokens(_: bool = Depends(verify_admin_session)) -> TokenListRespo
         logger.debug("[Admin] 获取Token列表")
 
         all_tokens = token_manager.get_tokens()
+        inflight = token_manager.get_inflight()
+        cooldowns = token_manager.get_cooldowns()
+        health = token_manager.get_health()
         token_list: List[TokenInfo] = []
 
         # 普通Token
@@ -277,7 +283,10 @@ async def list_tokens(_: bool = Depends(verify_admin_session)) -> TokenListRespo
                 heavy_remaining_queries=data.get("heavyremainingQueries", -1),
                 status=get_token_status(data, "sso"),
                 tags=data.get("tags", []),
-                note=data.get("note", "")
+                note=data.get("note", ""),
+                inflight=inflight.get(token, 0),
+                cooldown=round(cooldowns.get(token, 0), 1),
+                health=health.get(token)
             ))
 
         # Super Token
@@ -290,7 +299,10 @@ async def list_tokens(_: bool = Depends(verify_admin_session)) -> TokenListRespo
                 heavy_remaining_queries=data.get("heavyremainingQueries", -1),
                 status=get_token_status(data, "ssoSuper"),
                 tags=data.get("tags", []),
-                note=data.get("note", "")
+                note=data.get("note", ""),
+                inflight=inflight.get(token, 0),
+                cooldown=round(cooldowns.get(token, 0), 1),
+                health=health.get(token)
             ))
 
         logger.debug(f"[Admin] Token列表获取成功: {len(token_list)}个")
@@ -502,6 +514,36 @@ async def get_stats(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
         raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "STATS_ERROR"})
 
 
+@router.get("/api/metrics")
+async def get_metrics(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
+    """获取运行时指标"""
+    try:
+        from app.core.session_pool import session_pool
+        from app.core.retry import retry_engine
+        from app.core.admission import admission, bulkheads
+        from app.services.grok.rate_limit import rate_limit_refresher
+        from app.services.grok.quota_sweeper import quota_sweeper
+        from app.services.grok.hedge import hedge_policy
+        from app.services.grok.processer import GrokResponseProcessor
+        return {
+            "success": True,
+            "data": {
+                "admission": admission.stats(),
+                "bulkheads": bulkheads.stats(),
+                "sessions": session_pool.stats(),
+                "retry": retry_engine.stats(),
+                "rate_limit": rate_limit_refresher.stats(),
+                "quota": quota_sweeper.stats(),
+                "token_queue": token_manager.queue_stats(),
+                "hedge": hedge_policy.stats(),
+                "streams": GrokResponseProcessor.stream_stats(),
+            },
+        }
+    except Exception as e:
+        logger.error(f"[Admin] 获取运行时指标异常: {e}")
+        raise HTTPException(status_code=500, detail={"error": f"获取失败: {e}", "code": "METRICS_ERROR"})
+
+
 @router.get("/api/storage/mode")
 async def get_storage_mode(_: bool = Depends(verify_admin_session)) -> Dict[str, Any]:
     """获取存储模式"""
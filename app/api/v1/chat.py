@@ -1,6 +1,6 @@
 """聊天API路由 - OpenAI兼容的聊天接口"""
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Optional
 from fastapi.responses import StreamingResponse
 
@@ -8,6 +8,7 @@ from app.core.auth import auth_manager
 from app.core.exception import GrokApiException
 from app.core.logger import logger
 from app.services.grok.client import GrokClient
+from app.services.grok.processer import DeltaCoalescer, GrokResponseProcessor
 from app.models.openai_schema import OpenAIChatRequest
 
 
@@ -15,18 +16,22 @@ router = APIRouter(prefix="/chat", tags=["聊天"])
 
 
 @router.post("/completions", response_model=None)
-async def chat_completions(request: OpenAIChatRequest, _: Optional[str] = Depends(auth_manager.verify)):
+async def chat_completions(request: OpenAIChatRequest, raw_request: Request, api_key: Optional[str] = Depends(auth_manager.verify)):
     """创建聊天补全（支持流式和非流式）"""
     try:
         logger.info("[Chat] 收到聊天请求")
 
+        # 流式分片合并参数（可按 API Key 配置）
+        if request.stream:
+            DeltaCoalescer.configure(api_key)
+
         # 调用Grok客户端
         result = await GrokClient.openai_to_grok(request.model_dump())
         
-        # 流式响应
+        # 流式响应（客户端断开时取消上游读取并释放Token）
         if request.stream:
             return StreamingResponse(
-                content=result,
+                content=GrokResponseProcessor.guard_disconnect(result, raw_request.receive),
                 media_type="text/event-stream",
                 headers={
                     "Cache-Control": "no-cache",
@@ -39,6 +44,8 @@ async def chat_completions(request: OpenAIChatRequest, _: Optional[str] = Depend
         return result
         
     except GrokApiException as e:
+        if e.error_code == "QUEUE_FULL":
+            raise  # 由全局异常处理返回 429 + Retry-After
         logger.error(f"[Chat] Grok API错误: {e} - 详情: {e.details}")
         raise HTTPException(
             status_code=500,
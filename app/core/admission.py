@@ -0,0 +1,313 @@
+"""请求准入控制 - 自适应并发上限（AIMD + 延迟梯度）与有界排队"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+
+
+# 默认值
+DEFAULT_MAX_CONCURRENCY = 50  # 并发上限（也是自适应调整的上界）
+DEFAULT_MIN_CONCURRENCY = 4  # 自适应调整的下界
+DEFAULT_QUEUE_SIZE = 200  # 超出并发上限时最多排队的请求数
+DEFAULT_QUEUE_TIMEOUT = 30.0  # 排队最长等待时间（秒）
+DEFAULT_LATENCY_TOLERANCE = 2.0  # 短期延迟超过长期基线的该倍数时视为拥塞
+
+OVERLOAD_BACKOFF = 0.7  # 上游限流/拦截时的乘性减小系数
+LATENCY_BACKOFF = 0.9  # 延迟升高时的乘性减小系数
+DECREASE_INTERVAL = 1.0  # 两次减小之间的最小间隔（秒），避免同一波错误连续砍半
+SHORT_ALPHA = 0.3  # 短期延迟 EWMA 系数
+LONG_ALPHA = 0.02  # 长期延迟基线 EWMA 系数
+MIN_SAMPLES = 20  # 延迟梯度生效前至少需要的样本数
+
+# 按模型类别的隔离舱默认并发/排队上限（未配置的类别使用全局并发上限）
+DEFAULT_BULKHEAD_CONCURRENCY = {"fast": 40, "expert": 20, "heavy": 8, "video": 6}
+DEFAULT_BULKHEAD_QUEUE_SIZE = {"fast": 100, "expert": 50, "heavy": 20, "video": 10}
+
+
+class Permit:
+    """准入许可 - 请求结束时必须调用 release()"""
+
+    __slots__ = ("_controller", "_started", "_released", "overloaded", "latency")
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+        self.overloaded = False  # 请求过程中（含重试）是否遇到过上游过载信号
+        self.latency: Optional[float] = None  # 上游响应延迟（不含排队/上传），由 note_latency() 记录
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._started
+
+    def release(self, overloaded: bool = False, latency: Optional[float] = None) -> None:
+        """归还许可
+
+        Args:
+            overloaded: 本次请求遇到上游过载信号（429/403/网络错误）
+            latency: 延迟样本（秒），None 表示不参与延迟梯度
+        """
+        if self._released:
+            return
+        self._released = True
+        self._controller._release(overloaded or self.overloaded, latency)
+
+    def __del__(self):
+        if not self._released:
+            self.release()
+
+
+_permit: ContextVar[Optional[Permit]] = ContextVar("grok_admission_permit", default=None)
+
+
+@contextmanager
+def bind_permit(permit: Permit) -> Iterator[Permit]:
+    """作用域内的上游调用可通过 note_overload() 标记该许可"""
+    token = _permit.set(permit)
+    try:
+        yield permit
+    finally:
+        _permit.reset(token)
+
+
+def note_overload() -> None:
+    """上游返回过载信号（429/403），即使随后重试成功也计入自适应调整"""
+    permit = _permit.get()
+    if permit is not None:
+        permit.overloaded = True
+
+
+def note_latency(seconds: float) -> None:
+    """记录上游响应延迟（从发出请求到收到响应头），作为该许可的延迟样本"""
+    permit = _permit.get()
+    if permit is not None:
+        permit.latency = seconds
+
+
+class AdmissionController:
+    """准入控制器
+
+    - 在途请求数达到当前上限时排队（FIFO），队列已满或等待超时返回 QUEUE_FULL（429 + Retry-After）
+    - 当前上限从配置值开始：遇到过载信号或短期延迟明显高于长期基线时乘性减小，
+      正常完成且上限被充分使用时加性增大（每完成 limit 个请求约 +1），不超过配置值、不低于下界
+    - adaptive=False 时为固定上限的隔离舱
+    """
+
+    def __init__(
+        self,
+        name: str,
+        limit: Callable[[], int],
+        queue_size: Callable[[], int],
+        queue_timeout: Callable[[], float],
+        adaptive: bool = False,
+    ):
+        self.name = name
+        self._limit_conf = limit
+        self._queue_size = queue_size
+        self._queue_timeout = queue_timeout
+        self._adaptive = adaptive
+
+        self._configured = 0
+        self._limit = 0.0
+        self._inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._samples = 0
+        self._last_decrease = 0.0
+        self._avg_wait: Optional[float] = None
+        self._stats: Dict[str, int] = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "timeout": 0,
+            "overloaded": 0,
+            "increases": 0,
+            "decreases": 0,
+        }
+
+    # === 上限 ===
+
+    def _current_limit(self) -> int:
+        """当前并发上限（配置变更时重置）"""
+        configured = max(1, int(self._limit_conf()))
+        if configured != self._configured:
+            self._configured = configured
+            self._limit = float(configured)
+        return max(1, int(self._limit))
+
+    @staticmethod
+    def _min_limit() -> int:
+        return max(1, int(setting.global_config.get("admission_min_concurrency", DEFAULT_MIN_CONCURRENCY)))
+
+    def _adapt(self, overloaded: bool, latency: Optional[float], utilized: bool) -> None:
+        if latency is not None:
+            self._samples += 1
+            self._short = latency if self._short is None else self._short + SHORT_ALPHA * (latency - self._short)
+            self._long = latency if self._long is None else self._long + LONG_ALPHA * (latency - self._long)
+        if not self._adaptive:
+            return
+
+        tolerance = float(setting.global_config.get("admission_latency_tolerance", DEFAULT_LATENCY_TOLERANCE))
+        congested = (
+            self._samples >= MIN_SAMPLES and self._long
+            and self._short > self._long * tolerance
+        )
+        floor = min(self._min_limit(), self._configured)
+        if overloaded or congested:
+            now = time.monotonic()
+            if now - self._last_decrease < DECREASE_INTERVAL:
+                return
+            self._last_decrease = now
+            limit = max(floor, self._limit * (OVERLOAD_BACKOFF if overloaded else LATENCY_BACKOFF))
+            if limit < self._limit:
+                self._limit = limit
+                self._stats["decreases"] += 1
+        elif utilized and self._limit < self._configured:
+            self._limit = min(float(self._configured), self._limit + 1.0 / self._limit)
+            self._stats["increases"] += 1
+
+    # === 准入 ===
+
+    def retry_after(self) -> int:
+        """建议客户端的重试间隔（秒）"""
+        return max(1, math.ceil(self._avg_wait if self._avg_wait is not None else 1.0))
+
+    def _reject(self, reason: str) -> GrokApiException:
+        return GrokApiException(
+            f"服务繁忙（{self.name}），请稍后重试",
+            "QUEUE_FULL",
+            {"pool": self.name, "reason": reason, "queued": len(self._waiters), "retry_after": self.retry_after()}
+        )
+
+    def try_acquire(self) -> Optional[Permit]:
+        """不排队地获取许可（对冲等可有可无的额外请求用），已达上限或有请求排队时返回 None"""
+        if self._inflight < self._current_limit() and not self._waiters:
+            self._inflight += 1
+            self._stats["admitted"] += 1
+            return Permit(self)
+        return None
+
+    async def acquire(self) -> Permit:
+        """获取许可，需要时排队"""
+        limit = self._current_limit()
+        if self._inflight < limit and not self._waiters:
+            self._inflight += 1
+            self._stats["admitted"] += 1
+            return Permit(self)
+
+        if len(self._waiters) >= max(0, int(self._queue_size())):
+            self._stats["rejected"] += 1
+            raise self._reject("queue_full")
+
+        self._stats["queued"] += 1
+        started = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), max(0.0, float(self._queue_timeout())))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 已被分配许可但等待方放弃：归还
+                self._inflight -= 1
+                self._dispatch()
+            else:
+                future.cancel()
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self._stats["timeout"] += 1
+            raise self._reject("timeout") from None
+
+        waited = time.monotonic() - started
+        self._avg_wait = waited if self._avg_wait is None else self._avg_wait + 0.2 * (waited - self._avg_wait)
+        self._stats["admitted"] += 1
+        return Permit(self)
+
+    def _release(self, overloaded: bool, latency: Optional[float]) -> None:
+        utilized = self._inflight >= self._current_limit() * 0.5
+        self._inflight = max(0, self._inflight - 1)
+        if overloaded:
+            self._stats["overloaded"] += 1
+        self._adapt(overloaded, latency, utilized)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """按到达顺序放行排队请求"""
+        limit = self._current_limit()
+        while self._waiters and self._inflight < limit:
+            future = self._waiters.popleft()
+            if future.done():
+                continue
+            self._inflight += 1
+            future.set_result(None)
+
+    # === 统计 ===
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "limit": round(self._limit, 2) if self._configured else None,
+            "configured": self._configured or None,
+            "inflight": self._inflight,
+            "queue_depth": len(self._waiters),
+            "latency_short": round(self._short, 3) if self._short is not None else None,
+            "latency_long": round(self._long, 3) if self._long is not None else None,
+            "avg_wait": round(self._avg_wait, 3) if self._avg_wait is not None else None,
+        }
+
+
+class BulkheadRegistry:
+    """按模型类别（fast/expert/heavy/video）的固定并发隔离舱
+
+    慢请求（视频/Heavy）只能占满自己的隔离舱，不会耗尽交互式对话所需的并发；
+    请求先进入所属隔离舱再获取全局许可，在隔离舱排队时不占用全局名额。
+    """
+
+    def __init__(self):
+        self._pools: Dict[str, AdmissionController] = {}
+
+    @staticmethod
+    def _conf(key: str, defaults: Dict[str, int], name: str, fallback: int) -> int:
+        values = setting.grok_config.get(key) or {}
+        return int(values.get(name, defaults.get(name, fallback)))
+
+    def get(self, name: str) -> AdmissionController:
+        pool = self._pools.get(name)
+        if pool is None:
+            def limit() -> int:
+                fallback = int(setting.global_config.get("max_request_concurrency", DEFAULT_MAX_CONCURRENCY))
+                return self._conf("bulkhead_concurrency", DEFAULT_BULKHEAD_CONCURRENCY, name, fallback)
+
+            pool = self._pools[name] = AdmissionController(
+                name,
+                limit=limit,
+                queue_size=lambda: self._conf("bulkhead_queue_size", DEFAULT_BULKHEAD_QUEUE_SIZE, name, DEFAULT_QUEUE_SIZE),
+                queue_timeout=lambda: setting.global_config.get("admission_queue_timeout", DEFAULT_QUEUE_TIMEOUT),
+            )
+        return pool
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+
+# 全局实例：/v1/chat/completions 等对话入口的总并发
+admission = AdmissionController(
+    "global",
+    limit=lambda: setting.global_config.get("max_request_concurrency", DEFAULT_MAX_CONCURRENCY),
+    queue_size=lambda: setting.global_config.get("admission_queue_size", DEFAULT_QUEUE_SIZE),
+    queue_timeout=lambda: setting.global_config.get("admission_queue_timeout", DEFAULT_QUEUE_TIMEOUT),
+    adaptive=True,
+)
+
+bulkheads = BulkheadRegistry()
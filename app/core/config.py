@@ -25,6 +25,44 @@ DEFAULT_GROK = {
     "stream_chunk_timeout": 120,
     "stream_total_timeout": 600,
     "retry_status_codes": [401, 429],  # 可重试的HTTP状态码
+    "retry_max_attempts": 4,  # 单次上游调用最大尝试次数（含首次）
+    "retry_request_budget": 6,  # 单个API请求内所有上游调用共享的重试总次数
+    "retry_base_delay": 0.1,  # 退避基准（秒）
+    "retry_max_delay": 2.0,  # 单次退避上限（秒）
+    "retry_max_retry_after": 10.0,  # 可接受的Retry-After上限（秒）
+    "retry_rate_limit": 20.0,  # 进程级重试速率上限（次/秒）
+    "retry_rate_burst": 40,  # 进程级重试突发容量
+    "token_max_inflight": 0,  # 单Token最大在途请求数（0为不限），选择时总是优先在途最少的Token
+    "rate_limit_min_interval": 10.0,  # 同一Token两次限额查询的最小间隔（秒）
+    "rate_limit_sample_rate": 0.25,  # 预测额度可信时按该比例抽样查询限额
+    "rate_limit_low_watermark": 10,  # 预测剩余次数不高于该值时必查限额
+    "rate_limit_max_age": 300.0,  # 限额数据超过该时间（秒）未刷新时必查
+    "rate_limit_concurrency": 4,  # 同时进行的限额查询数上限
+    "quota_sweep_interval": 600.0,  # 后台复查耗尽/未使用Token的间隔（秒），0为关闭
+    "quota_sweep_concurrency": 2,  # 巡检时同时复查的Token数
+    "quota_sweep_jitter": 0.2,  # 巡检间隔的随机抖动比例
+    "quota_sweep_max_tokens": 50,  # 每轮巡检最多复查的项数，0为不限
+    "quota_history_size": 144,  # 保留的池容量采样点数
+    "token_cooldown_seconds": 60,  # 401/429后Token的首次冷却时间（秒），连续冷却按指数翻倍，上游返回Retry-After时以其为准
+    "token_cooldown_max_seconds": 1800,  # Token冷却时间上限（秒）
+    "token_health_alpha": 0.2,  # Token健康统计（首包延迟/耗时/错误率）的EWMA平滑系数
+    "token_health_min_samples": 5,  # 健康评分与剔除所需的最少请求数
+    "token_health_eject_error_rate": 0.5,  # 错误率达到该值时暂时剔除Token
+    "token_health_eject_latency_factor": 3.0,  # 首包延迟达到池平均的该倍数时暂时剔除Token
+    "token_health_eject_seconds": 120,  # 剔除时长（秒）
+    "token_health_max_eject_ratio": 0.5,  # 同时被剔除的Token占比上限
+    "token_queue_size": 0,  # 无可用Token时每个Token池最多排队等待的请求数（0为关闭排队，立即返回503）
+    "token_queue_timeout": 10.0,  # 单个请求最长排队时间（秒），超时返回503
+    "token_queue_order": "fifo",  # 排队顺序: fifo 先到先得 / priority 流式请求优先
+    "bulkhead_concurrency": {"fast": 40, "expert": 20, "heavy": 8, "video": 6},  # 各模型类别的并发上限
+    "bulkhead_queue_size": {"fast": 100, "expert": 50, "heavy": 20, "video": 10},  # 各模型类别的排队上限
+    "hedge_enabled": False,  # 流式首包过慢时在其他Token上发起对冲请求，先出数据者胜出
+    "hedge_min_delay": 2.0,  # 对冲阈值下限（秒），实际阈值取近期首包延迟p95
+    "hedge_budget_ratio": 0.05,  # 对冲请求占请求总数的比例上限
+    "hedge_bulkheads": ["fast", "expert"],  # 参与对冲的模型类别
+    "stream_coalesce_ms": 0,  # 流式分片合并的最长缓冲时间（毫秒），0为关闭
+    "stream_coalesce_bytes": 512,  # 缓冲达到该字节数立即发送
+    "stream_coalesce_keys": {},  # 按API Key覆盖合并参数，如 {"sk-xxx": {"ms": 30, "bytes": 1024}}
     "clash_enabled": False,
     "clash_subscription_url": "",
     "clash_proxy_node": "",
@@ -40,8 +78,19 @@ DEFAULT_GLOBAL = {
     "image_cache_max_size_mb": 512,
     "video_cache_max_size_mb": 1024,
     "max_upload_concurrency": 20,  # 最大并发上传数
-    "max_request_concurrency": 50,  # 最大并发请求数
+    "image_fetch_concurrency": 8,  # 同时下载的生成图片数
+    "image_fetch_timeout": 30.0,  # 单张生成图片下载超时（秒），超时回退为上游地址
+    "max_request_concurrency": 50,  # 最大并发请求数（自适应并发上限的上界）
+    "admission_min_concurrency": 4,  # 自适应并发上限的下界
+    "admission_queue_size": 200,  # 超出并发上限时最多排队的请求数，队列满返回429
+    "admission_queue_timeout": 30.0,  # 排队最长等待时间（秒）
+    "admission_latency_tolerance": 2.0,  # 短期延迟超过长期基线的该倍数时减小并发上限
+    "session_pool_size": 16,  # HTTP会话池最大会话数（按代理/指纹区分）
+    "session_idle_timeout": 120,  # 空闲会话回收时间（秒）
+    "session_max_clients": 1024,  # 单会话最大并发传输数
     "batch_save_interval": 1.0,  # 批量保存间隔（秒）
+    "token_watch_interval": 2.0,  # token文件变更检测间隔（秒），多进程共享文件时合并其他进程的修改
+    "token_sync_interval": 10.0,  # Redis模式下同步本地Token视图（管理后台展示）的间隔（秒）
     "batch_save_threshold": 10  # 触发批量保存的变更数阈值
 }
 
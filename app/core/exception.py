@@ -29,6 +29,7 @@ GROK_STATUS_MAP = {
     "NO_RESPONSE": status.HTTP_502_BAD_GATEWAY,
     "TOKEN_SAVE_ERROR": status.HTTP_500_INTERNAL_SERVER_ERROR,
     "NO_AVAILABLE_TOKEN": status.HTTP_503_SERVICE_UNAVAILABLE,
+    "QUEUE_FULL": status.HTTP_429_TOO_MANY_REQUESTS,
 }
 
 GROK_TYPE_MAP = {
@@ -42,6 +43,7 @@ GROK_TYPE_MAP = {
     "NO_RESPONSE": "api_error",
     "TOKEN_SAVE_ERROR": "api_error",
     "NO_AVAILABLE_TOKEN": "api_error",
+    "QUEUE_FULL": "rate_limit_error",
 }
 
 
@@ -95,10 +97,12 @@ async def grok_api_exception_handler(_: Request, exc: GrokApiException) -> JSONR
     """处理Grok API异常"""
     http_status = GROK_STATUS_MAP.get(exc.error_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
     error_type = GROK_TYPE_MAP.get(exc.error_code, "api_error")
+    retry_after = exc.details.get("retry_after") if http_status == status.HTTP_429_TOO_MANY_REQUESTS else None
 
     return JSONResponse(
         status_code=http_status,
-        content=build_error_response(exc.message, error_type, exc.error_code)
+        content=build_error_response(exc.message, error_type, exc.error_code),
+        headers={"Retry-After": str(retry_after)} if retry_after else None
     )
 
 
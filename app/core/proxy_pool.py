@@ -97,6 +97,10 @@ class ProxyPool:
                         
                         # 验证代理格式
                         if self._validate_proxy(proxy):
+                            if self._current_proxy and self._current_proxy != proxy:
+                                # 代理已切换，丢弃旧代理上的长连接
+                                from app.core.session_pool import session_pool
+                                session_pool.invalidate(self._current_proxy)
                             self._current_proxy = proxy
                             self._last_fetch_time = time.time()
                             logger.info(f"[ProxyPool] 成功获取新代理: {proxy}")
@@ -0,0 +1,256 @@
+"""上游重试引擎 - 统一的退避、预算与限速策略"""
+
+import random
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, Optional
+
+from app.core.admission import note_overload
+from app.core.config import setting
+from app.core.logger import logger
+
+
+# 默认值
+DEFAULT_MAX_ATTEMPTS = 4  # 单次调用最大尝试次数（含首次）
+DEFAULT_REQUEST_BUDGET = 6  # 单个API请求（含嵌套上传/创建/限额调用）的重试总预算
+DEFAULT_BASE_DELAY = 0.1  # 退避基准（秒）
+DEFAULT_MAX_DELAY = 2.0  # 单次退避上限（秒）
+DEFAULT_MAX_RETRY_AFTER = 10.0  # 可接受的 Retry-After 上限（秒），超过则直接放弃
+DEFAULT_RETRY_RATE = 20.0  # 进程级重试速率上限（次/秒）
+DEFAULT_RETRY_BURST = 40  # 进程级重试突发容量
+
+
+class RetryBudget:
+    """请求级重试预算 - 同一API请求内的所有上游调用共享"""
+
+    __slots__ = ("limit", "used")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+
+    def try_spend(self) -> bool:
+        if self.used >= self.limit:
+            return False
+        self.used += 1
+        return True
+
+
+_budget: ContextVar[Optional[RetryBudget]] = ContextVar("grok_retry_budget", default=None)
+
+
+@contextmanager
+def retry_scope(limit: Optional[int] = None) -> Iterator[RetryBudget]:
+    """为当前请求开启重试预算，作用域内的所有 execute 调用共享"""
+    if limit is None:
+        limit = int(setting.grok_config.get("retry_request_budget", DEFAULT_REQUEST_BUDGET))
+    budget = RetryBudget(limit)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+
+
+class TokenBucket:
+    """令牌桶 - 限制进程级重试速率"""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+
+    def configure(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self._tokens = min(self._tokens, float(burst))
+
+    def try_take(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After（秒数或HTTP日期）"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+class RetryEngine:
+    """上游重试引擎
+
+    - 403 且启用代理池: 刷新代理后重试
+    - retry_status_codes（默认401/429）: 退避后重试，优先遵循 Retry-After
+    - 退避采用 decorrelated jitter: sleep = min(cap, uniform(base, prev * 3))
+    - 单次调用受 max_attempts 限制，同一请求受 RetryBudget 限制，全进程受令牌桶限速
+    """
+
+    def __init__(self):
+        self._bucket = TokenBucket(DEFAULT_RETRY_RATE, DEFAULT_RETRY_BURST)
+        self._bucket_conf = (DEFAULT_RETRY_RATE, DEFAULT_RETRY_BURST)
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    # === 配置 ===
+
+    def _refresh_bucket(self) -> None:
+        conf = (
+            float(setting.grok_config.get("retry_rate_limit", DEFAULT_RETRY_RATE)),
+            int(setting.grok_config.get("retry_rate_burst", DEFAULT_RETRY_BURST)),
+        )
+        if conf != self._bucket_conf:
+            self._bucket.configure(*conf)
+            self._bucket_conf = conf
+
+    # === 统计 ===
+
+    def _record(self, tag: str, key: str, n: int = 1) -> None:
+        stats = self._stats.setdefault(tag, {})
+        stats[key] = stats.get(key, 0) + n
+
+    def stats(self) -> Dict[str, Any]:
+        """每个调用点的尝试/重试统计"""
+        return {tag: dict(values) for tag, values in self._stats.items()}
+
+    # === 执行 ===
+
+    def _allow_retry(self, tag: str, attempt: int, max_attempts: int) -> bool:
+        """判断是否还能重试（调用次数 -> 请求预算 -> 全局速率）"""
+        if attempt >= max_attempts:
+            self._record(tag, "gave_up_attempts")
+            return False
+        budget = _budget.get()
+        if budget is not None and not budget.try_spend():
+            self._record(tag, "gave_up_budget")
+            return False
+        self._refresh_bucket()
+        if not self._bucket.try_take():
+            self._record(tag, "gave_up_throttled")
+            return False
+        return True
+
+    async def execute(
+        self,
+        send: Callable[[Optional[str]], Awaitable[Any]],
+        *,
+        tag: str,
+        proxy_type: str = "service",
+        retry_codes: Optional[Iterable[int]] = None,
+        retry_exceptions: bool = False,
+        max_attempts: Optional[int] = None,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Any:
+        """执行上游调用并按策略重试
+
+        Args:
+            send: 以代理URL为参数发起一次请求，返回响应对象（需有 status_code/headers）
+            tag: 日志与统计标签
+            proxy_type: 代理类型（service/cache）
+            retry_codes: 可重试状态码，默认读取配置 retry_status_codes
+            retry_exceptions: 网络异常是否重试
+            max_attempts: 单次调用最大尝试次数
+            discard: 丢弃中间响应时的清理回调（流式响应需关闭）
+
+        Returns:
+            最后一次响应（状态码由调用方处理）；不可重试的异常原样抛出
+        """
+        from app.core.proxy_pool import proxy_pool
+
+        if retry_codes is None:
+            retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
+        retry_codes = set(retry_codes)
+        if max_attempts is None:
+            max_attempts = int(setting.grok_config.get("retry_max_attempts", DEFAULT_MAX_ATTEMPTS))
+        base = float(setting.grok_config.get("retry_base_delay", DEFAULT_BASE_DELAY))
+        cap = float(setting.grok_config.get("retry_max_delay", DEFAULT_MAX_DELAY))
+        max_retry_after = float(setting.grok_config.get("retry_max_retry_after", DEFAULT_MAX_RETRY_AFTER))
+
+        refresh_proxy = False
+        delay = base
+        attempt = 0
+
+        while True:
+            attempt += 1
+            self._record(tag, "attempts")
+
+            if refresh_proxy:
+                proxy = await proxy_pool.force_refresh()
+            else:
+                proxy = await setting.get_proxy_async(proxy_type)
+            refresh_proxy = False
+
+            try:
+                response = await send(proxy)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._record(tag, "exception")
+                if not retry_exceptions or not self._allow_retry(tag, attempt, max_attempts):
+                    raise
+                delay = min(cap, random.uniform(base, delay * 3))
+                self._record(tag, "retries")
+                logger.warning(f"[{tag}] 请求异常: {e}，{delay:.2f}s后重试 ({attempt}/{max_attempts})")
+                await asyncio.sleep(delay)
+                continue
+
+            status = response.status_code
+            self._record(tag, f"status_{status}")
+            if status in (403, 429):
+                note_overload()
+
+            # 403: 仅在启用代理池（可更换出口IP）时重试
+            if status == 403 and proxy_type == "service" and proxy_pool._enabled:
+                if self._allow_retry(tag, attempt, max_attempts):
+                    if discard:
+                        await discard(response)
+                    refresh_proxy = True
+                    self._record(tag, "retries")
+                    logger.warning(f"[{tag}] 遇到403错误，刷新代理后重试 ({attempt}/{max_attempts})")
+                    continue
+                logger.error(f"[{tag}] 403错误，已尝试{attempt}次，放弃")
+                return response
+
+            if status in retry_codes:
+                retry_after = parse_retry_after(response.headers.get("Retry-After") if response.headers else None)
+                if retry_after is not None and retry_after > max_retry_after:
+                    self._record(tag, "gave_up_retry_after")
+                    logger.warning(f"[{tag}] {status}错误，Retry-After={retry_after:.0f}s 超过上限，放弃")
+                    return response
+                if self._allow_retry(tag, attempt, max_attempts):
+                    if discard:
+                        await discard(response)
+                    delay = min(cap, random.uniform(base, delay * 3))
+                    if retry_after is not None:
+                        delay = max(delay, retry_after)
+                    self._record(tag, "retries")
+                    logger.warning(f"[{tag}] 遇到{status}错误，{delay:.2f}s后重试 ({attempt}/{max_attempts})")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"[{tag}] {status}错误，已尝试{attempt}次，放弃")
+                return response
+
+            if attempt > 1 and status == 200:
+                self._record(tag, "recovered")
+                logger.info(f"[{tag}] 重试成功！")
+            return response
+
+
+# 全局实例
+retry_engine = RetryEngine()
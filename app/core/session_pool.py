@@ -0,0 +1,228 @@
+"""HTTP会话池 - 按(代理, 浏览器指纹)复用curl_cffi AsyncSession，保持长连接"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from curl_cffi.requests import AsyncSession
+
+from app.core.config import setting
+from app.core.logger import logger
+
+
+# 默认值
+DEFAULT_POOL_SIZE = 16  # 最多保留的会话数（不同代理/指纹组合）
+DEFAULT_IDLE_TIMEOUT = 120  # 空闲会话回收时间（秒）
+DEFAULT_MAX_CLIENTS = 1024  # 单会话最大并发传输数（curl句柄按需创建）
+
+SessionKey = Tuple[str, str, str]
+
+
+class _PooledSession:
+    """池内会话"""
+
+    __slots__ = ("key", "session", "in_use", "last_used", "retired", "requests")
+
+    def __init__(self, key: SessionKey, session: AsyncSession):
+        self.key = key
+        self.session = session
+        self.in_use = 0
+        self.last_used = time.monotonic()
+        self.retired = False
+        self.requests = 0
+
+
+class SessionHandle:
+    """会话租约 - 使用完毕后必须调用 release()"""
+
+    __slots__ = ("_pool", "_entry", "_released")
+
+    def __init__(self, pool: "SessionPool", entry: _PooledSession):
+        self._pool = pool
+        self._entry = entry
+        self._released = False
+
+    @property
+    def session(self) -> AsyncSession:
+        return self._entry.session
+
+    async def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        await self._pool._release(self._entry)
+
+
+class SessionPool:
+    """AsyncSession 会话池
+
+    - 以 (代理URL, impersonate, 分区) 为键复用会话，避免每次请求重新握手 TCP/TLS
+    - 会话数量有上限（LRU淘汰），空闲超时自动回收
+    - 代理切换时可丢弃旧代理对应的会话
+    - 会话被淘汰时若仍有请求在用，延迟到最后一个请求结束后再关闭
+    """
+
+    def __init__(self):
+        self._sessions: "OrderedDict[SessionKey, _PooledSession]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+        self._stats: Dict[str, int] = {
+            "requests": 0,
+            "session_hits": 0,  # 借出时命中已有会话的次数（不等于TCP/TLS连接复用次数）
+            "created": 0,
+            "evicted_idle": 0,
+            "evicted_lru": 0,
+            "invalidated": 0,
+            "closed": 0,
+        }
+
+    # === 配置 ===
+
+    @staticmethod
+    def _pool_size() -> int:
+        return max(1, int(setting.global_config.get("session_pool_size", DEFAULT_POOL_SIZE)))
+
+    @staticmethod
+    def _idle_timeout() -> float:
+        return float(setting.global_config.get("session_idle_timeout", DEFAULT_IDLE_TIMEOUT))
+
+    @staticmethod
+    def _max_clients() -> int:
+        return max(1, int(setting.global_config.get("session_max_clients", DEFAULT_MAX_CLIENTS)))
+
+    # === 获取/归还 ===
+
+    async def checkout(self, proxy: Optional[str] = None, impersonate: Optional[str] = None, partition: str = "") -> SessionHandle:
+        """借出会话（需配对 release）；partition 用于隔离不同类别的请求（如视频长流与普通对话）"""
+        key = (proxy or "", impersonate or "", partition)
+        self._sweep_idle()
+
+        self._stats["requests"] += 1
+        entry = self._sessions.get(key)
+        if entry is not None and not entry.retired:
+            self._sessions.move_to_end(key)
+            self._stats["session_hits"] += 1
+        else:
+            entry = self._create(key, proxy, impersonate)
+
+        entry.in_use += 1
+        entry.requests += 1
+        entry.last_used = time.monotonic()
+        return SessionHandle(self, entry)
+
+    @asynccontextmanager
+    async def acquire(self, proxy: Optional[str] = None, impersonate: Optional[str] = None) -> AsyncIterator[AsyncSession]:
+        """借出会话（上下文管理器）"""
+        handle = await self.checkout(proxy, impersonate)
+        try:
+            yield handle.session
+        finally:
+            await handle.release()
+
+    async def _release(self, entry: _PooledSession) -> None:
+        entry.in_use = max(0, entry.in_use - 1)
+        entry.last_used = time.monotonic()
+        if entry.retired and entry.in_use == 0:
+            await self._close(entry)
+
+    def _create(self, key: SessionKey, proxy: Optional[str], impersonate: Optional[str]) -> _PooledSession:
+        kwargs: Dict[str, Any] = {"max_clients": self._max_clients(), "discard_cookies": True}
+        if proxy:
+            kwargs["proxies"] = {"http": proxy, "https": proxy}
+        if impersonate:
+            kwargs["impersonate"] = impersonate
+
+        entry = _PooledSession(key, AsyncSession(**kwargs))
+        self._sessions[key] = entry
+        self._stats["created"] += 1
+        logger.debug(f"[SessionPool] 新建会话: proxy={self._mask(proxy)}, impersonate={impersonate or '-'}")
+
+        # 超出容量时淘汰最久未使用的会话
+        while len(self._sessions) > self._pool_size():
+            _, oldest = self._sessions.popitem(last=False)
+            self._stats["evicted_lru"] += 1
+            self._retire(oldest)
+        return entry
+
+    # === 回收 ===
+
+    def _sweep_idle(self) -> None:
+        """回收空闲超时的会话（按 idle_timeout/4 节流）"""
+        idle = self._idle_timeout()
+        now = time.monotonic()
+        if idle <= 0 or now - self._last_sweep < idle / 4:
+            return
+        self._last_sweep = now
+
+        for key, entry in list(self._sessions.items()):
+            if entry.in_use == 0 and now - entry.last_used >= idle:
+                del self._sessions[key]
+                self._stats["evicted_idle"] += 1
+                self._retire(entry)
+
+    def invalidate(self, proxy: Optional[str]) -> None:
+        """丢弃指定代理的所有会话（代理切换时调用）"""
+        proxy = proxy or ""
+        for key, entry in list(self._sessions.items()):
+            if key[0] == proxy:
+                del self._sessions[key]
+                self._stats["invalidated"] += 1
+                self._retire(entry)
+        logger.debug(f"[SessionPool] 已丢弃代理会话: {self._mask(proxy)}")
+
+    def _retire(self, entry: _PooledSession) -> None:
+        """标记淘汰，空闲则立即关闭"""
+        entry.retired = True
+        if entry.in_use == 0:
+            try:
+                asyncio.get_running_loop().create_task(self._close(entry))
+            except RuntimeError:
+                pass
+
+    async def _close(self, entry: _PooledSession) -> None:
+        try:
+            await entry.session.close()
+            self._stats["closed"] += 1
+        except Exception as e:
+            logger.warning(f"[SessionPool] 关闭会话失败: {e}")
+
+    async def close(self) -> None:
+        """关闭全部会话"""
+        entries = list(self._sessions.values())
+        self._sessions.clear()
+        for entry in entries:
+            entry.retired = True
+            await self._close(entry)
+        logger.info(f"[SessionPool] 已关闭 {len(entries)} 个会话")
+
+    # === 统计 ===
+
+    def stats(self) -> Dict[str, Any]:
+        """会话命中统计（统计的是会话借出命中，连接级复用由 curl 在会话内部管理）"""
+        requests = self._stats["requests"]
+        return {
+            **self._stats,
+            "hit_ratio": round(self._stats["session_hits"] / requests, 4) if requests else 0.0,
+            "sessions": [
+                {
+                    "proxy": self._mask(entry.key[0]),
+                    "impersonate": entry.key[1],
+                    "partition": entry.key[2] or "-",
+                    "in_use": entry.in_use,
+                    "requests": entry.requests,
+                    "idle_seconds": round(time.monotonic() - entry.last_used, 1),
+                }
+                for entry in self._sessions.values()
+            ],
+        }
+
+    @staticmethod
+    def _mask(proxy: Optional[str]) -> str:
+        if not proxy:
+            return "direct"
+        return proxy.split("@")[-1] if "@" in proxy else proxy
+
+
+# 全局实例
+session_pool = SessionPool()
@@ -1,13 +1,15 @@
 """存储抽象层 - 支持文件、MySQL和Redis存储"""
 
 import os
+import time
 import orjson
 import toml
 import asyncio
 import warnings
 import aiofiles
+import portalocker
 from pathlib import Path
-from typing import Dict, Any, Optional, Literal
+from typing import Dict, Any, Iterable, List, Optional, Literal, Tuple
 from abc import ABC, abstractmethod
 from urllib.parse import urlparse, unquote
 
@@ -16,6 +18,15 @@ from app.core.logger import logger
 
 StorageMode = Literal["file", "mysql", "redis"]
 
+# Token日志: 日志大小超过 max(下限, 快照大小) 时触发压缩
+JOURNAL_COMPACT_MIN_BYTES = 256 * 1024
+
+# Token连续失败达到该次数后不再参与选择（Token管理器与Redis索引共用）
+MAX_TOKEN_FAILURES = 3
+
+# 日志游标: (快照签名 (mtime_ns, size, ino), 已读取的日志字节数)
+JournalCursor = Tuple[Optional[Tuple[int, int, int]], int]
+
 
 class BaseStorage(ABC):
     """存储基类"""
@@ -35,6 +46,14 @@ class BaseStorage(ABC):
         """保存token数据"""
         pass
 
+    async def save_token_changes(self, data: Dict[str, Any], changes: Iterable[Tuple[str, str]]) -> None:
+        """保存有变化的token记录 (类型, sso)，默认退化为整体保存"""
+        await self.save_tokens(data)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期命名租约（多进程中只有一个持有者执行的后台任务用），默认总是成功"""
+        return True
+
     @abstractmethod
     async def load_config(self) -> Dict[str, Any]:
         """加载配置数据"""
@@ -47,14 +66,25 @@ class BaseStorage(ABC):
 
 
 class FileStorage(BaseStorage):
-    """文件存储"""
+    """文件存储
+
+    Token 采用 快照(`token.json`) + 追加日志(`token.journal`) 的方式持久化：
+    - 批量保存只把变化的记录以 JSON 行追加到日志并 fsync，成本与变化量成正比
+    - 日志超过阈值后在后台线程压缩：快照 + 日志 重放后写入临时文件，原子替换快照并清空日志
+    - 加载时读取快照并重放日志；日志末尾不完整的行（写入中途崩溃）会被忽略
+    - 追加/压缩/读取均持有日志文件的进程锁，多进程共享同一数据目录时保持一致
+    - 每条日志记录写入方标识，增量读取时可跳过本实例自己写入的记录
+    """
 
     def __init__(self, data_dir: Path):
         self.data_dir = data_dir
         self.token_file = data_dir / "token.json"
+        self.token_journal = data_dir / "token.journal"
         self.config_file = data_dir / "setting.toml"
         self._token_lock = asyncio.Lock()
         self._config_lock = asyncio.Lock()
+        self._compact_task: Optional[asyncio.Task] = None
+        self.writer_id = f"{os.getpid()}-{os.urandom(4).hex()}"  # 日志写入方标识
 
     async def init_db(self) -> None:
         """初始化文件存储"""
@@ -123,12 +153,199 @@ class FileStorage(BaseStorage):
             raise
 
     async def load_tokens(self) -> Dict[str, Any]:
-        """加载token"""
-        return await self._load_json(self.token_file, {"sso": {}, "ssoSuper": {}}, self._token_lock)
+        """加载token（快照 + 日志重放）"""
+        data, _, _ = await self.read_token_changes(None)
+        return data
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token"""
-        await self._save_json(self.token_file, data, self._token_lock)
+        """保存token（整体写入快照并清空日志）"""
+        content = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        try:
+            async with self._token_lock:
+                await asyncio.to_thread(self._replace_snapshot, content)
+        except Exception as e:
+            logger.error(f"[Storage] 保存{self.token_file.name}失败: {e}")
+            raise
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: Iterable[Tuple[str, str]]) -> None:
+        """把变化的记录追加到日志（一次写入 + fsync）"""
+        lines = [
+            orjson.dumps({"t": token_type, "s": sso, "d": (data.get(token_type) or {}).get(sso), "w": self.writer_id})
+            for token_type, sso in changes
+        ]
+        if not lines:
+            return
+        try:
+            async with self._token_lock:
+                journal_size = await asyncio.to_thread(self._append_journal, b"\n".join(lines) + b"\n")
+        except Exception as e:
+            logger.error(f"[Storage] 写入{self.token_journal.name}失败: {e}")
+            raise
+
+        if journal_size > max(JOURNAL_COMPACT_MIN_BYTES, self._file_size(self.token_file)):
+            if self._compact_task is None or self._compact_task.done():
+                self._compact_task = asyncio.create_task(self.compact_tokens())
+
+    async def compact_tokens(self) -> None:
+        """压缩日志到快照（后台线程执行）"""
+        try:
+            async with self._token_lock:
+                count = await asyncio.to_thread(self._compact_sync)
+            logger.info(f"[Storage] Token日志已压缩: 合并 {count} 条记录")
+        except Exception as e:
+            logger.warning(f"[Storage] Token日志压缩失败: {e}")
+
+    async def read_token_changes(self, cursor: Optional[JournalCursor], skip_own: bool = False) -> Tuple[Optional[Dict[str, Any]], List[Tuple[str, str, Optional[Dict]]], JournalCursor]:
+        """读取自游标以来的变化
+
+        Args:
+            cursor: 上次返回的游标，为空时读取完整数据
+            skip_own: 增量记录中跳过本实例写入的记录（完整数据不受影响）
+
+        Returns:
+            (完整数据, 增量记录, 新游标)：游标为空、快照被替换或日志被截断时返回完整数据，否则返回增量记录
+        """
+        return await asyncio.to_thread(self._read_changes_sync, cursor, self.writer_id if skip_own else None)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期命名租约：租约文件记录持有者与到期时间，已过期或属于自己时写入新的到期时间"""
+        return await asyncio.to_thread(self._acquire_lease_sync, self.data_dir / f"{name}.lease", owner, ttl)
+
+    # === Token日志（同步实现，在线程中执行） ===
+
+    @staticmethod
+    def _file_size(path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _snapshot_sig(path: Path) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = path.stat()
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    @staticmethod
+    def _parse_journal(content: bytes, skip_writer: Optional[str] = None) -> List[Tuple[str, str, Optional[Dict]]]:
+        """解析日志行，忽略不完整/损坏的行以及 skip_writer 写入的行"""
+        entries = []
+        for line in content.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                item = orjson.loads(line)
+                if skip_writer is not None and item.get("w") == skip_writer:
+                    continue
+                entries.append((item["t"], item["s"], item["d"]))
+            except (ValueError, KeyError, TypeError):
+                logger.warning("[Storage] 忽略损坏的Token日志行")
+        return entries
+
+    @staticmethod
+    def _replay(data: Dict[str, Any], entries: List[Tuple[str, str, Optional[Dict]]]) -> Dict[str, Any]:
+        for token_type, sso, record in entries:
+            tokens = data.setdefault(token_type, {})
+            if record is None:
+                tokens.pop(sso, None)
+            else:
+                tokens[sso] = record
+        return data
+
+    def _load_locked(self, journal) -> Dict[str, Any]:
+        """读取快照并重放日志（调用方持有日志锁）"""
+        data: Dict[str, Any] = {"sso": {}, "ssoSuper": {}}
+        if self.token_file.exists():
+            data = orjson.loads(self.token_file.read_bytes())
+        journal.seek(0)
+        return self._replay(data, self._parse_journal(journal.read()))
+
+    def _write_snapshot(self, content: bytes) -> None:
+        """原子写入快照：临时文件 + fsync + rename"""
+        tmp = self.token_file.with_suffix(".json.tmp")
+        with open(tmp, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.token_file)
+
+    def _replace_snapshot(self, content: bytes) -> None:
+        with open(self.token_journal, "a+b") as journal:
+            portalocker.lock(journal, portalocker.LOCK_EX)
+            try:
+                self._write_snapshot(content)
+                journal.truncate(0)
+            finally:
+                portalocker.unlock(journal)
+
+    def _append_journal(self, payload: bytes) -> int:
+        with open(self.token_journal, "a+b") as journal:
+            portalocker.lock(journal, portalocker.LOCK_EX)
+            try:
+                # 崩溃残留的半行没有换行符：先补换行，避免新记录拼接到损坏行上一并被丢弃
+                if os.fstat(journal.fileno()).st_size:
+                    journal.seek(-1, os.SEEK_END)
+                    if journal.read(1) != b"\n":
+                        payload = b"\n" + payload
+                journal.write(payload)
+                journal.flush()
+                os.fsync(journal.fileno())
+                return journal.tell()
+            finally:
+                portalocker.unlock(journal)
+
+    def _compact_sync(self) -> int:
+        with open(self.token_journal, "a+b") as journal:
+            portalocker.lock(journal, portalocker.LOCK_EX)
+            try:
+                journal.seek(0)
+                entries = self._parse_journal(journal.read())
+                if not entries:
+                    return 0
+                data = orjson.loads(self.token_file.read_bytes()) if self.token_file.exists() else {"sso": {}, "ssoSuper": {}}
+                self._write_snapshot(orjson.dumps(self._replay(data, entries), option=orjson.OPT_INDENT_2))
+                journal.truncate(0)
+                return len(entries)
+            finally:
+                portalocker.unlock(journal)
+
+    @staticmethod
+    def _acquire_lease_sync(path: Path, owner: str, ttl: float) -> bool:
+        with open(path, "a+b") as f:
+            portalocker.lock(f, portalocker.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    current = orjson.loads(f.read())
+                except ValueError:
+                    current = {}
+                now = time.time()
+                if current.get("owner") not in (None, owner) and current.get("expires", 0) > now:
+                    return False
+                f.seek(0)
+                f.truncate(0)
+                f.write(orjson.dumps({"owner": owner, "expires": now + ttl}))
+                f.flush()
+                return True
+            finally:
+                portalocker.unlock(f)
+
+    def _read_changes_sync(self, cursor: Optional[JournalCursor], skip_writer: Optional[str] = None):
+        with open(self.token_journal, "a+b") as journal:
+            portalocker.lock(journal, portalocker.LOCK_SH)
+            try:
+                snapshot = self._snapshot_sig(self.token_file)
+                size = os.fstat(journal.fileno()).st_size
+                if cursor is None or cursor[0] != snapshot or size < cursor[1]:
+                    return self._load_locked(journal), [], (snapshot, size)
+                if size == cursor[1]:
+                    return None, [], cursor
+                journal.seek(cursor[1])
+                return None, self._parse_journal(journal.read(size - cursor[1]), skip_writer), (snapshot, size)
+            finally:
+                portalocker.unlock(journal)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
@@ -140,7 +357,25 @@ class FileStorage(BaseStorage):
 
 
 class MysqlStorage(BaseStorage):
-    """MySQL存储"""
+    """MySQL存储
+
+    Token 以每个SSO一行的形式保存在 `grok_token` 表，保存时只对变化的记录批量执行
+    `INSERT ... ON DUPLICATE KEY UPDATE` / `DELETE`，写入量与变化量成正比。
+    首次启动时自动从旧的 `grok_tokens` 整体JSON表迁移。
+    """
+
+    TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+    BATCH_SIZE = 500
+    _COLUMNS = (
+        "token_type", "sso", "created_time", "remaining_queries", "heavy_remaining_queries",
+        "status", "failed_count", "last_failure_time", "last_failure_reason", "tags", "note",
+    )
+    _UPSERT_SQL = (
+        f"INSERT INTO grok_token ({', '.join(_COLUMNS)}) VALUES ({', '.join(['%s'] * len(_COLUMNS))}) "
+        "ON DUPLICATE KEY UPDATE "
+        + ", ".join(f"{c} = VALUES({c})" for c in _COLUMNS[2:])
+    )
+    _DELETE_SQL = "DELETE FROM grok_token WHERE token_type = %s AND sso = %s"
 
     def __init__(self, database_url: str, data_dir: Path):
         self.database_url = database_url
@@ -207,6 +442,26 @@ class MysqlStorage(BaseStorage):
     async def _create_tables(self) -> None:
         """创建表"""
         tables = {
+            "grok_token": """
+                CREATE TABLE IF NOT EXISTS grok_token (
+                    token_type VARCHAR(16) NOT NULL,
+                    sso VARCHAR(512) NOT NULL,
+                    created_time BIGINT NOT NULL DEFAULT 0,
+                    remaining_queries INT NOT NULL DEFAULT -1,
+                    heavy_remaining_queries INT NOT NULL DEFAULT -1,
+                    status VARCHAR(16) NOT NULL DEFAULT 'active',
+                    failed_count INT NOT NULL DEFAULT 0,
+                    last_failure_time BIGINT NULL,
+                    last_failure_reason TEXT NULL,
+                    tags JSON NULL,
+                    note TEXT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    PRIMARY KEY (token_type, sso),
+                    KEY idx_select (token_type, status, remaining_queries),
+                    KEY idx_heavy (token_type, status, heavy_remaining_queries)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """,
+            # 旧版整体JSON表，仅用于迁移
             "grok_tokens": """
                 CREATE TABLE IF NOT EXISTS grok_tokens (
                     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -236,22 +491,105 @@ class MysqlStorage(BaseStorage):
     async def _sync_data(self) -> None:
         """同步数据"""
         try:
-            for table, key in [("grok_tokens", "sso"), ("grok_settings", "global")]:
-                data = await self._load_db(table)
-                if data:
-                    if table == "grok_tokens":
-                        await self._file.save_tokens(data)
-                    else:
-                        await self._file.save_config(data)
-                    logger.info(f"[Storage] {table.split('_')[1]}数据已从DB同步")
-                else:
-                    file_data = await (self._file.load_tokens() if table == "grok_tokens" else self._file.load_config())
-                    if file_data.get(key) or (table == "grok_tokens" and file_data.get("ssoSuper")):
-                        await self._save_db(table, file_data)
-                        logger.info(f"[Storage] {table.split('_')[1]}数据已初始化到DB")
+            await self._sync_tokens()
+
+            data = await self._load_db("grok_settings")
+            if data:
+                await self._file.save_config(data)
+                logger.info("[Storage] settings数据已从DB同步")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global"):
+                    await self._save_db("grok_settings", file_data)
+                    logger.info("[Storage] settings数据已初始化到DB")
         except Exception as e:
             logger.warning(f"[Storage] 同步失败: {e}")
 
+    async def _sync_tokens(self) -> None:
+        """Token表有数据则同步到本地文件，否则从旧JSON表或本地文件迁移"""
+        data = await self._load_token_rows()
+        if any(data.values()):
+            await self._file.save_tokens(data)
+            logger.info("[Storage] tokens数据已从DB同步")
+            return
+
+        data = await self._load_db("grok_tokens")
+        source = "grok_tokens"
+        if not data:
+            data, source = await self._file.load_tokens(), "本地文件"
+        changes = [(t, sso) for t in self.TOKEN_TYPES for sso in (data.get(t) or {})]
+        if changes:
+            await self._write_token_rows(data, changes)
+            await self._file.save_tokens(data)
+            logger.info(f"[Storage] tokens数据已迁移为逐行存储: {len(changes)} 条（来源: {source}）")
+
+    # === Token行读写 ===
+
+    @classmethod
+    def _to_row(cls, token_type: str, sso: str, data: Dict[str, Any]) -> Tuple:
+        """记录 -> 行"""
+        return (
+            token_type, sso,
+            int(data.get("createdTime") or 0),
+            int(data.get("remainingQueries", -1)),
+            int(data.get("heavyremainingQueries", -1)),
+            data.get("status") or "active",
+            int(data.get("failedCount") or 0),
+            data.get("lastFailureTime"),
+            data.get("lastFailureReason"),
+            orjson.dumps(data.get("tags") or []).decode(),
+            data.get("note") or "",
+        )
+
+    @staticmethod
+    def _from_row(row: Tuple) -> Dict[str, Any]:
+        """行 -> 记录"""
+        tags = row[9]
+        return {
+            "createdTime": row[2],
+            "remainingQueries": row[3],
+            "heavyremainingQueries": row[4],
+            "status": row[5],
+            "failedCount": row[6],
+            "lastFailureTime": row[7],
+            "lastFailureReason": row[8],
+            "tags": orjson.loads(tags) if tags else [],
+            "note": row[10] or "",
+        }
+
+    async def _load_token_rows(self) -> Dict[str, Any]:
+        """从Token表加载全部记录（按加入时间）"""
+        data: Dict[str, Any] = {t: {} for t in self.TOKEN_TYPES}
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    f"SELECT {', '.join(self._COLUMNS)} FROM grok_token ORDER BY created_time, sso"
+                )
+                for row in await cursor.fetchall():
+                    data.setdefault(row[0], {})[row[1]] = self._from_row(row)
+        return data
+
+    async def _write_token_rows(self, data: Dict[str, Any], changes: Iterable[Tuple[str, str]]) -> None:
+        """批量写入变化的记录（存在则更新，已删除则删除行）"""
+        upserts, deletes = [], []
+        for token_type, sso in changes:
+            record = (data.get(token_type) or {}).get(sso)
+            if record is None:
+                deletes.append((token_type, sso))
+            else:
+                upserts.append(self._to_row(token_type, sso, record))
+
+        try:
+            async with self._pool.acquire() as conn:
+                async with conn.cursor() as cursor:
+                    for i in range(0, len(upserts), self.BATCH_SIZE):
+                        await cursor.executemany(self._UPSERT_SQL, upserts[i:i + self.BATCH_SIZE])
+                    for i in range(0, len(deletes), self.BATCH_SIZE):
+                        await cursor.executemany(self._DELETE_SQL, deletes[i:i + self.BATCH_SIZE])
+        except Exception as e:
+            logger.error(f"[Storage] 保存grok_token失败: {e}")
+            raise
+
     async def _load_db(self, table: str) -> Optional[Dict]:
         """从DB加载"""
         try:
@@ -286,9 +624,30 @@ class MysqlStorage(BaseStorage):
         return await self._file.load_tokens()
 
     async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token"""
+        """保存token（整体同步：写入全部记录并删除多余记录）"""
         await self._file.save_tokens(data)
-        await self._save_db("grok_tokens", data)
+        stored = await self._load_token_rows()
+        changes = [(t, sso) for t in self.TOKEN_TYPES for sso in (data.get(t) or {})]
+        changes += [
+            (t, sso) for t, tokens in stored.items() for sso in tokens
+            if sso not in (data.get(t) or {})
+        ]
+        await self._write_token_rows(data, changes)
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: Iterable[Tuple[str, str]]) -> None:
+        """只写入变化的记录"""
+        changes = list(changes)
+        await self._file.save_token_changes(data, changes)
+        if changes:
+            await self._write_token_rows(data, changes)
+
+    async def read_token_changes(self, cursor: Optional[JournalCursor], skip_own: bool = False):
+        """读取本地文件镜像的变化（多进程同步用）"""
+        return await self._file.read_token_changes(cursor, skip_own)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期命名租约（由本地数据目录协调同一主机上的多个进程）"""
+        return await self._file.acquire_lease(name, owner, ttl)
 
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
@@ -307,14 +666,129 @@ class MysqlStorage(BaseStorage):
             logger.info("[Storage] MySQL已关闭")
 
 
+# Redis Token存储 Lua 脚本
+# 脚本访问的键全部通过 KEYS 传入。单个Token的脚本 KEYS = Hash, 加入顺序集合, 两个额度索引（顺序同 _token_keys）。
+# Redis Cluster 下同一脚本的键需落在同一槽位，可把前缀改为带哈希标签的形式（如 `{grok}:`）。
+_LUA_REINDEX = """
+local UNUSED = 1e15
+local function reindex(sso, maxf)
+    local h = redis.call('HMGET', KEYS[1], 'status', 'failedCount', 'remainingQueries', 'heavyremainingQueries')
+    local ok = redis.call('EXISTS', KEYS[1]) == 1 and h[1] ~= 'expired' and (tonumber(h[2]) or 0) < maxf
+    for i = 1, 2 do
+        local idx = KEYS[i + 2]
+        local remaining = tonumber(h[i + 2]) or -1
+        if ok and remaining == -1 then
+            redis.call('ZADD', idx, UNUSED, sso)
+        elseif ok and remaining > 0 then
+            redis.call('ZADD', idx, remaining, sso)
+        else
+            redis.call('ZREM', idx, sso)
+        end
+    end
+end
+"""
+
+# 占用候选Token并预扣额度: ARGV = sso, maxf, field, cost
+# 候选由调用方按额度索引给出，这里再按Hash校验一次；已不可用时修正索引并返回 false
+_LUA_TAKE = _LUA_REINDEX + """
+local sso, maxf, field, cost = ARGV[1], tonumber(ARGV[2]), ARGV[3], tonumber(ARGV[4])
+local h = redis.call('HMGET', KEYS[1], 'status', 'failedCount', field)
+local remaining = tonumber(h[3]) or -1
+if redis.call('EXISTS', KEYS[1]) == 0 or h[1] == 'expired' or (tonumber(h[2]) or 0) >= maxf
+        or (remaining ~= -1 and remaining <= 0) then
+    reindex(sso, maxf)
+    return false
+end
+local taken = 0
+if cost > 0 and remaining > 0 then
+    taken = math.min(cost, remaining)
+    remaining = remaining - taken
+    redis.call('HSET', KEYS[1], field, remaining)
+end
+reindex(sso, maxf)
+return {tostring(remaining), tostring(taken)}
+"""
+
+# 记录失败: ARGV = sso, maxf, status, reason, now_ms
+_LUA_FAIL = _LUA_REINDEX + """
+local sso, maxf, status = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local count = redis.call('HINCRBY', KEYS[1], 'failedCount', 1)
+redis.call('HSET', KEYS[1], 'lastFailureTime', ARGV[5], 'lastFailureReason', ARGV[4])
+if status >= 400 and status < 500 and count >= maxf then
+    redis.call('HSET', KEYS[1], 'status', 'expired')
+end
+reindex(sso, maxf)
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# 退回预扣额度: ARGV = sso, maxf, field, amount（额度未知/已不存在时不退回）
+_LUA_REFUND = _LUA_REINDEX + """
+local sso, maxf = ARGV[1], tonumber(ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+local remaining = tonumber(redis.call('HGET', KEYS[1], ARGV[3])) or -1
+if remaining < 0 then return false end
+redis.call('HINCRBY', KEYS[1], ARGV[3], tonumber(ARGV[4]))
+reindex(sso, maxf)
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# 更新字段: ARGV = sso, maxf, field1, value1, ...
+_LUA_UPDATE = _LUA_REINDEX + """
+local sso, maxf = ARGV[1], tonumber(ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then return false end
+for i = 3, #ARGV, 2 do redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) end
+reindex(sso, maxf)
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# 保存完整记录（新增/重新添加/整体同步）: ARGV = sso, maxf, createdTime, field1, value1, ...
+# 旧记录整体替换，重新添加的Token不会沿用旧的状态与失败计数；单字段修改走 _LUA_UPDATE
+_LUA_SAVE = _LUA_REINDEX + """
+local sso, maxf = ARGV[1], tonumber(ARGV[2])
+local existed = redis.call('DEL', KEYS[1])
+for i = 4, #ARGV, 2 do redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) end
+redis.call('ZADD', KEYS[2], tonumber(ARGV[3]) or 0, sso)
+reindex(sso, maxf)
+return 1 - existed
+"""
+
+# 获取或续期租约: KEYS = 租约键, ARGV = owner, ttl_ms
+_LUA_LEASE = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', tonumber(ARGV[2]))
+return 1
+"""
+
+# 删除记录: ARGV = sso
+_LUA_DELETE = """
+redis.call('DEL', KEYS[1])
+for i = 2, 4 do redis.call('ZREM', KEYS[i], ARGV[1]) end
+return 1
+"""
+
+
 class RedisStorage(BaseStorage):
-    """Redis存储"""
+    """Redis存储
+
+    Token 以每个Token一个Hash的形式保存（`grok:tok:{类型}:{sso}`），并按剩余额度维护有序集合索引
+    （`grok:idx:{类型}:{字段}`）。选择、额度预扣、失败记录均为原子Lua脚本，多进程/多节点共享同一Token池，
+    写入量与变化的记录数成正比。首次启动时自动从旧的 `grok:tokens` 整体JSON迁移。
+    """
+
+    shared_tokens = True  # Token选择与计数由存储端原子完成
+    PREFIX = "grok:"
+    TOKEN_TYPES = ("ssoNormal", "ssoSuper")
+    QUOTA_FIELDS = ("remainingQueries", "heavyremainingQueries")
+    _INT_FIELDS = ("createdTime", "remainingQueries", "heavyremainingQueries", "failedCount")
 
     def __init__(self, redis_url: str, data_dir: Path):
         self.redis_url = redis_url
         self.data_dir = data_dir
         self._redis = None
         self._file = FileStorage(data_dir)
+        self._scripts: Dict[str, Any] = {}
 
     async def init_db(self) -> None:
         """初始化Redis"""
@@ -331,8 +805,10 @@ class RedisStorage(BaseStorage):
             await self._redis.ping()
             logger.info(f"[Storage] Redis连接成功")
 
+            self._register_scripts()
             await self._file.init_db()
             await self._sync_data()
+            await self._migrate_tokens()
 
         except ImportError:
             raise Exception("redis未安装")
@@ -340,29 +816,209 @@ class RedisStorage(BaseStorage):
             logger.error(f"[Storage] Redis初始化失败: {e}")
             raise
 
+    def _register_scripts(self) -> None:
+        """注册Lua脚本（EVALSHA，脚本缓存丢失时自动重新加载）"""
+        for name, source in {
+            "take": _LUA_TAKE,
+            "refund": _LUA_REFUND,
+            "fail": _LUA_FAIL,
+            "update": _LUA_UPDATE,
+            "save": _LUA_SAVE,
+            "delete": _LUA_DELETE,
+            "lease": _LUA_LEASE,
+        }.items():
+            self._scripts[name] = self._redis.register_script(source)
+
     async def _sync_data(self) -> None:
-        """同步数据"""
+        """同步配置数据"""
         try:
-            for key, file_func, key_name in [
-                ("grok:tokens", self._file.load_tokens, "sso"),
-                ("grok:settings", self._file.load_config, "global")
-            ]:
-                data = await self._redis.get(key)
-                if data:
-                    parsed = orjson.loads(data)
-                    if key == "grok:tokens":
-                        await self._file.save_tokens(parsed)
-                    else:
-                        await self._file.save_config(parsed)
-                    logger.info(f"[Storage] {key.split(':')[1]}数据已从Redis同步")
-                else:
-                    file_data = await file_func()
-                    if file_data.get(key_name) or (key == "grok:tokens" and file_data.get("ssoSuper")):
-                        await self._redis.set(key, orjson.dumps(file_data).decode())
-                        logger.info(f"[Storage] {key.split(':')[1]}数据已初始化到Redis")
+            data = await self._redis.get("grok:settings")
+            if data:
+                await self._file.save_config(orjson.loads(data))
+                logger.info("[Storage] settings数据已从Redis同步")
+            else:
+                file_data = await self._file.load_config()
+                if file_data.get("global"):
+                    await self._redis.set("grok:settings", orjson.dumps(file_data).decode())
+                    logger.info("[Storage] settings数据已初始化到Redis")
         except Exception as e:
             logger.warning(f"[Storage] 同步失败: {e}")
 
+    async def _migrate_tokens(self) -> None:
+        """首次启动时把旧的整体JSON（或本地文件）迁移为逐Token的Hash"""
+        meta = f"{self.PREFIX}tok:meta"
+        if await self._redis.exists(meta):
+            return
+
+        # 多进程同时启动时只由一个进程迁移，其余等待完成
+        lock = f"{self.PREFIX}tok:migrating"
+        if not await self._redis.set(lock, "1", nx=True, ex=60):
+            for _ in range(300):
+                await asyncio.sleep(0.2)
+                if await self._redis.exists(meta):
+                    return
+            logger.warning("[Storage] 等待Token迁移超时")
+            return
+
+        try:
+            blob = await self._redis.get("grok:tokens")
+            data = orjson.loads(blob) if blob else await self._file.load_tokens()
+            changes = [(t, sso) for t in self.TOKEN_TYPES for sso in (data.get(t) or {})]
+            await self.save_token_changes(data, changes)
+            await self._redis.hset(meta, mapping={"version": 1, "migratedAt": int(time.time() * 1000)})
+            logger.info(f"[Storage] Token数据已迁移为逐条存储: {len(changes)} 条（来源: {'grok:tokens' if blob else '本地文件'}）")
+        finally:
+            await self._redis.delete(lock)
+
+    def _token_keys(self, token_type: str, sso: str) -> List[str]:
+        """单个Token的脚本KEYS: Hash, 加入顺序集合, 各额度索引"""
+        return [
+            f"{self.PREFIX}tok:{token_type}:{sso}",
+            f"{self.PREFIX}toks:{token_type}",
+            *(f"{self.PREFIX}idx:{token_type}:{field}" for field in self.QUOTA_FIELDS),
+        ]
+
+    # === Token编解码 ===
+
+    @classmethod
+    def _encode_token(cls, data: Dict[str, Any]) -> List[str]:
+        """记录 -> Hash字段（扁平列表）"""
+        pairs: List[str] = []
+        for field, value in data.items():
+            if field == "tags":
+                value = orjson.dumps(value or []).decode()
+            elif value is None:
+                value = ""
+            pairs += [field, str(value)]
+        return pairs
+
+    @classmethod
+    def _decode_token(cls, raw: Any) -> Optional[Dict[str, Any]]:
+        """Hash字段 -> 记录"""
+        if not raw:
+            return None
+        if isinstance(raw, list):
+            raw = dict(zip(raw[::2], raw[1::2]))
+        data: Dict[str, Any] = {}
+        for field, value in raw.items():
+            if field in cls._INT_FIELDS:
+                data[field] = int(value) if value not in ("", None) else -1
+            elif field == "lastFailureTime":
+                data[field] = int(value) if value else None
+            elif field == "lastFailureReason":
+                data[field] = value or None
+            elif field == "tags":
+                data[field] = orjson.loads(value) if value else []
+            else:
+                data[field] = value
+        return data
+
+    # === Token读写 ===
+
+    async def load_tokens(self) -> Dict[str, Any]:
+        """加载token（按加入顺序）"""
+        result: Dict[str, Any] = {t: {} for t in self.TOKEN_TYPES}
+        for token_type in self.TOKEN_TYPES:
+            ssos = await self._redis.zrange(f"{self.PREFIX}toks:{token_type}", 0, -1)
+            for i in range(0, len(ssos), 500):
+                chunk = ssos[i:i + 500]
+                pipe = self._redis.pipeline(transaction=False)
+                for sso in chunk:
+                    pipe.hgetall(f"{self.PREFIX}tok:{token_type}:{sso}")
+                for sso, raw in zip(chunk, await pipe.execute()):
+                    data = self._decode_token(raw)
+                    if data is not None:
+                        result[token_type][sso] = data
+        return result
+
+    async def save_tokens(self, data: Dict[str, Any]) -> None:
+        """保存token（整体同步：写入全部记录并删除多余记录）"""
+        changes = [(t, sso) for t in self.TOKEN_TYPES for sso in (data.get(t) or {})]
+        for token_type in self.TOKEN_TYPES:
+            stored = await self._redis.zrange(f"{self.PREFIX}toks:{token_type}", 0, -1)
+            changes += [(token_type, sso) for sso in stored if sso not in (data.get(token_type) or {})]
+        await self.save_token_changes(data, changes)
+
+    async def save_token_changes(self, data: Dict[str, Any], changes: Iterable[Tuple[str, str]]) -> None:
+        """只写入变化的记录"""
+        changes = list(changes)
+        try:
+            for i in range(0, len(changes), 500):
+                pipe = self._redis.pipeline(transaction=False)
+                for token_type, sso in changes[i:i + 500]:
+                    record = (data.get(token_type) or {}).get(sso)
+                    if record is None:
+                        await self._scripts["delete"](
+                            keys=self._token_keys(token_type, sso), args=[sso], client=pipe
+                        )
+                    else:
+                        await self._scripts["save"](
+                            keys=self._token_keys(token_type, sso),
+                            args=[sso, MAX_TOKEN_FAILURES, record.get("createdTime", 0), *self._encode_token(record)],
+                            client=pipe,
+                        )
+                await pipe.execute()
+        except Exception as e:
+            logger.error(f"[Storage] 保存Redis失败: {e}")
+            raise
+
+    async def select_token(self, token_types: List[str], field: str, exclude: Iterable[str] = (),
+                           cost: int = 1) -> Optional[Tuple[str, str, int, int]]:
+        """选择Token并原子预扣额度，返回 (类型, sso, 剩余次数, 实际预扣量)
+
+        按额度索引从高到低取候选，再逐个用脚本校验并预扣；候选在此期间被其他进程用完时跳过继续。
+        """
+        skip = set(exclude)
+        for token_type in token_types:
+            idx = f"{self.PREFIX}idx:{token_type}:{field}"
+            start = 0
+            while True:
+                batch = await self._redis.zrevrange(idx, start, start + 31)
+                if not batch:
+                    break
+                for sso in batch:
+                    if sso in skip:
+                        continue
+                    result = await self._scripts["take"](
+                        keys=self._token_keys(token_type, sso), args=[sso, MAX_TOKEN_FAILURES, field, cost]
+                    )
+                    if result:
+                        return token_type, sso, int(result[0]), int(result[1])
+                start += 32
+        return None
+
+    async def refund_token(self, token_type: str, sso: str, field: str, amount: int,
+                           max_failures: int) -> Optional[Dict[str, Any]]:
+        """原子退回预扣额度（HINCRBY），返回最新记录"""
+        raw = await self._scripts["refund"](
+            keys=self._token_keys(token_type, sso), args=[sso, max_failures, field, amount]
+        )
+        return self._decode_token(raw)
+
+    async def record_token_failure(self, token_type: str, sso: str, status: int, reason: str,
+                                   max_failures: int) -> Optional[Dict[str, Any]]:
+        """原子记录失败，返回最新记录"""
+        raw = await self._scripts["fail"](
+            keys=self._token_keys(token_type, sso),
+            args=[sso, max_failures, status, reason, int(time.time() * 1000)],
+        )
+        return self._decode_token(raw)
+
+    async def update_token(self, token_type: str, sso: str, fields: Dict[str, Any],
+                           max_failures: int) -> Optional[Dict[str, Any]]:
+        """原子更新字段并重建索引，返回最新记录"""
+        raw = await self._scripts["update"](
+            keys=self._token_keys(token_type, sso), args=[sso, max_failures, *self._encode_token(fields)]
+        )
+        return self._decode_token(raw)
+
+    async def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """获取或续期命名租约（`grok:lease:{名称}`，过期自动释放）"""
+        result = await self._scripts["lease"](
+            keys=[f"{self.PREFIX}lease:{name}"], args=[owner, max(1, int(ttl * 1000))]
+        )
+        return bool(result)
+
     async def _save_redis(self, key: str, data: Dict) -> None:
         """保存到Redis"""
         try:
@@ -371,15 +1027,6 @@ class RedisStorage(BaseStorage):
             logger.error(f"[Storage] 保存Redis失败: {e}")
             raise
 
-    async def load_tokens(self) -> Dict[str, Any]:
-        """加载token"""
-        return await self._file.load_tokens()
-
-    async def save_tokens(self, data: Dict[str, Any]) -> None:
-        """保存token"""
-        await self._file.save_tokens(data)
-        await self._save_redis("grok:tokens", data)
-
     async def load_config(self) -> Dict[str, Any]:
         """加载配置"""
         return await self._file.load_config()
@@ -10,6 +10,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-3", "MODEL_MODE_FAST"),
         "rate_limit_model": "grok-3",
         "cost": {"type": "low_cost", "multiplier": 1, "description": "计1次调用"},
+        "bulkhead": "fast",
         "requires_super": False,
         "display_name": "Grok 3 Fast",
         "description": "Fast and efficient Grok 3 model",
@@ -23,6 +24,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4-mini-thinking-tahoe", "MODEL_MODE_GROK_4_MINI_THINKING"),
         "rate_limit_model": "grok-4-mini-thinking-tahoe",
         "cost": {"type": "low_cost", "multiplier": 1, "description": "计1次调用"},
+        "bulkhead": "fast",
         "requires_super": False,
         "display_name": "Grok 4 Fast",
         "description": "Fast version of Grok 4 with mini thinking capabilities",
@@ -36,6 +38,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4-mini-thinking-tahoe", "MODEL_MODE_EXPERT"),
         "rate_limit_model": "grok-4-mini-thinking-tahoe",
         "cost": {"type": "high_cost", "multiplier": 4, "description": "计4次调用"},
+        "bulkhead": "expert",
         "requires_super": False,
         "display_name": "Grok 4 Fast Expert",
         "description": "Expert mode of Grok 4 Fast with enhanced reasoning",
@@ -49,6 +52,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4", "MODEL_MODE_EXPERT"),
         "rate_limit_model": "grok-4",
         "cost": {"type": "high_cost", "multiplier": 4, "description": "计4次调用"},
+        "bulkhead": "expert",
         "requires_super": False,
         "display_name": "Grok 4 Expert",
         "description": "Full Grok 4 model with expert mode capabilities",
@@ -62,6 +66,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4-heavy", "MODEL_MODE_HEAVY"),
         "rate_limit_model": "grok-4-heavy",
         "cost": {"type": "independent", "multiplier": 1, "description": "独立计费，只有Super用户可用"},
+        "bulkhead": "heavy",
         "requires_super": True,
         "display_name": "Grok 4 Heavy",
         "description": "Most powerful Grok 4 model with heavy computational capabilities. Requires Super Token for access.",
@@ -75,6 +80,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4-1-non-thinking-w-tool", "MODEL_MODE_GROK_4_1"),
         "rate_limit_model": "grok-4-1-non-thinking-w-tool",
         "cost": {"type": "low_cost", "multiplier": 1, "description": "计1次调用"},
+        "bulkhead": "fast",
         "requires_super": False,
         "display_name": "Grok 4.1",
         "description": "Latest Grok 4.1 model with tool capabilities",
@@ -88,6 +94,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-4-1-thinking-1108b", "MODEL_MODE_AUTO"),
         "rate_limit_model": "grok-4-1-thinking-1108b",
         "cost": {"type": "high_cost", "multiplier": 1, "description": "计1次调用"},
+        "bulkhead": "expert",
         "requires_super": False,
         "display_name": "Grok 4.1 Thinking",
         "description": "Grok 4.1 model with advanced thinking and tool capabilities",
@@ -101,6 +108,7 @@ _MODEL_CONFIG: Dict[str, Dict[str, Any]] = {
         "grok_model": ("grok-3", "MODEL_MODE_FAST"),
         "rate_limit_model": "grok-3",
         "cost": {"type": "low_cost", "multiplier": 1, "description": "计1次调用"},
+        "bulkhead": "video",
         "requires_super": False,
         "display_name": "Grok Imagine 0.9",
         "description": "Image and video generation model. Supports text-to-image and image-to-video generation.",
@@ -136,6 +144,18 @@ class Models(Enum):
         """获取模型配置"""
         return _MODEL_CONFIG.get(model, {})
 
+    @classmethod
+    def get_bulkhead(cls, model: str) -> str:
+        """模型所属的并发隔离舱（fast/expert/heavy/video）"""
+        config = _MODEL_CONFIG.get(model)
+        return config.get("bulkhead", "fast") if config else "fast"
+
+    @classmethod
+    def get_cost(cls, model: str) -> int:
+        """单次调用消耗的额度（计费倍率）"""
+        config = _MODEL_CONFIG.get(model)
+        return int(config["cost"].get("multiplier", 1)) if config else 1
+
     @classmethod
     def is_valid_model(cls, model: str) -> bool:
         """检查模型是否有效"""
@@ -2,13 +2,17 @@
 
 import asyncio
 import base64
+import aiofiles
+from contextlib import aclosing
 from pathlib import Path
-from typing import Optional, Tuple
-from curl_cffi.requests import AsyncSession
+from typing import AsyncGenerator, AsyncIterator, Optional, Tuple
 
 from app.core.config import setting
 from app.core.logger import logger
+from app.core.retry import retry_engine
+from app.core.session_pool import session_pool
 from app.services.grok.statsig import get_dynamic_headers
+from app.services.grok.stream import UpstreamStream
 
 
 # 常量定义
@@ -17,7 +21,10 @@ MIME_TYPES = {
     '.gif': 'image/gif', '.webp': 'image/webp', '.bmp': 'image/bmp',
 }
 DEFAULT_MIME = 'image/jpeg'
+BASE64_BLOCK = 6144  # 流式 base64 每块编码的字节数（3 的倍数，编码后 8KB）
+CACHE_READ_BLOCK = BASE64_BLOCK * 16  # 读取缓存文件的块大小（在线程池中读取，块大些以减少切换）
 ASSETS_URL = "https://assets.grok.com"
+BROWSER = "chrome133a"
 
 
 class CacheService:
@@ -53,90 +60,48 @@ class CacheService:
             "Cookie": f"{auth_token};{cf}" if cf else auth_token
         }
 
-    async def download(self, file_path: str, auth_token: str, timeout: Optional[float] = None) -> Optional[Path]:
+    async def download(self, file_path: str, auth_token: str) -> Optional[Path]:
         """下载并缓存文件"""
         cache_path = self._get_path(file_path)
         if cache_path.exists():
             self._log("debug", "文件已缓存")
             return cache_path
 
-        # 外层重试：可配置状态码（401/429等）
-        retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
-        MAX_OUTER_RETRY = 3
-        
-        for outer_retry in range(MAX_OUTER_RETRY + 1):  # +1 确保实际重试3次
-            try:
-                # 内层重试：403代理池重试（cache使用缓存代理，不支持代理池，所以403只重试一次）
-                max_403_retries = 5
-                retry_403_count = 0
-                
-                while retry_403_count <= max_403_retries:
-                    proxy = await setting.get_proxy_async("cache")
-                    proxies = {"http": proxy, "https": proxy} if proxy else {}
-                    
-                    if proxy and outer_retry == 0 and retry_403_count == 0:
-                        self._log("debug", f"使用代理: {proxy.split('@')[-1] if '@' in proxy else proxy}")
-
-                    async with AsyncSession() as session:
-                        url = f"{ASSETS_URL}{file_path}"
-                        if outer_retry == 0 and retry_403_count == 0:
-                            self._log("debug", f"下载: {url}")
-                        
-                        response = await session.get(
-                            url,
-                            headers=self._build_headers(file_path, auth_token),
-                            proxies=proxies,
-                            timeout=timeout or self.timeout,
-                            allow_redirects=True,
-                            impersonate="chrome133a"
-                        )
-                        
-                        # 检查403错误 - 内层重试(cache不使用代理池，所以直接失败)
-                        if response.status_code == 403:
-                            retry_403_count += 1
-                            
-                            if retry_403_count <= max_403_retries:
-                                self._log("warning", f"遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})...")
-                                await asyncio.sleep(0.5)
-                                continue
-                            
-                            self._log("error", f"403错误，已重试{retry_403_count-1}次，放弃")
-                            return None
-                        
-                        # 检查可配置状态码错误 - 外层重试
-                        if response.status_code in retry_codes:
-                            if outer_retry < MAX_OUTER_RETRY:
-                                delay = (outer_retry + 1) * 0.1  # 渐进延迟：0.1s, 0.2s, 0.3s
-                                self._log("warning", f"遇到{response.status_code}错误，外层重试 ({outer_retry+1}/{MAX_OUTER_RETRY})，等待{delay}s...")
-                                await asyncio.sleep(delay)
-                                break  # 跳出内层循环，进入外层重试
-                            else:
-                                self._log("error", f"{response.status_code}错误，已重试{outer_retry}次，放弃")
-                                return None
-                        
-                        response.raise_for_status()
-                        
-                        cache_path.write_bytes(response.content)
-                        
-                        if outer_retry > 0 or retry_403_count > 0:
-                            self._log("info", f"重试成功！")
-                        else:
-                            self._log("debug", "缓存成功")
-                        
-                        # 异步清理（带错误处理）
-                        asyncio.create_task(self._safe_cleanup())
-                        return cache_path
-                        
-            except Exception as e:
-                if outer_retry < MAX_OUTER_RETRY - 1:
-                    self._log("warning", f"下载异常: {e}，外层重试 ({outer_retry+1}/{MAX_OUTER_RETRY})...")
-                    await asyncio.sleep(0.5)
-                    continue
-                
-                self._log("error", f"下载失败: {e}（已重试{outer_retry}次）")
+        url = f"{ASSETS_URL}{file_path}"
+        self._log("debug", f"下载: {url}")
+
+        async def send(proxy: Optional[str]):
+            proxies = {"http": proxy, "https": proxy} if proxy else {}
+            async with session_pool.acquire(proxy, BROWSER) as session:
+                return await session.get(
+                    url,
+                    headers=self._build_headers(file_path, auth_token),
+                    proxies=proxies,
+                    timeout=self.timeout,
+                    allow_redirects=True,
+                    impersonate=BROWSER
+                )
+
+        try:
+            # 缓存使用缓存代理（不走代理池），401/429与网络异常由重试引擎退避重试
+            response = await retry_engine.execute(
+                send, tag=f"{self.cache_type.upper()}Cache", proxy_type="cache", retry_exceptions=True
+            )
+
+            if response.status_code != 200:
+                self._log("error", f"下载失败，状态码: {response.status_code}")
                 return None
-        
-        return None
+
+            cache_path.write_bytes(response.content)
+            self._log("debug", "缓存成功")
+
+            # 异步清理（带错误处理）
+            asyncio.create_task(self._safe_cleanup())
+            return cache_path
+
+        except Exception as e:
+            self._log("error", f"下载失败: {e}")
+            return None
 
     def get_cached(self, file_path: str) -> Optional[Path]:
         """获取已缓存的文件"""
@@ -208,25 +173,81 @@ class ImageCache(CacheService):
             return None
 
     async def download_base64(self, path: str, token: str) -> Optional[str]:
-        """下载并转为base64（自动删除临时文件）"""
+        """下载并转为base64（流式编码，不落盘）"""
         try:
-            cache_path = await self.download(path, token)
-            if not cache_path:
-                return None
-
-            result = self.to_base64(cache_path)
-            
-            # 清理临时文件
-            try:
-                cache_path.unlink()
-            except Exception as e:
-                logger.warning(f"[ImageCache] 删除临时文件失败: {e}")
-
-            return result
+            async with aclosing(self.stream_base64(path, token)) as parts:
+                return "".join([part async for part in parts])
         except Exception as e:
             logger.error(f"[ImageCache] 下载base64失败: {e}")
             return None
 
+    async def stream_base64(self, path: str, token: str) -> AsyncGenerator[str, None]:
+        """流式下载并逐块编码为 base64 data URI
+
+        先产出 "data:<mime>;base64," 头，再按 3 字节对齐逐块产出编码结果（每块约 8KB），
+        不写临时文件，单张图片的内存占用只有一个块。已缓存时直接从缓存文件分块读取。
+        下载失败时在产出任何内容前抛出异常，调用方可回退为上游地址。
+        """
+        mime = MIME_TYPES.get(Path(path).suffix.lower(), DEFAULT_MIME)
+        if cached := self.get_cached(path):
+            chunks, response = self._read_blocks(cached), None
+        else:
+            response = await self._open_stream(path, token)
+            chunks = response.aiter_bytes()
+
+        try:
+            yield f"data:{mime};base64,"
+            carry = b""
+            async for chunk in chunks:
+                data = carry + chunk if carry else chunk
+                aligned = len(data) - len(data) % 3
+                for i in range(0, aligned, BASE64_BLOCK):
+                    yield base64.b64encode(data[i:min(i + BASE64_BLOCK, aligned)]).decode()
+                carry = data[aligned:]
+            if carry:
+                yield base64.b64encode(carry).decode()
+        finally:
+            if response is not None:
+                await response.aclose()
+
+    async def _open_stream(self, path: str, token: str) -> UpstreamStream:
+        """以流式方式请求图片，非 200 时关闭并抛出异常"""
+        url = f"{ASSETS_URL}{path}"
+
+        async def send(proxy: Optional[str]) -> UpstreamStream:
+            proxies = {"http": proxy, "https": proxy} if proxy else {}
+            handle = await session_pool.checkout(proxy, BROWSER)
+            try:
+                response = await handle.session.get(
+                    url,
+                    headers=self._build_headers(path, token),
+                    proxies=proxies,
+                    timeout=self.timeout,
+                    allow_redirects=True,
+                    impersonate=BROWSER,
+                    stream=True
+                )
+            except BaseException:
+                await handle.release()
+                raise
+            return UpstreamStream(response, handle.release)
+
+        response = await retry_engine.execute(
+            send, tag=f"{self.cache_type.upper()}Cache", proxy_type="cache", retry_exceptions=True,
+            discard=UpstreamStream.aclose
+        )
+        if response.status_code != 200:
+            await response.aclose()
+            raise RuntimeError(f"下载失败，状态码: {response.status_code}")
+        return response
+
+    @staticmethod
+    async def _read_blocks(file_path: Path) -> AsyncIterator[bytes]:
+        """分块读取缓存文件（aiofiles，不阻塞事件循环）"""
+        async with aiofiles.open(file_path, "rb") as f:
+            while block := await f.read(CACHE_READ_BLOCK):
+                yield block
+
 
 class VideoCache(CacheService):
     """视频缓存服务"""
@@ -1,19 +1,26 @@
 """Grok API 客户端 - 处理OpenAI到Grok的请求转换和响应处理"""
 
+import time
 import asyncio
 import orjson
-from typing import Dict, List, Tuple, Any, Optional
+from typing import AsyncGenerator, Dict, List, Set, Tuple, Any, Optional
 from curl_cffi import requests as curl_requests
 
 from app.core.config import setting
 from app.core.logger import logger
 from app.models.grok_models import Models
-from app.services.grok.processer import GrokResponseProcessor
+from app.services.grok.processer import FailureFrame, GrokResponseProcessor
 from app.services.grok.statsig import get_dynamic_headers
-from app.services.grok.token import token_manager
+from app.services.grok.token import TokenLease, token_manager
+from app.services.grok.rate_limit import rate_limit_refresher
 from app.services.grok.upload import ImageUploadManager
 from app.services.grok.create import PostCreateManager
+from app.services.grok.stream import UpstreamStream
+from app.services.grok.hedge import hedge_policy, hedged_stream
 from app.core.exception import GrokApiException
+from app.core.retry import retry_engine, retry_scope, parse_retry_after
+from app.core.admission import Permit, admission, bind_permit, bulkheads, note_latency
+from app.core.session_pool import session_pool
 
 
 # 常量
@@ -56,16 +63,63 @@ class GrokClient:
             logger.warning(f"[Client] 视频模型仅支持1张图片，已截取前1张")
             images = images[:1]
         
-        return await GrokClient._retry(model, content, images, grok_model, mode, is_video, stream)
+        # 先进入模型类别的隔离舱，再获取全局准入许可（自适应并发上限），队列满时返回429
+        bulkhead = await bulkheads.get(Models.get_bulkhead(model)).acquire()
+        try:
+            permit = await admission.acquire()
+        except BaseException:
+            bulkhead.release()
+            raise
+        try:
+            # 同一请求内的上传、会话创建、对话与限额查询共享重试预算
+            with retry_scope(), bind_permit(permit):
+                result = await GrokClient._retry(model, content, images, grok_model, mode, is_video, stream)
+        except GrokApiException as e:
+            permit.release(overloaded=e.error_code == "NETWORK_ERROR" or e.details.get("status") in (403, 429))
+            bulkhead.release()
+            raise
+        except BaseException:
+            permit.release()
+            bulkhead.release()
+            raise
+
+        # 延迟样本只取上游响应延迟（不含Token排队/上传）；流式许可持有到流结束
+        if stream:
+            return GrokClient._hold_permit(result, (permit, bulkhead), permit.latency)
+        permit.release(latency=permit.latency)
+        bulkhead.release(latency=permit.latency)
+        return result
+
+    @staticmethod
+    async def _hold_permit(stream: AsyncGenerator, permits: Tuple[Permit, ...], latency: float) -> AsyncGenerator:
+        """转发流式响应，结束或被关闭时归还准入许可与隔离舱名额"""
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            for permit in permits:
+                permit.release(latency=latency)
+            await stream.aclose()
 
     @staticmethod
     async def _retry(model: str, content: str, images: List[str], grok_model: str, mode: str, is_video: bool, stream: bool):
-        """重试请求"""
+        """跨Token故障转移：401/429时立即换用未尝试过的Token重新发送（图片按新Token重新上传）"""
         last_err = None
+        tried: Set[str] = set()
 
         for i in range(MAX_RETRY):
             try:
-                token = token_manager.get_token(model)
+                # 首次选择可排队等待（流式请求优先）；故障转移时不等待，直接返回上游错误
+                lease = await token_manager.acquire(model, exclude=tried, wait=not tried, priority=0 if stream else 1)
+            except GrokApiException as e:
+                # 可用Token已全部尝试过，返回上一次的上游错误
+                if last_err is not None and e.error_code == "NO_AVAILABLE_TOKEN":
+                    raise last_err
+                raise
+            token = lease.token
+            tried.add(lease.sso)
+
+            try:
                 img_ids, img_uris = await GrokClient._upload(images, token)
 
                 # 视频模型创建会话
@@ -74,26 +128,129 @@ class GrokClient:
                     post_id = await GrokClient._create_post(img_ids[0], img_uris[0], token)
 
                 payload = GrokClient._build_payload(content, grok_model, mode, img_ids, img_uris, is_video, post_id)
-                return await GrokClient._request(payload, token, model, stream, post_id)
+                sent = time.monotonic()
+                result = await GrokClient._request(payload, token, model, stream, post_id)
 
             except GrokApiException as e:
+                # 上游未计费，退回预扣额度
+                await lease.refund()
+                lease.release()
+                token_manager.record_error(lease.sso, e.details.get("status") or e.error_code)
                 last_err = e
                 # 检查是否可重试
-                if e.error_code not in ["HTTP_ERROR", "NO_AVAILABLE_TOKEN"]:
+                if e.error_code != "HTTP_ERROR":
                     raise
 
-                status = e.context.get("status") if e.context else None
+                status = e.details.get("status")
                 retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
                 
                 if status not in retry_codes:
                     raise
 
+                # 失败Token进入冷却，避免被其他请求继续选中
+                token_manager.cooldown(token, e.details.get("retry_after"))
                 if i < MAX_RETRY - 1:
-                    logger.warning(f"[Client] 失败(状态:{status}), 重试 {i+1}/{MAX_RETRY}")
-                    await asyncio.sleep(0.5)
+                    logger.warning(f"[Client] 失败(状态:{status})，切换Token重试 {i+1}/{MAX_RETRY}")
+                continue
+            except BaseException:
+                lease.release()
+                raise
+
+            # 租约持有到响应结束：流式在生成器结束/关闭时释放
+            if stream:
+                result = GrokClient._hold_lease(result, lease, sent)
+                # 纯文本对话首包过慢时换用其他Token对冲（带图请求需按Token重新上传，不参与）
+                if not images and not is_video and hedge_policy.eligible(Models.get_bulkhead(model)):
+                    backup = lambda: GrokClient._hedge(model, content, grok_model, mode, tried)
+                    return hedged_stream(result, backup, hedge_policy)
+                return result
+            lease.release()
+            token_manager.record_success(lease.sso, duration=time.monotonic() - sent)
+            return result
 
         raise last_err or GrokApiException("请求失败", "REQUEST_ERROR")
 
+    @staticmethod
+    async def _hedge(model: str, content: str, grok_model: str, mode: str, tried: Set[str]) -> Optional[AsyncGenerator]:
+        """对冲请求：在未尝试过的Token上重发一次，不排队、不重试，失败返回 None
+
+        对冲请求同样占用隔离舱与全局准入名额（不排队，名额不足时放弃对冲），不提供延迟样本。
+        """
+        permits = []
+        for pool in (bulkheads.get(Models.get_bulkhead(model)), admission):
+            permit = pool.try_acquire()
+            if permit is None:
+                for held in permits:
+                    held.release()
+                return None
+            permits.append(permit)
+
+        try:
+            lease = await token_manager.acquire(model, exclude=tried, wait=False)
+        except GrokApiException:
+            for permit in permits:
+                permit.release()
+            return None
+        except BaseException:
+            for permit in permits:
+                permit.release()
+            raise
+        tried.add(lease.sso)
+
+        try:
+            with retry_scope():
+                payload = GrokClient._build_payload(content, grok_model, mode, [], [])
+                sent = time.monotonic()
+                result = await GrokClient._request(payload, lease.token, model, True)
+        except GrokApiException as e:
+            await lease.refund()
+            lease.release()
+            token_manager.record_error(lease.sso, e.details.get("status") or e.error_code)
+            for permit in permits:
+                permit.release()
+            logger.warning(f"[Client] 对冲请求失败: {e}")
+            return None
+        except BaseException:
+            lease.release()
+            for permit in permits:
+                permit.release()
+            raise
+        return GrokClient._hold_permit(GrokClient._hold_lease(result, lease, sent), tuple(permits), None)
+
+    @staticmethod
+    async def _hold_lease(stream: AsyncGenerator, lease: TokenLease, sent: float) -> AsyncGenerator:
+        """转发流式响应，结束、出错或被提前关闭时释放Token租约
+
+        产出正常内容后正常结束才记录成功（首包延迟/总耗时）；流内出现失败帧（超时/上游错误）
+        或没有任何内容时记录失败，失败帧不计入首包延迟。
+        """
+        ttfb = None
+        failure = None
+        finished = False
+        try:
+            async for chunk in stream:
+                if failure is None:
+                    if isinstance(chunk, FailureFrame):
+                        failure = chunk.reason
+                    elif ttfb is None:
+                        ttfb = time.monotonic() - sent
+                yield chunk
+            finished = True
+        except Exception as e:
+            failure = failure or getattr(e, "error_code", "STREAM_ERROR")
+            raise
+        finally:
+            # 客户端提前断开（未出现失败）不计入健康度
+            if failure is not None:
+                token_manager.record_error(lease.sso, failure)
+            elif finished:
+                if ttfb is not None:
+                    token_manager.record_success(lease.sso, ttfb, time.monotonic() - sent)
+                else:
+                    token_manager.record_error(lease.sso, "NO_RESPONSE")
+            lease.release()
+            await stream.aclose()
+
     @staticmethod
     def _extract_content(messages: List[Dict]) -> Tuple[str, List[str]]:
         """提取文本和图片"""
@@ -196,102 +353,50 @@ class GrokClient:
         if not token:
             raise GrokApiException("认证令牌缺失", "NO_AUTH_TOKEN")
 
-        # 外层重试：可配置状态码（401/429等）
-        retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
-        MAX_OUTER_RETRY = 3
-        
-        for outer_retry in range(MAX_OUTER_RETRY + 1):  # +1确保实际重试3次
-            # 内层重试：403代理池重试
-            max_403_retries = 5
-            retry_403_count = 0
-            
-            while retry_403_count <= max_403_retries:
-                try:
-                    # 构建请求
-                    headers = GrokClient._build_headers(token)
-                    if model == "grok-imagine-0.9":
-                        file_attachments = payload.get("fileAttachments", [])
-                        ref_id = post_id or (file_attachments[0] if file_attachments else "")
-                        if ref_id:
-                            headers["Referer"] = f"https://grok.com/imagine/{ref_id}"
-                    
-                    # 异步获取代理
-                    from app.core.proxy_pool import proxy_pool
-                    
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
-                        logger.info(f"[Client] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                        proxy = await proxy_pool.force_refresh()
-                    else:
-                        proxy = await setting.get_proxy_async("service")
-                    
-                    proxies = {"http": proxy, "https": proxy} if proxy else None
-                    
-                    # 执行请求
-                    response = await asyncio.to_thread(
-                        curl_requests.post,
-                        API_ENDPOINT,
-                        headers=headers,
-                        data=orjson.dumps(payload),
-                        impersonate=BROWSER,
-                        timeout=TIMEOUT,
-                        stream=True,
-                        proxies=proxies
-                    )
-                    
-                    # 内层403重试：仅当有代理池时触发
-                    if response.status_code == 403 and proxy_pool._enabled:
-                        retry_403_count += 1
-                        
-                        if retry_403_count <= max_403_retries:
-                            logger.warning(f"[Client] 遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})...")
-                            await asyncio.sleep(0.5)
-                            continue
-                        
-                        # 内层重试全部失败
-                        logger.error(f"[Client] 403错误，已重试{retry_403_count-1}次，放弃")
-                    
-                    # 检查可配置状态码错误 - 外层重试
-                    if response.status_code in retry_codes:
-                        if outer_retry < MAX_OUTER_RETRY:
-                            delay = (outer_retry + 1) * 0.1  # 渐进延迟：0.1s, 0.2s, 0.3s
-                            logger.warning(f"[Client] 遇到{response.status_code}错误，外层重试 ({outer_retry+1}/{MAX_OUTER_RETRY})，等待{delay}s...")
-                            await asyncio.sleep(delay)
-                            break  # 跳出内层循环，进入外层重试
-                        else:
-                            logger.error(f"[Client] {response.status_code}错误，已重试{outer_retry}次，放弃")
-                            GrokClient._handle_error(response, token)
-                    
-                    # 检查响应状态
-                    if response.status_code != 200:
-                        GrokClient._handle_error(response, token)
-                    
-                    # 成功 - 重置失败计数
-                    asyncio.create_task(token_manager.reset_failure(token))
-                    
-                    # 如果是重试成功，记录日志
-                    if outer_retry > 0 or retry_403_count > 0:
-                        logger.info(f"[Client] 重试成功！")
-                    
-                    # 处理响应
-                    result = (GrokResponseProcessor.process_stream(response, token) if stream 
-                             else await GrokResponseProcessor.process_normal(response, token, model))
-                    
-                    asyncio.create_task(GrokClient._update_limits(token, model))
-                    return result
-                    
-                except curl_requests.RequestsError as e:
-                    logger.error(f"[Client] 网络错误: {e}")
-                    raise GrokApiException(f"网络错误: {e}", "NETWORK_ERROR") from e
-                except GrokApiException:
-                    # 重新抛出GrokApiException（包括403错误）
-                    raise
-                except Exception as e:
-                    logger.error(f"[Client] 请求错误: {e}")
-                    raise GrokApiException(f"请求错误: {e}", "REQUEST_ERROR") from e
-        
-        # 理论上不应该到这里，但以防万一
-        raise GrokApiException("请求失败：已达到最大重试次数", "MAX_RETRIES_EXCEEDED")
+        started = time.monotonic()
+
+        async def send(proxy: Optional[str]) -> UpstreamStream:
+            nonlocal started
+            started = time.monotonic()
+            # 构建请求（每次尝试重新生成动态请求头）
+            headers = GrokClient._build_headers(token)
+            if model == "grok-imagine-0.9":
+                file_attachments = payload.get("fileAttachments", [])
+                ref_id = post_id or (file_attachments[0] if file_attachments else "")
+                if ref_id:
+                    headers["Referer"] = f"https://grok.com/imagine/{ref_id}"
+
+            # 执行请求（异步流式，读取不阻塞事件循环）
+            return await GrokClient._open_stream(headers, payload, proxy, Models.get_bulkhead(model))
+
+        try:
+            # 401/429 不在同一Token上重试，交由 _retry 切换Token
+            response = await retry_engine.execute(send, tag="Client", retry_codes=(), discard=UpstreamStream.aclose)
+
+            # 检查响应状态
+            if response.status_code != 200:
+                await GrokClient._handle_error(response, token)
+            note_latency(time.monotonic() - started)
+
+            # 成功 - 重置失败计数
+            asyncio.create_task(token_manager.reset_failure(token))
+
+            # 处理响应
+            result = (GrokResponseProcessor.process_stream(response, token) if stream
+                     else await GrokResponseProcessor.process_normal(response, token, model))
+
+            # 限额刷新由调度器合并/节流/抽样
+            rate_limit_refresher.schedule(token, model)
+            return result
+
+        except curl_requests.RequestsError as e:
+            logger.error(f"[Client] 网络错误: {e}")
+            raise GrokApiException(f"网络错误: {e}", "NETWORK_ERROR") from e
+        except GrokApiException:
+            raise
+        except Exception as e:
+            logger.error(f"[Client] 请求错误: {e}")
+            raise GrokApiException(f"请求错误: {e}", "REQUEST_ERROR") from e
 
     @staticmethod
     def _build_headers(token: str) -> Dict[str, str]:
@@ -302,31 +407,51 @@ class GrokClient:
         return headers
 
     @staticmethod
-    def _handle_error(response, token: str):
-        """处理错误"""
-        if response.status_code == 403:
-            msg = "您的IP被拦截，请尝试以下方法之一: 1.更换IP 2.使用代理 3.配置CF值"
-            data = {"cf_blocked": True, "status": 403}
-            logger.warning(f"[Client] {msg}")
-        else:
-            try:
-                data = response.json()
-                msg = str(data)
-            except:
-                data = response.text
-                msg = data[:200] if data else "未知错误"
+    async def _open_stream(headers: Dict[str, str], payload: dict, proxy: Optional[str], partition: str = "") -> UpstreamStream:
+        """发起流式请求，返回非阻塞的上游流（会话来自共享会话池，按模型类别分区，流关闭时归还）"""
+        proxies = {"http": proxy, "https": proxy} if proxy else None
+        handle = await session_pool.checkout(proxy, BROWSER, partition)
+        try:
+            response = await handle.session.post(
+                API_ENDPOINT,
+                headers=headers,
+                data=orjson.dumps(payload),
+                impersonate=BROWSER,
+                timeout=TIMEOUT,
+                stream=True,
+                proxies=proxies
+            )
+        except BaseException:
+            await handle.release()
+            raise
+        return UpstreamStream(response, handle.release)
+
+    @staticmethod
+    async def _handle_error(response: UpstreamStream, token: str):
+        """处理错误（读取错误响应体并关闭上游流）"""
+        try:
+            if response.status_code == 403:
+                msg = "您的IP被拦截，请尝试以下方法之一: 1.更换IP 2.使用代理 3.配置CF值"
+                data = {"cf_blocked": True, "status": 403}
+                logger.warning(f"[Client] {msg}")
+            else:
+                try:
+                    await response.aread()
+                    data = response.json()
+                    msg = str(data)
+                except:
+                    data = response.text
+                    msg = data[:200] if data else "未知错误"
+        finally:
+            await response.aclose()
         
         asyncio.create_task(token_manager.record_failure(token, response.status_code, msg))
         raise GrokApiException(
             f"请求失败: {response.status_code} - {msg}",
             "HTTP_ERROR",
-            {"status": response.status_code, "data": data}
+            {
+                "status": response.status_code,
+                "data": data,
+                "retry_after": parse_retry_after(response.headers.get("Retry-After") if response.headers else None)
+            }
         )
-
-    @staticmethod
-    async def _update_limits(token: str, model: str):
-        """更新速率限制"""
-        try:
-            await token_manager.check_limits(token, model)
-        except Exception as e:
-            logger.error(f"[Client] 更新限制失败: {e}")
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""Token冷却调度 - 基于哈希时间轮的暂停/自动恢复"""
+
+import math
+import random
+import time
+from typing import Callable, Dict, Hashable, Iterable, KeysView, List, Optional
+
+from app.core.config import setting
+
+
+# 默认值
+DEFAULT_COOLDOWN = 60  # 首次冷却时间（秒），之后按指数退避翻倍
+DEFAULT_MAX_COOLDOWN = 1800  # 冷却时间上限（秒）
+DEFAULT_TICK = 1.0  # 时间轮刻度（秒）
+DEFAULT_SLOTS = 256  # 时间轮槽数（一圈覆盖 tick * slots 秒，更远的到期时间按圈数等待）
+
+
+class TimingWheel:
+    """哈希时间轮
+
+    - add/remove 为 O(1)：条目放入到期刻度对应的槽，另以字典记录所在槽
+    - advance 只处理自上次推进以来经过的槽，每槽只检查其中的条目；
+      到期时间超过一圈的条目留在槽内，下一圈再检查
+    """
+
+    def __init__(self, tick: float = DEFAULT_TICK, slots: int = DEFAULT_SLOTS, clock: Callable[[], float] = time.monotonic):
+        self._tick = tick
+        self._slots: List[Dict[Hashable, float]] = [{} for _ in range(slots)]
+        self._where: Dict[Hashable, int] = {}
+        self._clock = clock
+        self._current = int(clock() / tick)  # 已处理到的刻度
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def keys(self) -> KeysView:
+        return self._where.keys()
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        slot = self._where.get(key)
+        return None if slot is None else self._slots[slot][key]
+
+    def add(self, key: Hashable, deadline: float) -> None:
+        """加入（或改期）条目"""
+        self.remove(key)
+        # 放入不早于到期时间的刻度，且必须是尚未处理的刻度
+        tick = max(math.ceil(deadline / self._tick), self._current + 1)
+        slot = tick % len(self._slots)
+        self._slots[slot][key] = deadline
+        self._where[key] = slot
+
+    def remove(self, key: Hashable) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        del self._slots[slot][key]
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """推进到当前时间，返回已到期的条目"""
+        if not self._where:
+            self._current = int((self._clock() if now is None else now) / self._tick)
+            return []
+        if now is None:
+            now = self._clock()
+        target = int(now / self._tick)
+        if target <= self._current:
+            return []
+
+        count = len(self._slots)
+        if target - self._current >= count:
+            ticks: Iterable[int] = range(count)
+        else:
+            ticks = (t % count for t in range(self._current + 1, target + 1))
+        self._current = target
+
+        expired: List[Hashable] = []
+        for slot in ticks:
+            bucket = self._slots[slot]
+            if not bucket:
+                continue
+            for key in [k for k, d in bucket.items() if d <= now]:
+                del bucket[key]
+                del self._where[key]
+                expired.append(key)
+        return expired
+
+
+class CooldownScheduler:
+    """Token冷却调度器
+
+    - park: Token暂时退出选择，冷却时间优先使用上游 Retry-After，
+      否则按连续冷却次数指数退避（带抖动，不超过上限）
+    - advance: 到期的Token通过回调重新加入选择索引，无需扫描整个Token池
+    - forgive: 请求成功后清零退避次数
+    """
+
+    def __init__(
+        self,
+        on_park: Optional[Callable[[str], None]] = None,
+        on_expire: Optional[Callable[[str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._wheel = TimingWheel(clock=clock)
+        self._strikes: Dict[str, int] = {}
+        self._clock = clock
+        self._on_park = on_park
+        self._on_expire = on_expire
+
+    def __contains__(self, sso: str) -> bool:
+        return sso in self._wheel
+
+    def parked(self) -> KeysView:
+        """冷却中的Token"""
+        return self._wheel.keys()
+
+    def backoff(self, sso: str) -> float:
+        """下一次冷却的退避时间"""
+        base = float(setting.grok_config.get("token_cooldown_seconds", DEFAULT_COOLDOWN))
+        cap = float(setting.grok_config.get("token_cooldown_max_seconds", DEFAULT_MAX_COOLDOWN))
+        delay = min(cap, base * (2 ** self._strikes.get(sso, 0)))
+        return delay * random.uniform(0.8, 1.0)
+
+    def park(self, sso: str, seconds: Optional[float] = None, strike: bool = True) -> float:
+        """暂停Token，返回冷却时间（秒）；已在冷却中时取较晚的到期时间
+
+        Args:
+            sso: Token
+            seconds: 冷却时间，None 时按退避计算
+            strike: 是否计入退避次数（健康度剔除等非限流原因的暂停不计入）
+        """
+        if seconds is None:
+            seconds = self.backoff(sso)
+        if seconds <= 0:
+            return 0.0
+        if strike:
+            self._strikes[sso] = self._strikes.get(sso, 0) + 1
+
+        deadline = self._clock() + seconds
+        current = self._wheel.deadline(sso)
+        if current is not None and current >= deadline:
+            return current - self._clock()
+        self._wheel.add(sso, deadline)
+        if current is None and self._on_park:
+            self._on_park(sso)
+        return seconds
+
+    def unpark(self, sso: str) -> None:
+        """提前解除冷却"""
+        if self._wheel.remove(sso) and self._on_expire:
+            self._on_expire(sso)
+
+    def forgive(self, sso: str) -> None:
+        """请求成功，清零退避次数"""
+        self._strikes.pop(sso, None)
+
+    def advance(self) -> List[str]:
+        """恢复已到期的Token"""
+        expired = self._wheel.advance()
+        if self._on_expire:
+            for sso in expired:
+                self._on_expire(sso)
+        return expired
+
+    def remaining(self) -> Dict[str, float]:
+        """各冷却中Token的剩余冷却时间（秒）"""
+        now = self._clock()
+        return {sso: max(0.0, self._wheel.deadline(sso) - now) for sso in self._wheel.keys()}
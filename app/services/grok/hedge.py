@@ -0,0 +1,170 @@
+"""对冲请求 - 流式首包过慢时换用其他Token并发再发一次，先出数据者胜出"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable, Deque, Dict, Optional
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.services.grok.processer import FailureFrame
+
+
+# 默认值
+DEFAULT_BUDGET_RATIO = 0.05  # 对冲请求占请求总数的比例上限（额外上游负载）
+DEFAULT_PERCENTILE = 0.95  # 对冲阈值取首包延迟的分位数
+DEFAULT_MIN_DELAY = 2.0  # 对冲阈值下限（秒），样本不足时也使用该值
+WINDOW_SIZE = 200  # 首包延迟采样窗口
+MIN_SAMPLES = 20  # 使用分位数前至少需要的样本数
+MAX_CREDIT = 10.0  # 预算累积上限，避免长时间空闲后集中对冲
+DEFAULT_HEDGE_BULKHEADS = ["fast", "expert"]  # 允许对冲的模型类别（heavy/video 额度稀缺或耗时本就很长）
+
+
+class HedgePolicy:
+    """对冲策略
+
+    - 阈值：最近 WINDOW_SIZE 个首包延迟的 p95（不低于 hedge_min_delay，不超过首包超时）
+    - 预算：每个可对冲请求积累 hedge_budget_ratio 次额度，每次对冲消耗 1 次
+    """
+
+    def __init__(self):
+        self._samples: Deque[float] = deque(maxlen=WINDOW_SIZE)
+        self._threshold: Optional[float] = None
+        self._dirty = 0
+        self._credit = 0.0
+        self._stats: Dict[str, int] = {
+            "eligible": 0,
+            "hedged": 0,
+            "budget_denied": 0,
+            "backup_failed": 0,
+            "primary_won": 0,
+            "backup_won": 0,
+        }
+
+    @staticmethod
+    def enabled() -> bool:
+        return bool(setting.grok_config.get("hedge_enabled", False))
+
+    def eligible(self, bulkhead: str) -> bool:
+        """该模型类别的流式请求是否参与对冲"""
+        return self.enabled() and bulkhead in setting.grok_config.get("hedge_bulkheads", DEFAULT_HEDGE_BULKHEADS)
+
+    def threshold(self) -> float:
+        """当前对冲阈值（秒）"""
+        min_delay = float(setting.grok_config.get("hedge_min_delay", DEFAULT_MIN_DELAY))
+        max_delay = float(setting.grok_config.get("stream_first_response_timeout", 30))
+        if len(self._samples) >= MIN_SAMPLES and (self._threshold is None or self._dirty >= MIN_SAMPLES):
+            ordered = sorted(self._samples)
+            percentile = float(setting.grok_config.get("hedge_percentile", DEFAULT_PERCENTILE))
+            self._threshold = ordered[min(len(ordered) - 1, int(len(ordered) * percentile))]
+            self._dirty = 0
+        value = self._threshold if self._threshold is not None else min_delay
+        return max(min_delay, min(value, max_delay))
+
+    def observe(self, ttfb: float) -> None:
+        """记录一次首包延迟"""
+        self._samples.append(ttfb)
+        self._dirty += 1
+
+    def admit(self) -> None:
+        """一次可对冲请求：积累预算"""
+        self._stats["eligible"] += 1
+        ratio = float(setting.grok_config.get("hedge_budget_ratio", DEFAULT_BUDGET_RATIO))
+        self._credit = min(MAX_CREDIT, self._credit + ratio)
+
+    def try_spend(self) -> bool:
+        if self._credit >= 1.0:
+            self._credit -= 1.0
+            return True
+        self._stats["budget_denied"] += 1
+        return False
+
+    def record(self, key: str) -> None:
+        self._stats[key] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "enabled": self.enabled(),
+            "threshold": round(self.threshold(), 3),
+            "samples": len(self._samples),
+            "credit": round(self._credit, 2),
+        }
+
+
+async def _discard(task: "asyncio.Future", stream: AsyncGenerator) -> None:
+    """取消未完成的读取并关闭流（释放租约与上游连接）"""
+    if not task.done():
+        task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    await stream.aclose()
+
+
+async def hedged_stream(
+    primary: AsyncGenerator,
+    start_backup: Callable[[], Awaitable[Optional[AsyncGenerator]]],
+    policy: HedgePolicy,
+) -> AsyncGenerator[Any, None]:
+    """转发主请求的流；超过阈值仍无首包时发起备份请求，先产出数据者胜出，另一条立即取消
+
+    首帧为失败帧（首包超时/上游错误）的一路视为失败，另一路仍在进行时继续等待它；
+    失败的一路不计入首包延迟统计。
+    """
+    policy.admit()
+    started = time.monotonic()
+    streams: Dict["asyncio.Future", AsyncGenerator] = {asyncio.ensure_future(primary.__anext__()): primary}
+    winner: Optional[AsyncGenerator] = None
+    first: Any = None
+    hedged = False
+
+    try:
+        threshold = policy.threshold()
+        done, _ = await asyncio.wait(streams.keys(), timeout=threshold)
+        if not done and policy.try_spend():
+            backup = await start_backup()
+            if backup is None:
+                policy.record("backup_failed")
+            else:
+                hedged = True
+                policy.record("hedged")
+                streams[asyncio.ensure_future(backup.__anext__())] = backup
+                logger.info(f"[Hedge] 首包超过 {threshold:.2f}s，已发起对冲请求")
+
+        while streams:
+            done, _ = await asyncio.wait(streams.keys(), return_when=asyncio.FIRST_COMPLETED)
+            task = done.pop()
+            stream = streams.pop(task)
+            if task.exception() is None:
+                winner, first = stream, task.result()
+                if not isinstance(first, FailureFrame) or not streams:
+                    break
+                winner = None
+            # 该路失败或无数据：关闭，等待另一路；两路都失败时抛出最后的异常
+            await stream.aclose()
+            if not streams:
+                if isinstance(task.exception(), StopAsyncIteration):
+                    return
+                raise task.exception()
+
+        for task, stream in list(streams.items()):
+            await _discard(task, stream)
+        streams.clear()
+
+        # 备份胜出时主请求的首包延迟只知道下限，仍按下限计入，让阈值随慢请求上移
+        if not isinstance(first, FailureFrame):
+            policy.observe(time.monotonic() - started)
+        if hedged:
+            policy.record("primary_won" if winner is primary else "backup_won")
+
+        yield first
+        async for chunk in winner:
+            yield chunk
+    finally:
+        for task, stream in streams.items():
+            await _discard(task, stream)
+        if winner is not None:
+            await winner.aclose()
+
+
+# 全局实例
+hedge_policy = HedgePolicy()
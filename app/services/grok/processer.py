@@ -4,7 +4,9 @@ import orjson
 import uuid
 import time
 import asyncio
-from typing import AsyncGenerator, Tuple
+from contextlib import aclosing
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, List, Optional, Tuple
 
 from app.core.config import setting
 from app.core.exception import GrokApiException
@@ -12,12 +14,11 @@ from app.core.logger import logger
 from app.models.openai_schema import (
     OpenAIChatCompletionResponse,
     OpenAIChatCompletionChoice,
-    OpenAIChatCompletionMessage,
-    OpenAIChatCompletionChunkResponse,
-    OpenAIChatCompletionChunkChoice,
-    OpenAIChatCompletionChunkMessage
+    OpenAIChatCompletionMessage
 )
 from app.services.grok.cache import image_cache_service, video_cache_service
+from app.services.grok.stream import UpstreamStream
+from app.services.grok.tag_filter import get_tag_filter
 
 
 class StreamTimeoutManager:
@@ -56,15 +57,193 @@ class StreamTimeoutManager:
         return asyncio.get_event_loop().time() - self.start_time
 
 
+SSE_DONE = b"data: [DONE]\n\n"
+
+
+class FailureFrame(bytes):
+    """流内的失败帧（超时/上游错误/处理异常）：照常发送给客户端，转发层据此记录失败而非成功"""
+
+    def __new__(cls, frame: bytes, reason: str):
+        obj = super().__new__(cls, frame)
+        obj.reason = reason
+        return obj
+
+
+class SSEEncoder:
+    """流式响应帧编码器
+
+    与 OpenAIChatCompletionChunkResponse.model_dump_json() 输出相同的 JSON 结构，但每条流只生成一次
+    id/created 与帧前缀，每个分片只对内容做 orjson 转义并拼接字节，不再逐块构造 pydantic 模型。
+    """
+
+    __slots__ = ("_id", "_created", "_model", "_prefix")
+
+    def __init__(self, model: str):
+        self._id = f"chatcmpl-{uuid.uuid4()}"
+        self._created = int(time.time())
+        self._model = None
+        self._prefix = b""
+        self.set_model(model)
+
+    def set_model(self, model: str) -> None:
+        """上游返回实际模型后更新前缀"""
+        if model == self._model:
+            return
+        self._model = model
+        head = orjson.dumps({
+            "id": self._id,
+            "object": "chat.completion.chunk",
+            "created": self._created,
+            "model": model,
+            "system_fingerprint": None,
+        })
+        self._prefix = b"data: " + head[:-1] + b',"choices":[{"index":0,"delta":'
+
+    def chunk(self, content: str, finish: str = None) -> bytes:
+        delta = b'{"role":"assistant","content":' + orjson.dumps(content) + b"}" if content else b"{}"
+        finish_reason = orjson.dumps(finish) if finish else b"null"
+        return self._prefix + delta + b',"finish_reason":' + finish_reason + b"}]}\n\n"
+
+
+# 分片合并默认值
+DEFAULT_COALESCE_MS = 0  # 分片最长缓冲时间（毫秒），0 表示关闭合并
+DEFAULT_COALESCE_BYTES = 512  # 缓冲达到该字节数立即发送
+
+# 生成图片下载默认值
+DEFAULT_IMAGE_FETCH_CONCURRENCY = 8  # 同时下载的生成图片数（全局）
+DEFAULT_IMAGE_FETCH_TIMEOUT = 30.0  # 单张图片下载超时（秒），超时回退为上游地址
+
+_coalesce: ContextVar[Optional[Tuple[float, int]]] = ContextVar("grok_stream_coalesce", default=None)
+
+
+class DeltaCoalescer:
+    """流式分片合并
+
+    上游每行只带一个小 token，逐个成帧会让序列化、写 socket 与反向代理缓冲的开销占主导。
+    对话内容先进入缓冲，缓冲时间达到 max_delay 或大小达到 max_bytes 时合并为一帧发送；
+    思考/回答切换、图片/视频、错误与流结束前立即发送缓冲内容。
+    """
+
+    __slots__ = ("max_delay", "max_bytes", "_parts", "_size", "_deadline")
+
+    def __init__(self, max_delay: float = 0.0, max_bytes: int = DEFAULT_COALESCE_BYTES):
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self._parts: List[str] = []
+        self._size = 0
+        self._deadline = 0.0
+
+    @staticmethod
+    def configure(api_key: Optional[str]) -> None:
+        """按 API Key 选择合并参数（stream_coalesce_keys 覆盖全局 stream_coalesce_ms/bytes）
+
+        在请求处理任务内设置，随后在同一任务中迭代的流式响应读取该参数。
+        """
+        conf = (setting.grok_config.get("stream_coalesce_keys") or {}).get(api_key or "", {})
+        ms = conf.get("ms", setting.grok_config.get("stream_coalesce_ms", DEFAULT_COALESCE_MS))
+        size = conf.get("bytes", setting.grok_config.get("stream_coalesce_bytes", DEFAULT_COALESCE_BYTES))
+        _coalesce.set((max(0.0, float(ms)) / 1000, max(1, int(size))))
+
+    @staticmethod
+    def current() -> "DeltaCoalescer":
+        conf = _coalesce.get()
+        if conf is None:
+            return DeltaCoalescer()
+        return DeltaCoalescer(*conf)
+
+    def add(self, text: str) -> Optional[str]:
+        """加入一个分片，返回需要立即发送的合并内容"""
+        if self.max_delay <= 0:
+            return text
+        now = time.monotonic()
+        if not self._parts:
+            self._deadline = now + self.max_delay
+        self._parts.append(text)
+        self._size += len(text.encode())
+        if self._size >= self.max_bytes or now >= self._deadline:
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._parts:
+            return None
+        text = "".join(self._parts)
+        self._parts.clear()
+        self._size = 0
+        return text
+
+    def timeout(self) -> Optional[float]:
+        """缓冲内容距到期的秒数，缓冲为空时为 None"""
+        if not self._parts:
+            return None
+        return max(0.0, self._deadline - time.monotonic())
+
+
 class GrokResponseProcessor:
     """Grok响应处理器"""
 
+    _fetch_sem = None  # 图片下载信号量，延迟初始化
+
+    # 流式响应统计：started 开始 / completed 正常结束 / cancelled 客户端断开后取消
+    _stream_stats: Dict[str, int] = {"started": 0, "completed": 0, "cancelled": 0}
+
     @staticmethod
-    async def process_normal(response, auth_token: str, model: str = None) -> OpenAIChatCompletionResponse:
+    async def guard_disconnect(stream: AsyncGenerator, receive: Callable[[], Awaitable[Dict[str, Any]]]) -> AsyncGenerator:
+        """转发流式响应，客户端断开时立即取消上游读取
+
+        ASGI 2.4 下 StreamingResponse 不监听断开，上游流会一直跑到超时；这里后台等待 http.disconnect，
+        正在读取上游时取消当前任务（process_stream 关闭上游响应、中断进行中的缓存下载，外层释放租约与许可），
+        正在向客户端发送时在下一块前结束。
+        """
+        stats = GrokResponseProcessor._stream_stats
+        stats["started"] += 1
+        task = asyncio.current_task()
+        reading = False
+        disconnected = False
+
+        async def watch():
+            nonlocal disconnected
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected = True
+                    if reading:
+                        task.cancel()
+                    return
+
+        watcher = asyncio.create_task(watch())
+        try:
+            while not disconnected:
+                reading = True
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    stats["completed"] += 1
+                    return
+                finally:
+                    reading = False
+                yield chunk
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+            task.uncancel()
+        finally:
+            watcher.cancel()
+            await stream.aclose()
+            if disconnected:
+                stats["cancelled"] += 1
+                logger.info("[Processor] 客户端已断开，已取消上游流")
+
+    @staticmethod
+    def stream_stats() -> Dict[str, int]:
+        return dict(GrokResponseProcessor._stream_stats)
+
+    @staticmethod
+    async def process_normal(response: UpstreamStream, auth_token: str, model: str = None) -> OpenAIChatCompletionResponse:
         """处理非流式响应"""
         response_closed = False
         try:
-            for chunk in response.iter_lines():
+            async for chunk in response.aiter_lines():
                 if not chunk:
                     continue
 
@@ -86,7 +265,7 @@ class GrokResponseProcessor:
                         content = await GrokResponseProcessor._build_video_content(video_url, auth_token)
                         result = GrokResponseProcessor._build_response(content, model or "grok-imagine-0.9")
                         response_closed = True
-                        response.close()
+                        await response.aclose()
                         return result
 
                 # 模型响应
@@ -107,7 +286,7 @@ class GrokResponseProcessor:
 
                 result = GrokResponseProcessor._build_response(content, model_name)
                 response_closed = True
-                response.close()
+                await response.aclose()
                 return result
 
             raise GrokApiException("无响应数据", "NO_RESPONSE")
@@ -119,21 +298,20 @@ class GrokResponseProcessor:
             logger.error(f"[Processor] 处理错误: {type(e).__name__}: {e}")
             raise GrokApiException(f"响应处理错误: {e}", "PROCESS_ERROR") from e
         finally:
-            if not response_closed and hasattr(response, 'close'):
+            if not response_closed:
                 try:
-                    response.close()
+                    await response.aclose()
                 except Exception as e:
                     logger.warning(f"[Processor] 关闭响应失败: {e}")
 
     @staticmethod
-    async def process_stream(response, auth_token: str) -> AsyncGenerator[str, None]:
+    async def process_stream(response: UpstreamStream, auth_token: str) -> AsyncGenerator[bytes, None]:
         """处理流式响应"""
         # 状态变量
         is_image = False
         is_thinking = False
         thinking_finished = False
-        model = None
-        filtered_tags = setting.grok_config.get("filtered_tags", "").split(",")
+        tag_filter = get_tag_filter()
         video_progress_started = False
         last_video_progress = -1
         response_closed = False
@@ -146,31 +324,27 @@ class GrokResponseProcessor:
             total_timeout=setting.grok_config.get("stream_total_timeout", 600)
         )
 
-        def make_chunk(content: str, finish: str = None):
-            """生成响应块"""
-            chunk_data = OpenAIChatCompletionChunkResponse(
-                id=f"chatcmpl-{uuid.uuid4()}",
-                created=int(time.time()),
-                model=model or "grok-4-mini-thinking-tahoe",
-                choices=[OpenAIChatCompletionChunkChoice(
-                    index=0,
-                    delta=OpenAIChatCompletionChunkMessage(
-                        role="assistant",
-                        content=content
-                    ) if content else {},
-                    finish_reason=finish
-                )]
-            )
-            return f"data: {chunk_data.model_dump_json()}\n\n"
+        # 帧编码器：整条流共用同一 id，直接输出字节
+        encoder = SSEEncoder("grok-4-mini-thinking-tahoe")
+        make_chunk = encoder.chunk
+        coalescer = DeltaCoalescer.current()
 
         try:
-            for chunk in response.iter_lines():
+            async for chunk in GrokResponseProcessor._read_lines(response, coalescer):
+                # 合并缓冲到期
+                if chunk is None:
+                    if text := coalescer.flush():
+                        yield make_chunk(text)
+                    continue
+
                 # 超时检查
                 is_timeout, timeout_msg = timeout_mgr.check_timeout()
                 if is_timeout:
                     logger.warning(f"[Processor] {timeout_msg}")
-                    yield make_chunk("", "stop")
-                    yield "data: [DONE]\n\n"
+                    if text := coalescer.flush():
+                        yield make_chunk(text)
+                    yield FailureFrame(make_chunk("", "stop"), "STREAM_TIMEOUT")
+                    yield SSE_DONE
                     return
 
                 logger.debug(f"[Processor] 收到数据块: {len(chunk)} bytes")
@@ -184,8 +358,10 @@ class GrokResponseProcessor:
                     if error := data.get("error"):
                         error_msg = error.get('message', '未知错误')
                         logger.error(f"[Processor] API错误: {error_msg}")
-                        yield make_chunk(f"Error: {error_msg}", "stop")
-                        yield "data: [DONE]\n\n"
+                        if text := coalescer.flush():
+                            yield make_chunk(text)
+                        yield FailureFrame(make_chunk(f"Error: {error_msg}", "stop"), "UPSTREAM_ERROR")
+                        yield SSE_DONE
                         return
 
                     grok_resp = data.get("result", {}).get("response", {})
@@ -198,10 +374,12 @@ class GrokResponseProcessor:
                     # 更新模型
                     if user_resp := grok_resp.get("userResponse"):
                         if m := user_resp.get("model"):
-                            model = m
+                            encoder.set_model(m)
 
                     # 视频处理
                     if video_resp := grok_resp.get("streamingVideoGenerationResponse"):
+                        if text := coalescer.flush():
+                            yield make_chunk(text)
                         progress = video_resp.get("progress", 0)
                         v_url = video_resp.get("videoUrl")
                         
@@ -234,43 +412,23 @@ class GrokResponseProcessor:
 
                     # 图片处理
                     if is_image:
+                        if text := coalescer.flush():
+                            yield make_chunk(text)
                         if model_resp := grok_resp.get("modelResponse"):
-                            image_mode = setting.global_config.get("image_mode", "url")
-                            content = ""
-
-                            for img in model_resp.get("generatedImageUrls", []):
-                                try:
-                                    if image_mode == "base64":
-                                        # Base64模式 - 分块发送
-                                        base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
-                                        if base64_str:
-                                            # 分块发送大数据
-                                            if not base64_str.startswith("data:"):
-                                                parts = base64_str.split(",", 1)
-                                                if len(parts) == 2:
-                                                    yield make_chunk(f"![Generated Image](data:{parts[0]},")
-                                                    # 8KB分块
-                                                    for i in range(0, len(parts[1]), 8192):
-                                                        yield make_chunk(parts[1][i:i+8192])
-                                                    yield make_chunk(")\n")
-                                                else:
-                                                    yield make_chunk(f"![Generated Image]({base64_str})\n")
-                                            else:
-                                                yield make_chunk(f"![Generated Image]({base64_str})\n")
-                                        else:
-                                            yield make_chunk(f"![Generated Image](https://assets.grok.com/{img})\n")
-                                    else:
-                                        # URL模式
-                                        await image_cache_service.download_image(f"/{img}", auth_token)
-                                        img_path = img.replace('/', '-')
-                                        base_url = setting.global_config.get("base_url", "")
-                                        img_url = f"{base_url}/images/{img_path}" if base_url else f"/images/{img_path}"
-                                        content += f"![Generated Image]({img_url})\n"
-                                except Exception as e:
-                                    logger.warning(f"[Processor] 处理图片失败: {e}")
-                                    content += f"![Generated Image](https://assets.grok.com/{img})\n"
-
-                            yield make_chunk(content.strip(), "stop")
+                            images = model_resp.get("generatedImageUrls", [])
+                            if setting.global_config.get("image_mode", "url") == "base64":
+                                # Base64模式：边下载边编码，逐块直接发送
+                                for img in images:
+                                    async with aclosing(GrokResponseProcessor._stream_image_base64(img, auth_token)) as parts:
+                                        async for part in parts:
+                                            yield make_chunk(part)
+                            else:
+                                # URL模式：并发下载，按原始顺序逐张发送；失败/超时的图片回退为上游地址
+                                async with aclosing(GrokResponseProcessor._fetch_images(images, auth_token, False)) as fetched:
+                                    async for img, result in fetched:
+                                        yield make_chunk(GrokResponseProcessor._image_markdown(img, result) + "\n")
+
+                            yield make_chunk("", "stop")
                             return
                         elif token:
                             yield make_chunk(token)
@@ -280,8 +438,11 @@ class GrokResponseProcessor:
                         if isinstance(token, list):
                             continue
 
-                        if any(tag in token for tag in filtered_tags if token):
-                            continue
+                        # 过滤标签片段（可能跨多个分片）
+                        if token:
+                            token = tag_filter.feed(token)
+                            if not token:
+                                continue
 
                         current_is_thinking = grok_resp.get("isThinking", False)
                         message_tag = grok_resp.get("messageTag")
@@ -330,7 +491,11 @@ class GrokResponseProcessor:
                                     should_skip = True
 
                             if not should_skip:
-                                yield make_chunk(content)
+                                # 思考/回答切换与标题处先发送已缓冲内容
+                                if (is_thinking != current_is_thinking or message_tag == "header") and (text := coalescer.flush()):
+                                    yield make_chunk(text)
+                                if text := coalescer.add(content):
+                                    yield make_chunk(text)
                             
                             is_thinking = current_is_thinking
 
@@ -341,22 +506,63 @@ class GrokResponseProcessor:
                     logger.warning(f"[Processor] 处理出错: {e}")
                     continue
 
+            if text := (coalescer.flush() or "") + tag_filter.flush():
+                yield make_chunk(text)
             yield make_chunk("", "stop")
-            yield "data: [DONE]\n\n"
+            yield SSE_DONE
             logger.info(f"[Processor] 流式完成，耗时: {timeout_mgr.duration():.2f}秒")
 
+        except asyncio.CancelledError:
+            # 客户端断开：不再产出错误块，finally 中关闭上游响应
+            logger.debug(f"[Processor] 流式已取消，耗时: {timeout_mgr.duration():.2f}秒")
+            raise
         except Exception as e:
             logger.error(f"[Processor] 严重错误: {e}")
-            yield make_chunk(f"处理错误: {e}", "error")
-            yield "data: [DONE]\n\n"
+            if text := coalescer.flush():
+                yield make_chunk(text)
+            yield FailureFrame(make_chunk(f"处理错误: {e}", "error"), "STREAM_ERROR")
+            yield SSE_DONE
         finally:
-            if not response_closed and hasattr(response, 'close'):
+            if not response_closed:
                 try:
-                    response.close()
+                    await response.aclose()
                     logger.debug("[Processor] 响应已关闭")
                 except Exception as e:
                     logger.warning(f"[Processor] 关闭失败: {e}")
 
+    @staticmethod
+    async def _read_lines(response: UpstreamStream, coalescer: DeltaCoalescer) -> AsyncGenerator[Optional[bytes], None]:
+        """逐行读取上游；合并缓冲非空且到期前没有新行时产出 None，提示先发送缓冲内容"""
+        lines = response.aiter_lines()
+        pending: Optional[asyncio.Future] = None
+        try:
+            while True:
+                wait = coalescer.timeout()
+                if wait is None and pending is None:
+                    try:
+                        line = await lines.__anext__()
+                    except StopAsyncIteration:
+                        return
+                else:
+                    # 缓冲中有内容：读取不被超时取消，到期后下一轮继续等待同一行
+                    if pending is None:
+                        pending = asyncio.ensure_future(lines.__anext__())
+                    done, _ = await asyncio.wait({pending}, timeout=wait)
+                    if not done:
+                        yield None
+                        continue
+                    task, pending = pending, None
+                    try:
+                        line = task.result()
+                    except StopAsyncIteration:
+                        return
+                yield line
+        finally:
+            if pending is not None:
+                pending.cancel()
+                await asyncio.gather(pending, return_exceptions=True)
+            await lines.aclose()
+
     @staticmethod
     async def _build_video_content(video_url: str, auth_token: str) -> str:
         """构建视频内容"""
@@ -378,30 +584,84 @@ class GrokResponseProcessor:
     @staticmethod
     async def _append_images(content: str, images: list, auth_token: str) -> str:
         """追加图片到内容"""
-        image_mode = setting.global_config.get("image_mode", "url")
-        
-        for img in images:
+        as_base64 = setting.global_config.get("image_mode", "url") == "base64"
+        async with aclosing(GrokResponseProcessor._fetch_images(images, auth_token, as_base64)) as fetched:
+            async for img, result in fetched:
+                content += f"\n{GrokResponseProcessor._image_markdown(img, result)}"
+        return content
+
+    @staticmethod
+    def _get_fetch_semaphore() -> asyncio.Semaphore:
+        """获取图片下载信号量（动态配置）"""
+        if GrokResponseProcessor._fetch_sem is None:
+            max_concurrency = setting.global_config.get("image_fetch_concurrency", DEFAULT_IMAGE_FETCH_CONCURRENCY)
+            GrokResponseProcessor._fetch_sem = asyncio.Semaphore(max_concurrency)
+        return GrokResponseProcessor._fetch_sem
+
+    @staticmethod
+    async def _fetch_images(images: list, auth_token: str, as_base64: bool) -> AsyncGenerator[Tuple[str, Any], None]:
+        """并发下载生成的图片，按原始顺序逐张产出 (图片路径, 结果)
+
+        下载受全局信号量限制，单张超过 image_fetch_timeout 秒或失败时结果为 None；
+        生成器提前关闭（如客户端断开）时取消尚未完成的下载。
+        """
+        timeout = float(setting.global_config.get("image_fetch_timeout", DEFAULT_IMAGE_FETCH_TIMEOUT))
+        download = image_cache_service.download_base64 if as_base64 else image_cache_service.download_image
+        semaphore = GrokResponseProcessor._get_fetch_semaphore()
+
+        async def fetch(img: str) -> Any:
+            async with semaphore:
+                try:
+                    return await asyncio.wait_for(download(f"/{img}", auth_token), timeout)
+                except Exception as e:
+                    logger.warning(f"[Processor] 处理图片失败: {img} - {e!r}")
+                    return None
+
+        tasks = [asyncio.ensure_future(fetch(img)) for img in images]
+        try:
+            for img, task in zip(images, tasks):
+                yield img, await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    @staticmethod
+    async def _stream_image_base64(img: str, auth_token: str) -> AsyncGenerator[str, None]:
+        """以 base64 data URI 流式输出一张图片的 Markdown
+
+        收到响应头和第一块图片数据（image_fetch_timeout 内）后才开始输出，此前的失败回退为上游地址。
+        开始输出后下载中断无法挽回（客户端已收到部分 data URI），只结束当前图片。
+        """
+        deadline = time.monotonic() + float(setting.global_config.get("image_fetch_timeout", DEFAULT_IMAGE_FETCH_TIMEOUT))
+        async with aclosing(image_cache_service.stream_base64(f"/{img}", auth_token)) as parts:
             try:
-                if image_mode == "base64":
-                    base64_str = await image_cache_service.download_base64(f"/{img}", auth_token)
-                    if base64_str:
-                        content += f"\n![Generated Image]({base64_str})"
-                    else:
-                        content += f"\n![Generated Image](https://assets.grok.com/{img})"
-                else:
-                    cache_path = await image_cache_service.download_image(f"/{img}", auth_token)
-                    if cache_path:
-                        img_path = img.replace('/', '-')
-                        base_url = setting.global_config.get("base_url", "")
-                        img_url = f"{base_url}/images/{img_path}" if base_url else f"/images/{img_path}"
-                        content += f"\n![Generated Image]({img_url})"
-                    else:
-                        content += f"\n![Generated Image](https://assets.grok.com/{img})"
+                header = await asyncio.wait_for(parts.__anext__(), deadline - time.monotonic())
+                first = await asyncio.wait_for(parts.__anext__(), deadline - time.monotonic())
             except Exception as e:
-                logger.warning(f"[Processor] 处理图片失败: {e}")
-                content += f"\n![Generated Image](https://assets.grok.com/{img})"
-        
-        return content
+                logger.warning(f"[Processor] 处理图片失败: {img} - {e!r}")
+                yield f"![Generated Image](https://assets.grok.com/{img})\n"
+                return
+
+            yield f"![Generated Image]({header}{first}"
+            try:
+                async for part in parts:
+                    yield part
+            except Exception as e:
+                logger.warning(f"[Processor] 图片下载中断，图片不完整: {img} - {e!r}")
+            yield ")\n"
+
+    @staticmethod
+    def _image_markdown(img: str, result: Any) -> str:
+        """图片的 Markdown：base64 数据、本地缓存地址，或下载失败时的上游地址"""
+        if isinstance(result, str):
+            return f"![Generated Image]({result})"
+        if result:
+            img_path = img.replace('/', '-')
+            base_url = setting.global_config.get("base_url", "")
+            img_url = f"{base_url}/images/{img_path}" if base_url else f"/images/{img_path}"
+            return f"![Generated Image]({img_url})"
+        return f"![Generated Image](https://assets.grok.com/{img})"
 
     @staticmethod
     def _build_response(content: str, model: str) -> OpenAIChatCompletionResponse:
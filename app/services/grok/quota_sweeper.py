@@ -0,0 +1,230 @@
+"""额度巡检 - 后台定期复查已耗尽/未使用的Token，恢复后重新参与选择"""
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.storage import storage_manager
+from app.models.grok_models import TokenType
+from app.services.grok.rate_limit import rate_limit_refresher
+from app.services.grok.token import MAX_FAILURES, token_manager
+
+
+# 默认值
+DEFAULT_SWEEP_INTERVAL = 600.0  # 巡检间隔（秒），0 表示关闭
+DEFAULT_SWEEP_CONCURRENCY = 2  # 同时复查的Token数
+DEFAULT_SWEEP_JITTER = 0.2  # 巡检间隔与单次复查的随机抖动比例
+DEFAULT_SWEEP_MAX_TOKENS = 50  # 每轮最多复查的项数，0 表示不限
+DEFAULT_HISTORY_SIZE = 144  # 保留的容量采样点数
+
+# 额度字段 -> 查询该字段所用的模型
+_FIELD_MODELS = {
+    "remainingQueries": "grok-4-fast",
+    "heavyremainingQueries": "grok-4-heavy",
+}
+
+# 巡检目标: (Token类型, sso, 额度字段)
+_Target = Tuple[str, str, str]
+
+
+class QuotaSweeper:
+    """额度巡检器
+
+    剩余次数为 0 的Token不会被选中，也就不会在对话后刷新限额，只能靠巡检恢复：
+    - 多个 worker/节点通过存储端的命名租约选出唯一的巡检者，其余 worker 跳过本轮
+    - 每隔 quota_sweep_interval（带抖动）收集剩余为 0 或未使用（-1）的有效Token，
+      按上次复查时间（从未复查的耗尽Token优先）取前 quota_sweep_max_tokens 项
+    - 以 quota_sweep_concurrency 为并发上限逐个复查，每次复查前随机延迟以错开请求
+    - 复查结果经 update_limits 写回，剩余大于 0 的Token随索引更新自动回到轮换
+    - 每轮结束记录一次池容量采样，供 /api/metrics 展示容量随时间的变化
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=DEFAULT_HISTORY_SIZE)
+        self._last_sweep: Optional[Dict[str, Any]] = None
+        self._stats: Dict[str, int] = {"sweeps": 0, "checked": 0, "recovered": 0, "skipped": 0}
+        self._owner = f"{os.getpid()}-{os.urandom(4).hex()}"  # 巡检租约持有者标识
+        self._checked_at: Dict[Tuple[str, str], float] = {}  # (sso, 字段) -> 上次复查时间
+
+    # === 配置 ===
+
+    @staticmethod
+    def _interval() -> float:
+        return float(setting.grok_config.get("quota_sweep_interval", DEFAULT_SWEEP_INTERVAL))
+
+    @staticmethod
+    def _jitter() -> float:
+        return max(0.0, min(1.0, float(setting.grok_config.get("quota_sweep_jitter", DEFAULT_SWEEP_JITTER))))
+
+    @staticmethod
+    def _max_tokens() -> int:
+        return max(0, int(setting.grok_config.get("quota_sweep_max_tokens", DEFAULT_SWEEP_MAX_TOKENS)))
+
+    def _resize_history(self) -> None:
+        size = max(1, int(setting.grok_config.get("quota_history_size", DEFAULT_HISTORY_SIZE)))
+        if size != self._history.maxlen:
+            self._history = deque(self._history, maxlen=size)
+
+    # === 生命周期 ===
+
+    def start(self) -> None:
+        """启动后台巡检任务"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._worker())
+            logger.info("[QuotaSweeper] 巡检任务已创建")
+
+    async def stop(self) -> None:
+        """停止后台巡检任务"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _worker(self) -> None:
+        while True:
+            interval = self._interval()
+            if interval <= 0:
+                # 已关闭，等待配置变更
+                await asyncio.sleep(60)
+                continue
+            jitter = self._jitter()
+            await asyncio.sleep(interval * random.uniform(1 - jitter, 1 + jitter))
+            try:
+                # 租约覆盖两个最长间隔：持有者持续续期，退出后由其他 worker 接替
+                if not await self._elected(interval * (1 + jitter) * 2):
+                    self._stats["skipped"] += 1
+                    continue
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[QuotaSweeper] 巡检异常: {e}")
+
+    async def _elected(self, ttl: float) -> bool:
+        """获取或续期巡检租约，只有持有者执行巡检"""
+        try:
+            storage = storage_manager.get_storage()
+        except RuntimeError:
+            return True
+        try:
+            return await storage.acquire_lease("quota_sweeper", self._owner, ttl)
+        except Exception as e:
+            logger.warning(f"[QuotaSweeper] 获取巡检租约失败: {e}")
+            return False
+
+    # === 巡检 ===
+
+    @staticmethod
+    def _targets() -> List[_Target]:
+        """收集需要复查的Token（剩余为 0 或未使用，且未失效）"""
+        targets: List[_Target] = []
+        token_data = token_manager.token_data or {}
+        for token_type, tokens in token_data.items():
+            fields = ("remainingQueries", "heavyremainingQueries") if token_type == TokenType.SUPER.value else ("remainingQueries",)
+            for sso, data in tokens.items():
+                if data.get("status") == "expired" or data.get("failedCount", 0) >= MAX_FAILURES:
+                    continue
+                for field in fields:
+                    if int(data.get(field, -1)) in (0, -1):
+                        targets.append((token_type, sso, field))
+        return targets
+
+    def _select(self, targets: List[_Target]) -> List[_Target]:
+        """按上次复查时间取本轮复查的目标（从未复查的耗尽Token优先），不超过 quota_sweep_max_tokens 项"""
+        keys = {(sso, field) for _, sso, field in targets}
+        self._checked_at = {key: at for key, at in self._checked_at.items() if key in keys}
+        limit = self._max_tokens()
+        if not limit or len(targets) <= limit:
+            return targets
+        quota = lambda t: token_manager.quota_state(t[1], t[2])[0]
+        ordered = sorted(targets, key=lambda t: (self._checked_at.get((t[1], t[2]), 0.0), quota(t) != 0))
+        return ordered[:limit]
+
+    async def sweep(self) -> Dict[str, Any]:
+        """执行一轮巡检，返回本轮结果"""
+        self._resize_history()
+        targets = self._select(self._targets())
+        concurrency = max(1, int(setting.grok_config.get("quota_sweep_concurrency", DEFAULT_SWEEP_CONCURRENCY)))
+        semaphore = asyncio.Semaphore(concurrency)
+        spread = self._jitter() * 2.0
+        started = time.monotonic()
+        recovered = 0
+
+        async def check(target: _Target) -> None:
+            nonlocal recovered
+            _, sso, field = target
+            async with semaphore:
+                if spread > 0:
+                    await asyncio.sleep(random.uniform(0, spread))
+                before, _ = token_manager.quota_state(sso, field)
+                self._checked_at[(sso, field)] = time.monotonic()
+                await rate_limit_refresher.refresh(f"sso-rw={sso};sso={sso}", _FIELD_MODELS[field])
+                after, _ = token_manager.quota_state(sso, field)
+                if before == 0 and after is not None and after > 0:
+                    recovered += 1
+                    logger.info(f"[QuotaSweeper] Token已恢复: {sso[:10]}... ({field}={after})")
+
+        await asyncio.gather(*(check(t) for t in targets))
+
+        self._stats["sweeps"] += 1
+        self._stats["checked"] += len(targets)
+        self._stats["recovered"] += recovered
+        self._last_sweep = {
+            "time": int(time.time() * 1000),
+            "checked": len(targets),
+            "recovered": recovered,
+            "duration": round(time.monotonic() - started, 2),
+        }
+        self._record_capacity()
+        if targets:
+            logger.info(f"[QuotaSweeper] 巡检完成: 复查 {len(targets)} 项, 恢复 {recovered} 项")
+        return self._last_sweep
+
+    # === 容量 ===
+
+    @staticmethod
+    def capacity() -> Dict[str, int]:
+        """当前池容量：可用/耗尽/未使用/失效的Token数及已知剩余次数合计"""
+        result = {"total": 0, "available": 0, "limited": 0, "unused": 0, "expired": 0, "remaining": 0}
+        for tokens in (token_manager.token_data or {}).values():
+            for data in tokens.values():
+                result["total"] += 1
+                remaining = int(data.get("remainingQueries", -1))
+                if data.get("status") == "expired" or data.get("failedCount", 0) >= MAX_FAILURES:
+                    result["expired"] += 1
+                elif remaining == 0:
+                    result["limited"] += 1
+                else:
+                    result["available"] += 1
+                    if remaining == -1:
+                        result["unused"] += 1
+                    else:
+                        result["remaining"] += remaining
+        return result
+
+    def _record_capacity(self) -> None:
+        self._history.append({"time": int(time.time() * 1000), **self.capacity()})
+
+    def stats(self) -> Dict[str, Any]:
+        """巡检统计与容量历史"""
+        return {
+            **self._stats,
+            "running": self._task is not None,
+            "last_sweep": self._last_sweep,
+            "capacity": self.capacity(),
+            "history": list(self._history),
+        }
+
+
+# 全局实例
+quota_sweeper = QuotaSweeper()
@@ -0,0 +1,143 @@
+"""限额刷新调度 - 合并、节流并采样 /rest/rate-limits 查询"""
+
+import asyncio
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.core.config import setting
+from app.core.logger import logger
+from app.core.retry import retry_scope
+from app.models.grok_models import Models
+from app.services.grok.token import token_manager
+
+
+# 默认值
+DEFAULT_MIN_INTERVAL = 10.0  # 同一 (Token, 限额模型) 两次查询的最小间隔（秒）
+DEFAULT_SAMPLE_RATE = 0.25  # 预测额度可信时的抽样查询比例
+DEFAULT_LOW_WATERMARK = 10  # 预测剩余次数低于该值时必查
+DEFAULT_MAX_AGE = 300.0  # 超过该时间未查询则必查（秒）
+DEFAULT_CONCURRENCY = 4  # 同时进行的查询数上限
+
+RefreshKey = Tuple[str, str]
+
+
+class RateLimitRefresher:
+    """限额刷新调度器
+
+    对话成功后不再逐次调用 check_limits，而是：
+    - 同一 (Token, 限额模型) 同时只有一个查询（single-flight），期间的请求直接合并
+    - 两次查询至少间隔 min_interval
+    - 剩余次数未知、预测剩余或累计预扣达到水位线、数据过旧时必查；否则预测额度可信，仅按比例抽样查询
+    - 全局信号量限制并发查询数
+    """
+
+    def __init__(self):
+        self._pending: Dict[RefreshKey, asyncio.Task] = {}
+        self._last: Dict[RefreshKey, float] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._concurrency = 0
+        self._stats: Dict[str, int] = {
+            "requested": 0,
+            "coalesced": 0,
+            "throttled": 0,
+            "sampled_out": 0,
+            "refreshed": 0,
+            "failed": 0,
+        }
+
+    # === 配置 ===
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        concurrency = max(1, int(setting.grok_config.get("rate_limit_concurrency", DEFAULT_CONCURRENCY)))
+        if self._semaphore is None or concurrency != self._concurrency:
+            self._semaphore = asyncio.Semaphore(concurrency)
+            self._concurrency = concurrency
+        return self._semaphore
+
+    # === 调度 ===
+
+    def schedule(self, auth_token: str, model: str, force: bool = False) -> bool:
+        """请求刷新限额（不等待），返回是否实际发起了查询"""
+        sso = token_manager._extract_sso(auth_token)
+        if not sso:
+            return False
+        key = (sso, Models.to_rate_limit(model))
+        self._stats["requested"] += 1
+
+        if key in self._pending:
+            self._stats["coalesced"] += 1
+            return False
+
+        if not force and not self._should_refresh(key, sso, model):
+            return False
+
+        self._start(key, auth_token, model)
+        return True
+
+    async def refresh(self, auth_token: str, model: str) -> None:
+        """立即刷新限额并等待完成（已有同键查询时等待该查询，不重复发起）"""
+        sso = token_manager._extract_sso(auth_token)
+        if not sso:
+            return
+        key = (sso, Models.to_rate_limit(model))
+        self._stats["requested"] += 1
+        task = self._pending.get(key)
+        if task is None:
+            task = self._start(key, auth_token, model)
+        else:
+            self._stats["coalesced"] += 1
+        await asyncio.shield(task)
+
+    def _start(self, key: RefreshKey, auth_token: str, model: str) -> asyncio.Task:
+        self._last[key] = time.monotonic()
+        task = asyncio.create_task(self._refresh(key, auth_token, model))
+        self._pending[key] = task
+        task.add_done_callback(lambda _: self._pending.pop(key, None))
+        return task
+
+    def _should_refresh(self, key: RefreshKey, sso: str, model: str) -> bool:
+        """判断是否需要查询（节流 -> 必查条件 -> 抽样）"""
+        conf = setting.grok_config
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < float(conf.get("rate_limit_min_interval", DEFAULT_MIN_INTERVAL)):
+            self._stats["throttled"] += 1
+            return False
+
+        field = "heavyremainingQueries" if model == "grok-4-heavy" else "remainingQueries"
+        remaining, drift = token_manager.quota_state(sso, field)
+        if remaining is None or remaining < 0:
+            return True
+        # 剩余接近耗尽或本地预扣累积过多时预测不可信
+        watermark = int(conf.get("rate_limit_low_watermark", DEFAULT_LOW_WATERMARK))
+        if remaining <= watermark or drift >= watermark:
+            return True
+        if last is None or now - last >= float(conf.get("rate_limit_max_age", DEFAULT_MAX_AGE)):
+            return True
+
+        if random.random() < float(conf.get("rate_limit_sample_rate", DEFAULT_SAMPLE_RATE)):
+            return True
+        self._stats["sampled_out"] += 1
+        return False
+
+    async def _refresh(self, key: RefreshKey, auth_token: str, model: str) -> None:
+        try:
+            async with self._get_semaphore():
+                # 独立的重试预算，不占用触发它的对话请求的预算
+                with retry_scope():
+                    result = await token_manager.check_limits(auth_token, model)
+            self._stats["refreshed" if result is not None else "failed"] += 1
+        except Exception as e:
+            self._stats["failed"] += 1
+            logger.error(f"[RateLimit] 更新限制失败: {e}")
+
+    # === 统计 ===
+
+    def stats(self) -> Dict[str, Any]:
+        """查询/合并/节流/抽样统计"""
+        return {**self._stats, "pending": len(self._pending), "tracked": len(self._last)}
+
+
+# 全局实例
+rate_limit_refresher = RateLimitRefresher()
@@ -0,0 +1,81 @@
+"""上游流式传输 - 基于curl_cffi AsyncSession的非阻塞响应读取"""
+
+import asyncio
+import orjson
+from contextlib import suppress
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from app.core.logger import logger
+
+
+class UpstreamStream:
+    """上游流式响应
+
+    包装 curl_cffi 的异步流式响应，所有读取都在事件循环上以协程方式完成，
+    不占用线程，也不会阻塞其他请求。
+    """
+
+    def __init__(self, response, release: Optional[Callable[[], Awaitable[None]]] = None):
+        self._response = response
+        self._release = release
+        self._body: Optional[bytes] = None
+        self._closed = False
+
+    @property
+    def status_code(self) -> int:
+        return self._response.status_code
+
+    @property
+    def headers(self):
+        return self._response.headers
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def aiter_lines(self) -> AsyncIterator[bytes]:
+        """逐行读取上游数据（NDJSON）"""
+        async for line in self._response.aiter_lines():
+            yield line
+
+    async def aiter_bytes(self) -> AsyncIterator[bytes]:
+        """逐块读取上游数据"""
+        async for chunk in self._response.aiter_content():
+            yield chunk
+
+    async def aread(self) -> bytes:
+        """读取完整响应体（用于错误响应）"""
+        if self._body is None:
+            parts = [chunk async for chunk in self._response.aiter_content()]
+            self._body = b"".join(parts)
+        return self._body
+
+    def json(self) -> Any:
+        """解析已读取的响应体"""
+        return orjson.loads(self._body or b"")
+
+    @property
+    def text(self) -> str:
+        return (self._body or b"").decode("utf-8", errors="replace")
+
+    async def aclose(self) -> None:
+        """立即中止上游传输并释放连接"""
+        if self._closed:
+            return
+        self._closed = True
+
+        response = self._response
+        # 通知写回调停止接收，并取消传输任务（无数据时也能立即中止）
+        if quit_now := getattr(response, "quit_now", None):
+            quit_now.set()
+        if task := getattr(response, "astream_task", None):
+            if not task.done():
+                task.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await task
+
+        if self._release is not None:
+            try:
+                await self._release()
+            except Exception as e:
+                logger.warning(f"[Stream] 归还会话失败: {e}")
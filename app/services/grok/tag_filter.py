@@ -0,0 +1,176 @@
+"""响应标签过滤 - 多模式 Aho-Corasick 流式匹配，跨分片识别并整体去除 <tag ...>...</tag> 片段"""
+
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import setting
+
+
+# 标签名之后允许出现的字符（用于区分 <grok:render 与 <grok:renderer）
+_BOUNDARY = frozenset(" \t\r\n>/")
+# 仅转换 ASCII 大小写，保证转换前后下标一一对应
+_ASCII_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+
+class TagMatcher:
+    """编译后的多标签匹配自动机（不区分大小写），按配置共享，流式状态见 StreamTagFilter"""
+
+    def __init__(self, tags: List[str]):
+        self.tags = [t.strip().translate(_ASCII_LOWER) for t in tags if t.strip()]
+        self.closers = [f"</{tag}>" for tag in self.tags]
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[int] = [-1]  # 终止状态对应的标签下标
+        self._depth: List[int] = [0]
+        self._build([f"<{tag}" for tag in self.tags])
+
+    def _build(self, patterns: List[str]) -> None:
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(-1)
+                    self._depth.append(self._depth[state] + 1)
+                    self._goto[state][char] = nxt
+                state = nxt
+            if self._out[state] < 0:
+                self._out[state] = index
+
+        # BFS 计算失败指针（第一层指向根）
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                if self._out[nxt] < 0:
+                    self._out[nxt] = self._out[self._fail[nxt]]
+                queue.append(nxt)
+
+    def step(self, state: int, char: str) -> int:
+        while state and char not in self._goto[state]:
+            state = self._fail[state]
+        return self._goto[state].get(char, 0)
+
+    def match(self, state: int) -> int:
+        return self._out[state]
+
+    def depth(self, state: int) -> int:
+        return self._depth[state]
+
+    def __bool__(self) -> bool:
+        return bool(self.tags)
+
+
+class StreamTagFilter:
+    """单条流的过滤状态
+
+    - feed() 返回可以立即输出的文本；可能是标签开头的尾部字符暂存到下一个分片再判断
+    - 匹配到 <tag 且其后为空白、> 或 / 时，丢弃直到对应的 </tag> 或自闭合 />
+    - flush() 在流结束时输出暂存内容；未闭合的标签片段整体丢弃
+    """
+
+    __slots__ = ("_matcher", "_held", "_inside", "_open", "_last")
+
+    def __init__(self, matcher: TagMatcher):
+        self._matcher = matcher
+        self._held = ""
+        self._inside = -1  # 正在丢弃的标签下标，-1 表示不在标签内
+        self._open = False  # 是否仍在开始标签 <tag ...> 内
+        self._last = ""  # 开始标签内上一个分片的最后一个字符（判断跨分片的 />）
+
+    def feed(self, text: str) -> str:
+        if not self._matcher:
+            return text
+        if not self._held and self._inside < 0 and "<" not in text:
+            return text
+
+        buf = self._held + text
+        lower = buf.translate(_ASCII_LOWER)
+        self._held = ""
+        out: List[str] = []
+        pos = 0
+        while pos < len(buf):
+            if self._inside >= 0:
+                pos = self._skip(buf, lower, pos)
+                if pos < 0:
+                    break
+                continue
+            emitted, pos = self._scan(buf, lower, pos)
+            out.append(emitted)
+            if pos < 0:
+                break
+        return "".join(out)
+
+    def _scan(self, buf: str, lower: str, pos: int) -> Tuple[str, int]:
+        """标签外：输出到下一个匹配的开始标签为止；返回 (输出文本, 继续位置或 -1)"""
+        matcher = self._matcher
+        state = 0
+        i = pos
+        n = len(buf)
+        while i < n:
+            if state == 0:
+                # 所有模式都以 < 开头，状态 0 时直接跳到下一个 <
+                i = lower.find("<", i)
+                if i < 0:
+                    return buf[pos:], -1
+            state = matcher.step(state, lower[i])
+            tag = matcher.match(state)
+            if tag >= 0:
+                start = i - len(matcher.tags[tag])
+                if i + 1 >= n:
+                    # 标签名已完整但还看不到后一个字符：暂存
+                    self._held = buf[start:]
+                    return buf[pos:start], -1
+                if lower[i + 1] in _BOUNDARY:
+                    self._inside, self._open, self._last = tag, True, ""
+                    return buf[pos:start], i + 1
+            i += 1
+
+        keep = matcher.depth(state)
+        self._held = buf[n - keep:] if keep else ""
+        return buf[pos:n - keep], -1
+
+    def _skip(self, buf: str, lower: str, pos: int) -> int:
+        """标签内：丢弃到标签结束；返回继续位置，本分片内未结束时返回 -1"""
+        if self._open:
+            end = lower.find(">", pos)
+            if end < 0:
+                self._last = buf[-1]
+                return -1
+            previous = buf[end - 1] if end > pos else self._last
+            if previous == "/":
+                self._inside = -1
+                return end + 1
+            self._open = False
+            pos = end + 1
+
+        closer = self._matcher.closers[self._inside]
+        end = lower.find(closer, pos)
+        if end < 0:
+            # 可能是结束标签的前半部分：暂存
+            self._held = buf[max(pos, len(buf) - len(closer) + 1):]
+            return -1
+        self._inside = -1
+        return end + len(closer)
+
+    def flush(self) -> str:
+        held = "" if self._inside >= 0 else self._held
+        self._held, self._inside, self._open, self._last = "", -1, False, ""
+        return held
+
+
+_compiled: Optional[Tuple[str, TagMatcher]] = None
+
+
+def get_tag_filter() -> StreamTagFilter:
+    """按当前 filtered_tags 配置创建流式过滤器（自动机在配置变更时才重新编译）"""
+    global _compiled
+    tags = setting.grok_config.get("filtered_tags", "") or ""
+    if _compiled is None or _compiled[0] != tags:
+        _compiled = (tags, TagMatcher(tags.split(",")))
+    return StreamTagFilter(_compiled[1])
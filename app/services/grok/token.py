@@ -6,23 +6,71 @@ import asyncio
 import aiofiles
 import portalocker
 from pathlib import Path
-from curl_cffi.requests import AsyncSession
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
 
 from app.models.grok_models import TokenType, Models
 from app.core.exception import GrokApiException
 from app.core.logger import logger
+from app.core.storage import MAX_TOKEN_FAILURES
 from app.core.config import setting
+from app.core.retry import retry_engine
+from app.core.session_pool import session_pool
 from app.services.grok.statsig import get_dynamic_headers
+from app.services.grok.token_index import TokenIndex
+from app.services.grok.cooldown import CooldownScheduler
+from app.services.grok.token_health import HealthTracker
+from app.services.grok.token_queue import TokenWaitQueue
 
 
 # 常量
 RATE_LIMIT_API = "https://grok.com/rest/rate-limits"
 TIMEOUT = 30
 BROWSER = "chrome133a"
-MAX_FAILURES = 3
+MAX_FAILURES = MAX_TOKEN_FAILURES
 TOKEN_INVALID = 401
 STATSIG_INVALID = 403
+RATE_LIMITED = 429
+DEFAULT_WATCH_INTERVAL = 2.0  # token文件变更检测间隔（秒）
+DEFAULT_SYNC_INTERVAL = 10.0  # 共享存储（Redis）模式下同步本地视图的间隔（秒）
+DEFAULT_MAX_INFLIGHT = 0  # 单Token最大在途请求数（0 表示不限）
+QUOTA_FIELDS = ("remainingQueries", "heavyremainingQueries")  # 额度字段
+COOLDOWN_TICK = 1.0  # 冷却到期检查间隔（秒），与时间轮刻度一致
+
+
+class TokenLease:
+    """Token租约 - 请求结束（非流式返回/流式响应结束）时必须调用 release()"""
+
+    __slots__ = ("sso", "token", "field", "cost", "_manager", "_released")
+
+    def __init__(self, manager: "GrokTokenManager", sso: str, field: str = "remainingQueries", cost: int = 0):
+        self.sso = sso
+        self.token = f"sso-rw={sso};sso={sso}"
+        self.field = field
+        self.cost = cost  # 本地预扣的额度
+        self._manager = manager
+        self._released = False
+
+    @property
+    def released(self) -> bool:
+        return self._released
+
+    def release(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        self._manager._release_lease(self.sso)
+
+    async def refund(self) -> None:
+        """请求未被上游计费（发送前/上游报错）时退回预扣的额度"""
+        if self.cost > 0:
+            cost, self.cost = self.cost, 0
+            await self._manager._refund(self.sso, self.field, cost)
+
+    def __del__(self):
+        # 兜底：未被消费就被丢弃的流式响应
+        if not self._released:
+            logger.warning(f"[Token] 租约未释放即被回收: {self.sso[:10]}...")
+            self.release()
 
 
 class GrokTokenManager:
@@ -45,11 +93,36 @@ class GrokTokenManager:
         self.token_file.parent.mkdir(parents=True, exist_ok=True)
         self._storage = None
         self.token_data = None  # 延迟加载
+        self._index = TokenIndex(MAX_FAILURES)  # 选择索引，随每次修改增量更新
         
         # 批量保存队列
         self._save_pending = False  # 标记是否有待保存的数据
         self._save_task = None  # 后台保存任务
         self._shutdown = False  # 关闭标志
+        self._dirty: Set[Tuple[str, str]] = set()  # 本进程尚未保存的记录 (类型, sso)
+
+        # 文件变更检测（多进程共享同一token文件）
+        self._watch_task = None
+        self._cooldown_task = None  # 冷却到期检查任务
+        self._file_sig: Optional[Tuple[int, int]] = None  # 上次读取时的 (mtime_ns, size)
+        self._disk_snapshot: Dict[str, Any] = {}  # 上次读取的文件内容，用于计算差异
+        self._journal_cursor = None  # 日志模式下已读取到的位置
+
+        # 冷却调度：冷却中的Token退出索引，到期后自动恢复
+        self._cooldown = CooldownScheduler(on_park=self._index.park, on_expire=self._readmit)
+
+        # 健康度：EWMA 首包延迟/错误率影响选择排序，异常Token暂时剔除
+        self._health = HealthTracker(on_penalty=self._index.set_penalty, on_eject=self._eject)
+        self._ejected: Set[str] = set()
+
+        # 无可用Token时的等待队列：按额度字段（Token池）分开，不同池的请求互不阻塞
+        self._queues: Dict[str, TokenWaitQueue] = {field: TokenWaitQueue() for field in QUOTA_FIELDS}
+
+        # 在途请求（租约）: sso -> 数量
+        self._inflight: Dict[str, int] = {}
+
+        # 自上次权威额度以来的本地预扣量: (sso, 字段) -> 次数
+        self._predicted: Dict[Tuple[str, str], int] = {}
         
         self._initialized = True
         logger.debug(f"[Token] 初始化完成: {self.token_file}")
@@ -58,12 +131,30 @@ class GrokTokenManager:
         """设置存储实例"""
         self._storage = storage
 
+    @property
+    def _shared(self) -> bool:
+        """存储端是否原子维护Token选择与计数（Redis模式）"""
+        return bool(getattr(self._storage, "shared_tokens", False))
+
+    @property
+    def _journaled(self) -> bool:
+        """存储端是否提供快照+日志的增量变更读取（文件/MySQL模式）"""
+        return not self._shared and hasattr(self._storage, "read_token_changes")
+
     async def _load_data(self) -> None:
         """异步加载Token数据（支持多进程）"""
         default = {TokenType.NORMAL.value: {}, TokenType.SUPER.value: {}}
         
         try:
-            if self.token_file.exists():
+            if self._shared:
+                self.token_data = await self._storage.load_tokens()
+                self._disk_snapshot = orjson.loads(orjson.dumps(self.token_data))
+            elif self._journaled:
+                # 快照 + 日志重放
+                data, _, self._journal_cursor = await self._storage.read_token_changes(None)
+                self.token_data = data
+                self._disk_snapshot = orjson.loads(orjson.dumps(data))
+            elif self.token_file.exists():
                 # 使用进程锁读取文件
                 async with self._file_lock:
                     with open(self.token_file, "r", encoding="utf-8") as f:
@@ -71,17 +162,40 @@ class GrokTokenManager:
                         try:
                             content = f.read()
                             self.token_data = orjson.loads(content)
+                            self._disk_snapshot = orjson.loads(content)
                         finally:
                             portalocker.unlock(f)
+                self._file_sig = self._file_signature(self.token_file)
             else:
                 self.token_data = default
                 logger.debug("[Token] 创建新数据文件")
         except Exception as e:
             logger.error(f"[Token] 加载失败: {e}")
             self.token_data = default
+        for token_type in default:
+            self.token_data.setdefault(token_type, {})
+        self._index.rebuild(self.token_data)
 
     async def _save_data(self) -> None:
         """保存Token数据（支持多进程）"""
+        # 保存期间产生的新修改记入新的集合，保存失败则合并回去
+        dirty, self._dirty = self._dirty, set()
+        saved = {(t, sso): orjson.loads(orjson.dumps(self.token_data.get(t, {}).get(sso))) for t, sso in dirty}
+        try:
+            await self._write_data(dirty)
+        except BaseException:
+            self._dirty |= dirty
+            raise
+        # 本进程写入的记录直接计入已读取的内容，变更检测时不再当作外部修改合并回来
+        for (token_type, sso), record in saved.items():
+            tokens = self._disk_snapshot.setdefault(token_type, {})
+            if record is None:
+                tokens.pop(sso, None)
+            else:
+                tokens[sso] = record
+
+    async def _write_data(self, changes: Set[Tuple[str, str]]) -> None:
+        """写入Token数据（存储支持时只写入变化的记录）"""
         try:
             if not self._storage:
                 async with self._file_lock:
@@ -95,15 +209,31 @@ class GrokTokenManager:
                         finally:
                             portalocker.unlock(f)
             else:
-                await self._storage.save_tokens(self.token_data)
+                await self._storage.save_token_changes(self.token_data, changes)
         except IOError as e:
             logger.error(f"[Token] 保存失败: {e}")
             raise GrokApiException(f"保存失败: {e}", "TOKEN_SAVE_ERROR", {"file": str(self.token_file)})
 
-    def _mark_dirty(self) -> None:
+    def _mark_dirty(self, token_type: str, sso: str) -> None:
         """标记有待保存的数据"""
+        self._dirty.add((token_type, sso))
         self._save_pending = True
 
+    def _replace_local(self, token_type: str, sso: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """用存储端返回的最新记录覆盖本地视图"""
+        self.token_data.setdefault(token_type, {})[sso] = record
+        self._index.update(token_type, sso, record)
+        return record
+
+    async def _commit(self, token_type: str, sso: str, fields: Dict[str, Any]) -> None:
+        """提交字段修改：共享存储模式下原子写入存储端，否则批量保存"""
+        if self._shared:
+            record = await self._storage.update_token(token_type, sso, fields, MAX_FAILURES)
+            if record is not None:
+                self._replace_local(token_type, sso, record)
+            return
+        self._mark_dirty(token_type, sso)  # 批量保存
+
     async def _batch_save_worker(self) -> None:
         """批量保存后台任务"""
         from app.core.config import setting
@@ -123,21 +253,26 @@ class GrokTokenManager:
                     logger.error(f"[Token] 存储失败: {e}")
 
     async def start_batch_save(self) -> None:
-        """启动批量保存任务"""
+        """启动批量保存任务与文件变更检测任务"""
         if self._save_task is None:
             self._save_task = asyncio.create_task(self._batch_save_worker())
             logger.info("[Token] 存储任务已创建")
+        if self._watch_task is None:
+            self._watch_task = asyncio.create_task(self._watch_worker())
+        if self._cooldown_task is None:
+            self._cooldown_task = asyncio.create_task(self._cooldown_worker())
 
     async def shutdown(self) -> None:
         """关闭并刷新所有待保存数据"""
         self._shutdown = True
         
-        if self._save_task:
-            self._save_task.cancel()
-            try:
-                await self._save_task
-            except asyncio.CancelledError:
-                pass
+        for task in (self._save_task, self._watch_task, self._cooldown_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
         
         # 最终刷新
         if self._save_pending:
@@ -180,9 +315,11 @@ class GrokTokenManager:
                 "tags": [],
                 "note": ""
             }
+            self._index.update(token_type.value, token, self.token_data[token_type.value][token])
+            self._mark_dirty(token_type.value, token)  # 批量保存
             count += 1
 
-        self._mark_dirty()  # 批量保存
+        self._notify_waiters()
         logger.info(f"[Token] 添加 {count} 个 {token_type.value} Token")
 
     async def delete_token(self, tokens: list[str], token_type: TokenType) -> None:
@@ -194,9 +331,11 @@ class GrokTokenManager:
         for token in tokens:
             if token in self.token_data[token_type.value]:
                 del self.token_data[token_type.value][token]
+                self._index.update(token_type.value, token, None)
+                self._health.forget(token)
+                self._mark_dirty(token_type.value, token)  # 批量保存
                 count += 1
 
-        self._mark_dirty()  # 批量保存
         logger.info(f"[Token] 删除 {count} 个 {token_type.value} Token")
 
     async def update_token_tags(self, token: str, token_type: TokenType, tags: list[str]) -> None:
@@ -206,7 +345,7 @@ class GrokTokenManager:
         
         cleaned = [t.strip() for t in tags if t and t.strip()]
         self.token_data[token_type.value][token]["tags"] = cleaned
-        self._mark_dirty()  # 批量保存
+        await self._commit(token_type.value, token, {"tags": cleaned})
         logger.info(f"[Token] 更新标签: {token[:10]}... -> {cleaned}")
 
     async def update_token_note(self, token: str, token_type: TokenType, note: str) -> None:
@@ -215,84 +354,373 @@ class GrokTokenManager:
             raise GrokApiException("Token不存在", "TOKEN_NOT_FOUND", {"token": token[:10]})
         
         self.token_data[token_type.value][token]["note"] = note.strip()
-        self._mark_dirty()  # 批量保存
+        await self._commit(token_type.value, token, {"note": note.strip()})
         logger.info(f"[Token] 更新备注: {token[:10]}...")
     
     def get_tokens(self) -> Dict[str, Any]:
         """获取所有Token"""
         return self.token_data.copy()
 
-    def _reload_if_needed(self) -> None:
-        """在多进程模式下重新加载数据（同步版本，用于select_token）"""
-        # 只在文件模式且多进程环境下才重新加载
-        if self._storage:
-            return  # 数据库模式不需要
-        
+    # === 文件变更检测 ===
+
+    @staticmethod
+    def _file_signature(path: Path) -> Optional[Tuple[int, int]]:
+        """文件签名 (mtime_ns, size)，文件不存在返回None"""
         try:
-            if self.token_file.exists():
-                with open(self.token_file, "r", encoding="utf-8") as f:
-                    portalocker.lock(f, portalocker.LOCK_SH)
-                    try:
-                        content = f.read()
-                        self.token_data = orjson.loads(content)
-                    finally:
-                        portalocker.unlock(f)
-        except Exception as e:
-            logger.warning(f"[Token] 重新加载失败: {e}")
+            st = path.stat()
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
 
-    def get_token(self, model: str) -> str:
-        """获取Token"""
-        jwt = self.select_token(model)
-        return f"sso-rw={jwt};sso={jwt}"
-    
-    def select_token(self, model: str) -> str:
-        """选择最优Token（多进程安全）"""
-        # 重新加载最新数据（多进程模式）
-        self._reload_if_needed()
-        def select_best(tokens: Dict[str, Any], field: str) -> Tuple[Optional[str], Optional[int]]:
-            """选择最佳Token"""
-            unused, used = [], []
-
-            for key, data in tokens.items():
-                # 跳过已失效的token
-                if data.get("status") == "expired":
+    def _read_file(self) -> Dict[str, Any]:
+        """读取并解析token文件（在线程中执行）"""
+        with open(self.token_file, "r", encoding="utf-8") as f:
+            portalocker.lock(f, portalocker.LOCK_SH)
+            try:
+                return orjson.loads(f.read())
+            finally:
+                portalocker.unlock(f)
+
+    @staticmethod
+    def _diff_records(old: Dict[str, Any], new: Dict[str, Any]) -> List[Tuple[str, str, Optional[Dict]]]:
+        """对比两次文件内容，返回变化的记录 (类型, sso, 新数据/None表示删除)"""
+        changes = []
+        for token_type in (TokenType.NORMAL.value, TokenType.SUPER.value):
+            before, after = old.get(token_type) or {}, new.get(token_type) or {}
+            for sso, data in after.items():
+                if before.get(sso) != data:
+                    changes.append((token_type, sso, data))
+            for sso in before.keys() - after.keys():
+                changes.append((token_type, sso, None))
+        return changes
+
+    def _apply_changes(self, changes: List[Tuple[str, str, Optional[Dict]]]) -> int:
+        """合并其他进程的修改（本进程未保存的记录以本地为准，有未结清预扣的额度字段保留本地值）"""
+        applied = 0
+        for token_type, sso, data in changes:
+            if (token_type, sso) in self._dirty:
+                continue
+            tokens = self.token_data.setdefault(token_type, {})
+            local = tokens.get(sso)
+            if data is None:
+                if local is None:
                     continue
-                
-                # 跳过失败次数过多的token（任何错误状态码）
-                if data.get("failedCount", 0) >= MAX_FAILURES:
+                del tokens[sso]
+                self._index.update(token_type, sso, None)
+            else:
+                record = dict(data)
+                if local is not None:
+                    for field in QUOTA_FIELDS:
+                        if (sso, field) in self._predicted and field in local:
+                            record[field] = local[field]
+                if local == record:
                     continue
+                tokens[sso] = record
+                self._index.update(token_type, sso, record)
+            applied += 1
+        return applied
 
-                remaining = int(data.get(field, -1))
-                if remaining == 0:
-                    continue
+    async def _check_file_changes(self) -> int:
+        """文件签名变化时在线程中解析并计算差异，只合并变化的记录"""
+        sig = self._file_signature(self.token_file)
+        if sig is None or sig == self._file_sig:
+            return 0
+
+        try:
+            disk = await asyncio.to_thread(self._read_file)
+        except ValueError:
+            # 其他进程写入中（内容不完整），下一轮再读
+            return 0
+
+        changes = await asyncio.to_thread(self._diff_records, self._disk_snapshot, disk)
+        self._file_sig = sig
+        self._disk_snapshot = disk
+        applied = self._apply_changes(changes)
+        if applied:
+            logger.info(f"[Token] 检测到文件变更，合并 {applied} 条记录")
+        return applied
+
+    async def _check_journal_changes(self) -> int:
+        """日志模式：只读取其他进程新追加的日志记录；快照被压缩替换时整体对比"""
+        full, entries, self._journal_cursor = await self._storage.read_token_changes(self._journal_cursor, skip_own=True)
+        if full is not None:
+            changes = await asyncio.to_thread(self._diff_records, self._disk_snapshot, full)
+            self._disk_snapshot = full
+        else:
+            changes = entries
+            for token_type, sso, record in entries:
+                tokens = self._disk_snapshot.setdefault(token_type, {})
+                if record is None:
+                    tokens.pop(sso, None)
+                else:
+                    tokens[sso] = record
+        applied = self._apply_changes(changes)
+        if applied:
+            logger.info(f"[Token] 检测到其他进程变更，合并 {applied} 条记录")
+        return applied
+
+    async def _check_storage_changes(self) -> int:
+        """共享存储模式：重新拉取存储端数据，只合并变化的记录"""
+        remote = await self._storage.load_tokens()
+        changes = await asyncio.to_thread(self._diff_records, self._disk_snapshot, remote)
+        self._disk_snapshot = remote
+        applied = self._apply_changes(changes)
+        if applied:
+            logger.debug(f"[Token] 同步存储端变更 {applied} 条")
+        return applied
+
+    async def _watch_worker(self) -> None:
+        """变更检测后台任务（替代每次选择时重新读取文件）"""
+        if self._shared:
+            interval = float(setting.global_config.get("token_sync_interval", DEFAULT_SYNC_INTERVAL))
+            check = self._check_storage_changes
+        else:
+            interval = float(setting.global_config.get("token_watch_interval", DEFAULT_WATCH_INTERVAL))
+            check = self._check_journal_changes if self._journaled else self._check_file_changes
+        if interval <= 0:
+            return
+        logger.info(f"[Token] 变更检测已启动，间隔: {interval}s")
+
+        while not self._shutdown:
+            await asyncio.sleep(interval)
+            try:
+                await check()
+            except Exception as e:
+                logger.warning(f"[Token] 变更检测失败: {e}")
+
+    async def _cooldown_worker(self) -> None:
+        """按时间轮刻度推进冷却：到期（含健康度剔除到期）的Token即使没有新请求也自动恢复并唤醒等待者"""
+        while not self._shutdown:
+            await asyncio.sleep(COOLDOWN_TICK)
+            try:
+                self._cooldown.advance()
+            except Exception as e:
+                logger.warning(f"[Token] 冷却检查失败: {e}")
+
+    # === 租约 ===
+
+    def _max_inflight(self) -> int:
+        return max(0, int(setting.grok_config.get("token_max_inflight", DEFAULT_MAX_INFLIGHT)))
+
+    def _saturated(self) -> Iterable[str]:
+        """已达在途上限的Token"""
+        limit = self._index.max_load
+        if limit <= 0:
+            return ()
+        return [sso for sso, n in self._inflight.items() if n >= limit]
+
+    async def acquire(
+        self,
+        model: str,
+        exclude: Optional[Iterable[str]] = None,
+        wait: bool = True,
+        priority: int = 0,
+    ) -> TokenLease:
+        """选择Token并占用一个在途名额（优先选择在途请求最少的Token）
+
+        Args:
+            model: 模型名称
+            exclude: 需要跳过的SSO
+            wait: 无可用Token时是否进入等待队列（队列关闭时不等待）
+            priority: 等待队列为 priority 模式时的优先级，数值小者优先
+        """
+        attempt = lambda: self._acquire_now(model, exclude)
+        queue = self._queues[self._quota_field(model)]
+        if len(queue):
+            # 同一Token池已有请求在排队：先到先得，不与等待者争抢释放出来的Token
+            error = GrokApiException(
+                f"没有可用Token: {model}",
+                "NO_AVAILABLE_TOKEN",
+                {"model": model, "queued": len(queue)}
+            )
+            if not wait or not queue.enabled:
+                raise error
+            return await queue.wait(attempt, error, priority, self._discard_lease)
+        try:
+            return await attempt()
+        except GrokApiException as e:
+            if not wait or e.error_code != "NO_AVAILABLE_TOKEN" or not queue.enabled:
+                raise
+            return await queue.wait(attempt, e, priority, self._discard_lease)
+
+    @staticmethod
+    def _quota_field(model: str) -> str:
+        """模型消耗的额度字段（即所属的Token池）"""
+        return "heavyremainingQueries" if model == "grok-4-heavy" else "remainingQueries"
+
+    def _notify_waiters(self) -> None:
+        """可能有Token可用了：通知各Token池的等待队列（Super Token同时属于两个池）"""
+        for queue in self._queues.values():
+            queue.notify()
+
+    @staticmethod
+    async def _discard_lease(lease: TokenLease) -> None:
+        """排队者已离开时交还为其获取的租约"""
+        await lease.refund()
+        lease.release()
+
+    async def _acquire_now(self, model: str, exclude: Optional[Iterable[str]] = None) -> TokenLease:
+        self._index.set_max_load(self._max_inflight())
+        field = self._quota_field(model)
+        cost = Models.get_cost(model)
+        if self._shared:
+            # 存储端选择时已原子预扣
+            sso, taken = await self._select_shared(model, exclude, cost)
+        else:
+            sso = self.select_token(model, exclude)
+            taken = self._predict(sso, field, cost)
+
+        count = self._inflight.get(sso, 0) + 1
+        self._inflight[sso] = count
+        self._index.set_load(sso, count)
+        return TokenLease(self, sso, field, taken)
+
+    # === 预测额度 ===
+
+    def _predict(self, sso: str, field: str, cost: int) -> int:
+        """按模型计费倍率预扣本地额度（剩余次数已知时），返回实际预扣量"""
+        token_type, data = self._find_token(sso)
+        if not data:
+            return 0
+        remaining = int(data.get(field, -1))
+        if remaining <= 0 or cost <= 0:
+            return 0
+        taken = min(cost, remaining)
+        data[field] = remaining - taken
+        self._index.update(token_type, sso, data)
+        self._mark_dirty(token_type, sso)
+        key = (sso, field)
+        self._predicted[key] = self._predicted.get(key, 0) + taken
+        return taken
+
+    async def _refund(self, sso: str, field: str, amount: int) -> None:
+        """退回预扣额度（期间已收到权威额度则不再退回）"""
+        if self._shared:
+            await self._refund_shared(sso, field, amount)
+            return
+        key = (sso, field)
+        amount = min(amount, self._predicted.get(key, 0))
+        if amount <= 0:
+            return
+        token_type, data = self._find_token(sso)
+        if not data:
+            return
+        data[field] = int(data.get(field, 0)) + amount
+        self._index.update(token_type, sso, data)
+        self._mark_dirty(token_type, sso)
+        if self._predicted[key] > amount:
+            self._predicted[key] -= amount
+        else:
+            del self._predicted[key]
+
+    async def _refund_shared(self, sso: str, field: str, amount: int) -> None:
+        """共享存储模式：在存储端原子退回选择时预扣的额度"""
+        token_type, _ = self._find_token(sso)
+        types = [token_type] if token_type else [TokenType.NORMAL.value, TokenType.SUPER.value]
+        try:
+            for token_type in types:
+                record = await self._storage.refund_token(token_type, sso, field, amount, MAX_FAILURES)
+                if record is not None:
+                    self._replace_local(token_type, sso, record)
+                    return
+        except Exception as e:
+            logger.warning(f"[Token] 存储端退回额度失败: {e}")
+
+    def quota_state(self, sso: str, field: str) -> Tuple[Optional[int], int]:
+        """返回 (当前剩余次数（含预扣）, 自上次权威额度以来的预扣量)，Token不存在时剩余为None"""
+        _, data = self._find_token(sso)
+        if not data:
+            return None, 0
+        return int(data.get(field, -1)), self._predicted.get((sso, field), 0)
+
+    def _reconcile(self, sso: str, field: str, value: int, current: Any) -> None:
+        """收到权威额度：清除预扣记录"""
+        predicted = self._predicted.pop((sso, field), 0)
+        if predicted and current is not None and int(current) != value:
+            logger.debug(f"[Token] 额度校正: {sso[:10]}... {field} 预测={current} 实际={value}（预扣{predicted}次）")
+
+    def _release_lease(self, sso: str) -> None:
+        count = self._inflight.get(sso, 0) - 1
+        if count > 0:
+            self._inflight[sso] = count
+        else:
+            self._inflight.pop(sso, None)
+            count = 0
+        self._index.set_load(sso, count)
+        self._notify_waiters()
+
+    def get_inflight(self) -> Dict[str, int]:
+        """各Token当前在途请求数"""
+        return dict(self._inflight)
+
+    async def get_token(self, model: str, exclude: Optional[Iterable[str]] = None) -> str:
+        """获取Token（不占用在途名额，请求链路请使用 acquire）"""
+        if self._shared:
+            jwt, _ = await self._select_shared(model, exclude)
+        else:
+            jwt = self.select_token(model, exclude)
+        return f"sso-rw={jwt};sso={jwt}"
+
+    async def _select_shared(self, model: str, exclude: Optional[Iterable[str]] = None,
+                             cost: int = 1) -> Tuple[str, int]:
+        """共享存储模式：由存储端原子选择并预扣额度，存储不可用时退回本地选择
+
+        Returns:
+            (sso, 存储端实际预扣量)
+        """
+        self._cooldown.advance()
+        skip = set(exclude) if exclude else set()
+        skip.update(self._cooldown.parked())
+        skip.update(self._saturated())
 
-                if remaining == -1:
-                    unused.append(key)
-                elif remaining > 0:
-                    used.append((key, remaining))
-
-            if unused:
-                return unused[0], -1
-            if used:
-                used.sort(key=lambda x: x[1], reverse=True)
-                return used[0][0], used[0][1]
-            return None, None
-
-        # 快照
-        snapshot = {
-            TokenType.NORMAL.value: self.token_data[TokenType.NORMAL.value].copy(),
-            TokenType.SUPER.value: self.token_data[TokenType.SUPER.value].copy()
-        }
-
-        # 选择策略
+        if model == "grok-4-heavy":
+            field, types = "heavyremainingQueries", [TokenType.SUPER.value]
+        else:
+            field, types = "remainingQueries", [TokenType.NORMAL.value, TokenType.SUPER.value]
+
+        try:
+            result = await self._storage.select_token(types, field, skip, cost)
+        except Exception as e:
+            logger.warning(f"[Token] 存储端选择失败，使用本地视图: {e}")
+            return self.select_token(model, exclude), 0
+
+        if result is None:
+            raise GrokApiException(
+                f"没有可用Token: {model}",
+                "NO_AVAILABLE_TOKEN",
+                {"model": model, "skipped": len(skip)}
+            )
+
+        token_type, sso, remaining, taken = result
+        local = self.token_data.get(token_type, {}).get(sso)
+        if local is not None and local.get(field) != remaining:
+            local[field] = remaining
+            self._index.update(token_type, sso, local)
+
+        status = "未使用" if remaining == -1 else f"剩余{remaining}次"
+        logger.debug(f"[Token] 分配Token: {model} ({status})")
+        return sso, taken
+    
+    def select_token(self, model: str, exclude: Optional[Iterable[str]] = None) -> str:
+        """选择最优Token（多进程下的修改由 _watch_worker 后台合并）
+
+        Args:
+            model: 模型名称
+            exclude: 需要跳过的SSO（同一请求内已尝试过的Token）
+        """
+        # 到期的冷却Token重新入堆，冷却中的Token不在堆中，无需跳过
+        self._cooldown.advance()
+        skip = set(exclude) if exclude else set()
+
+        # 选择策略（索引按 未使用 > 剩余次数多 排序，无需复制与遍历）
         if model == "grok-4-heavy":
             field = "heavyremainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
+            token_key, remaining = self._index.select(TokenType.SUPER.value, field, skip)
         else:
             field = "remainingQueries"
-            token_key, remaining = select_best(snapshot[TokenType.NORMAL.value], field)
+            token_key, remaining = self._index.select(TokenType.NORMAL.value, field, skip)
             if token_key is None:
-                token_key, remaining = select_best(snapshot[TokenType.SUPER.value], field)
+                token_key, remaining = self._index.select(TokenType.SUPER.value, field, skip)
 
         if token_key is None:
             raise GrokApiException(
@@ -300,8 +728,11 @@ class GrokTokenManager:
                 "NO_AVAILABLE_TOKEN",
                 {
                     "model": model,
-                    "normal": len(snapshot[TokenType.NORMAL.value]),
-                    "super": len(snapshot[TokenType.SUPER.value])
+                    "normal": len(self.token_data[TokenType.NORMAL.value]),
+                    "super": len(self.token_data[TokenType.SUPER.value]),
+                    "skipped": len(skip),
+                    "cooling": len(self._cooldown.parked()),
+                    "inflight": sum(self._inflight.values())
                 }
             )
 
@@ -309,6 +740,64 @@ class GrokTokenManager:
         logger.debug(f"[Token] 分配Token: {model} ({status})")
         return token_key
     
+    def cooldown(self, auth_token: str, seconds: Optional[float] = None) -> None:
+        """让Token暂时退出选择（401/429后调用，优先使用上游的Retry-After，否则指数退避）"""
+        sso = self._extract_sso(auth_token)
+        if not sso:
+            return
+        seconds = self._cooldown.park(sso, seconds)
+        if seconds > 0:
+            logger.info(f"[Token] 冷却: {sso[:10]}... ({seconds:.0f}秒)")
+
+    def _readmit(self, sso: str) -> None:
+        """冷却到期，重新参与选择"""
+        self._index.unpark(sso)
+        self._ejected.discard(sso)
+        self._notify_waiters()
+        logger.debug(f"[Token] 冷却结束: {sso[:10]}...")
+
+    # === 健康度 ===
+
+    def record_success(self, sso: str, ttfb: Optional[float] = None, duration: Optional[float] = None) -> None:
+        """记录一次成功请求的首包延迟与总耗时（秒）"""
+        self._health.record_success(sso, ttfb, duration)
+
+    def record_error(self, sso: str, status: Any) -> None:
+        """记录一次失败请求（限流只计数，不计入错误率）"""
+        self._health.record_error(sso, status, penalize=status != RATE_LIMITED)
+
+    def _eject(self, sso: str, seconds: float) -> bool:
+        """暂时剔除异常Token（已在冷却中或剔除数达到上限时不剔除）"""
+        if sso in self._cooldown:
+            return False
+        total = sum(len(tokens) for tokens in (self.token_data or {}).values())
+        if len(self._ejected) >= self._health.max_ejected(total):
+            return False
+        self._ejected.add(sso)
+        # 剔除不计入限流退避次数，避免之后的429冷却被翻倍
+        self._cooldown.park(sso, seconds, strike=False)
+        logger.warning(f"[Token] 健康度异常，暂时剔除: {sso[:10]}... ({seconds:.0f}秒)")
+        return True
+
+    def queue_stats(self) -> Dict[str, Any]:
+        """等待队列统计（各Token池合计，pools 为分池明细）"""
+        pools = {field: queue.stats() for field, queue in self._queues.items()}
+        result: Dict[str, Any] = {key: sum(p[key] for p in pools.values())
+                                  for key in ("queued", "served", "timeout", "rejected", "waiting")}
+        waits = [p["avg_wait"] for p in pools.values() if p["avg_wait"] is not None]
+        result["avg_wait"] = max(waits) if waits else None
+        result["pools"] = pools
+        return result
+
+    def get_health(self) -> Dict[str, Dict[str, Any]]:
+        """各Token的健康统计"""
+        return self._health.snapshots()
+
+    def get_cooldowns(self) -> Dict[str, float]:
+        """各冷却中Token的剩余冷却时间（秒）"""
+        self._cooldown.advance()
+        return self._cooldown.remaining()
+
     async def check_limits(self, auth_token: str, model: str) -> Optional[Dict[str, Any]]:
         """检查速率限制"""
         try:
@@ -319,93 +808,43 @@ class GrokTokenManager:
             headers = get_dynamic_headers("/rest/rate-limits")
             headers["Cookie"] = f"{auth_token};{cf}" if cf else auth_token
 
-            # 外层重试：可配置状态码（401/429等）
-            retry_codes = setting.grok_config.get("retry_status_codes", [401, 429])
-            MAX_OUTER_RETRY = 3
-            
-            for outer_retry in range(MAX_OUTER_RETRY + 1):  # +1 确保实际重试3次
-                # 内层重试：403代理池重试
-                max_403_retries = 5
-                retry_403_count = 0
-                
-                while retry_403_count <= max_403_retries:
-                    # 异步获取代理（支持代理池）
-                    from app.core.proxy_pool import proxy_pool
-                    
-                    # 如果是403重试且使用代理池，强制刷新代理
-                    if retry_403_count > 0 and proxy_pool._enabled:
-                        logger.info(f"[Token] 403重试 {retry_403_count}/{max_403_retries}，刷新代理...")
-                        proxy = await proxy_pool.force_refresh()
-                    else:
-                        proxy = await setting.get_proxy_async("service")
-                    
-                    proxies = {"http": proxy, "https": proxy} if proxy else None
-                    
-                    async with AsyncSession() as session:
-                        response = await session.post(
-                            RATE_LIMIT_API,
-                            headers=headers,
-                            json=payload,
-                            impersonate=BROWSER,
-                            timeout=TIMEOUT,
-                            proxies=proxies
-                        )
-
-                        # 内层403重试：仅当有代理池时触发
-                        if response.status_code == 403 and proxy_pool._enabled:
-                            retry_403_count += 1
-                            
-                            if retry_403_count <= max_403_retries:
-                                logger.warning(f"[Token] 遇到403错误，正在重试 ({retry_403_count}/{max_403_retries})...")
-                                await asyncio.sleep(0.5)
-                                continue
-                            
-                            # 内层重试全部失败
-                            logger.error(f"[Token] 403错误，已重试{retry_403_count-1}次，放弃")
-                            sso = self._extract_sso(auth_token)
-                            if sso:
-                                await self.record_failure(auth_token, 403, "服务器被Block")
-                        
-                        # 检查可配置状态码错误 - 外层重试
-                        if response.status_code in retry_codes:
-                            if outer_retry < MAX_OUTER_RETRY:
-                                delay = (outer_retry + 1) * 0.1  # 渐进延迟：0.1s, 0.2s, 0.3s
-                                logger.warning(f"[Token] 遇到{response.status_code}错误，外层重试 ({outer_retry+1}/{MAX_OUTER_RETRY})，等待{delay}s...")
-                                await asyncio.sleep(delay)
-                                break  # 跳出内层循环，进入外层重试
-                            else:
-                                logger.error(f"[Token] {response.status_code}错误，已重试{outer_retry}次，放弃")
-                                sso = self._extract_sso(auth_token)
-                                if sso:
-                                    if response.status_code == 401:
-                                        await self.record_failure(auth_token, 401, "Token失效")
-                                    else:
-                                        await self.record_failure(auth_token, response.status_code, f"错误: {response.status_code}")
-                                return None
-
-                        if response.status_code == 200:
-                            data = response.json()
-                            sso = self._extract_sso(auth_token)
-                            
-                            if outer_retry > 0 or retry_403_count > 0:
-                                logger.info(f"[Token] 重试成功！")
-                            
-                            if sso:
-                                if model == "grok-4-heavy":
-                                    await self.update_limits(sso, normal=None, heavy=data.get("remainingQueries", -1))
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., heavy={data.get('remainingQueries', -1)}")
-                                else:
-                                    await self.update_limits(sso, normal=data.get("remainingTokens", -1), heavy=None)
-                                    logger.info(f"[Token] 更新限制: {sso[:10]}..., basic={data.get('remainingTokens', -1)}")
-                            
-                            return data
-                        else:
-                            # 其他错误
-                            logger.warning(f"[Token] 获取限制失败: {response.status_code}")
-                            sso = self._extract_sso(auth_token)
-                            if sso:
-                                await self.record_failure(auth_token, response.status_code, f"错误: {response.status_code}")
-                            return None
+            async def send(proxy: Optional[str]):
+                proxies = {"http": proxy, "https": proxy} if proxy else None
+                async with session_pool.acquire(proxy, BROWSER) as session:
+                    return await session.post(
+                        RATE_LIMIT_API,
+                        headers=headers,
+                        json=payload,
+                        impersonate=BROWSER,
+                        timeout=TIMEOUT,
+                        proxies=proxies
+                    )
+
+            # 403换代理、401/429退避重试由重试引擎统一处理
+            response = await retry_engine.execute(send, tag="Token")
+
+            if response.status_code != 200:
+                logger.warning(f"[Token] 获取限制失败: {response.status_code}")
+                if response.status_code == STATSIG_INVALID:
+                    reason = "服务器被Block"
+                elif response.status_code == TOKEN_INVALID:
+                    reason = "Token失效"
+                else:
+                    reason = f"错误: {response.status_code}"
+                await self.record_failure(auth_token, response.status_code, reason)
+                return None
+
+            data = response.json()
+            sso = self._extract_sso(auth_token)
+            if sso:
+                if model == "grok-4-heavy":
+                    await self.update_limits(sso, normal=None, heavy=data.get("remainingQueries", -1))
+                    logger.info(f"[Token] 更新限制: {sso[:10]}..., heavy={data.get('remainingQueries', -1)}")
+                else:
+                    await self.update_limits(sso, normal=data.get("remainingTokens", -1), heavy=None)
+                    logger.info(f"[Token] 更新限制: {sso[:10]}..., basic={data.get('remainingTokens', -1)}")
+
+            return data
 
         except Exception as e:
             logger.error(f"[Token] 检查限制错误: {e}")
@@ -416,11 +855,17 @@ class GrokTokenManager:
         try:
             for token_type in [TokenType.NORMAL.value, TokenType.SUPER.value]:
                 if sso in self.token_data[token_type]:
+                    fields = {}
                     if normal is not None:
-                        self.token_data[token_type][sso]["remainingQueries"] = normal
+                        fields["remainingQueries"] = normal
                     if heavy is not None:
-                        self.token_data[token_type][sso]["heavyremainingQueries"] = heavy
-                    self._mark_dirty()  # 批量保存
+                        fields["heavyremainingQueries"] = heavy
+                    for field, value in fields.items():
+                        self._reconcile(sso, field, value, self.token_data[token_type][sso].get(field))
+                    self.token_data[token_type][sso].update(fields)
+                    self._index.update(token_type, sso, self.token_data[token_type][sso])
+                    self._notify_waiters()
+                    await self._commit(token_type, sso, fields)
                     logger.info(f"[Token] 更新限制: {sso[:10]}...")
                     return
             logger.warning(f"[Token] 未找到: {sso[:10]}...")
@@ -438,14 +883,28 @@ class GrokTokenManager:
             if not sso:
                 return
 
-            _, data = self._find_token(sso)
+            token_type, data = self._find_token(sso)
             if not data:
                 logger.warning(f"[Token] 未找到: {sso[:10]}...")
                 return
 
-            data["failedCount"] = data.get("failedCount", 0) + 1
-            data["lastFailureTime"] = int(time.time() * 1000)
-            data["lastFailureReason"] = f"{status}: {msg}"
+            if status == RATE_LIMITED:
+                # 限流是暂时的：进入冷却（指数退避），不计入失败次数，不会因此被标记失效
+                if sso not in self._cooldown:
+                    self.cooldown(auth_token)
+                logger.warning(f"[Token] 限流: {sso[:10]}..., 原因: {msg}")
+                return
+
+            if self._shared:
+                # 失败计数在存储端原子累加，避免多进程互相覆盖
+                record = await self._storage.record_token_failure(token_type, sso, status, f"{status}: {msg}", MAX_FAILURES)
+                if record is None:
+                    return
+                data = self._replace_local(token_type, sso, record)
+            else:
+                data["failedCount"] = data.get("failedCount", 0) + 1
+                data["lastFailureTime"] = int(time.time() * 1000)
+                data["lastFailureReason"] = f"{status}: {msg}"
 
             logger.warning(
                 f"[Token] 失败: {sso[:10]}... (状态:{status}), "
@@ -456,7 +915,9 @@ class GrokTokenManager:
                 data["status"] = "expired"
                 logger.error(f"[Token] 标记失效: {sso[:10]}... (连续{status}错误{data['failedCount']}次)")
 
-            self._mark_dirty()  # 批量保存
+            if not self._shared:
+                self._index.update(token_type, sso, data)
+                self._mark_dirty(token_type, sso)  # 批量保存
 
         except Exception as e:
             logger.error(f"[Token] 记录失败错误: {e}")
@@ -467,16 +928,17 @@ class GrokTokenManager:
             sso = self._extract_sso(auth_token)
             if not sso:
                 return
+            self._cooldown.forgive(sso)
 
-            _, data = self._find_token(sso)
+            token_type, data = self._find_token(sso)
             if not data:
                 return
 
             if data.get("failedCount", 0) > 0:
-                data["failedCount"] = 0
-                data["lastFailureTime"] = None
-                data["lastFailureReason"] = None
-                self._mark_dirty()  # 批量保存
+                fields = {"failedCount": 0, "lastFailureTime": None, "lastFailureReason": None}
+                data.update(fields)
+                self._index.update(token_type, sso, data)
+                await self._commit(token_type, sso, fields)
                 logger.info(f"[Token] 重置失败计数: {sso[:10]}...")
 
         except Exception as e:
@@ -0,0 +1,166 @@
+"""Token健康度 - 按Token统计首包延迟/耗时/错误率（EWMA），用于选择排序与异常剔除"""
+
+import time
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import setting
+
+
+# 默认值
+DEFAULT_ALPHA = 0.2  # EWMA 平滑系数，越大越偏向最近的请求
+DEFAULT_MIN_SAMPLES = 5  # 参与评分/剔除前至少需要的请求数
+DEFAULT_EJECT_ERROR_RATE = 0.5  # 错误率（EWMA）达到该值时暂时剔除
+DEFAULT_EJECT_LATENCY_FACTOR = 3.0  # 首包延迟达到池平均的该倍数时暂时剔除
+DEFAULT_EJECT_SECONDS = 120  # 剔除时长（秒）
+DEFAULT_MAX_EJECT_RATIO = 0.5  # 同时被剔除的Token占比上限
+
+# 健康分分档数：选择时按档位排序，同档内仍按剩余额度排序，避免微小差异打乱额度均衡
+HEALTH_BUCKETS = 4
+
+
+class TokenHealth:
+    """单个Token的滚动统计"""
+
+    __slots__ = ("requests", "ttfb", "duration", "error_rate", "errors", "last_success", "last_error", "ejections")
+
+    def __init__(self):
+        self.requests = 0
+        self.ttfb: Optional[float] = None  # 首包延迟 EWMA（秒）
+        self.duration: Optional[float] = None  # 请求总耗时 EWMA（秒）
+        self.error_rate = 0.0  # 错误率 EWMA
+        self.errors: Dict[str, int] = {}  # 按状态码/错误码计数
+        self.last_success: Optional[int] = None  # 毫秒时间戳
+        self.last_error: Optional[int] = None
+        self.ejections = 0
+
+
+def _ewma(current: Optional[float], value: float, alpha: float) -> float:
+    return value if current is None else current + alpha * (value - current)
+
+
+class HealthTracker:
+    """Token健康度追踪
+
+    - 每次请求结束记录首包延迟、总耗时与成败，按 EWMA 平滑
+    - 健康分 = (1 - 错误率) * min(1, 池平均首包延迟 / 本Token首包延迟)，样本不足时视为健康
+    - 健康分按 HEALTH_BUCKETS 分档后交给选择索引，在途数相同时优先高分Token
+    - 错误率或首包延迟明显偏离的Token通过 on_eject 回调暂时剔除（冷却），到期后按降低后的错误率重新试用
+    """
+
+    def __init__(
+        self,
+        on_penalty: Optional[Callable[[str, int], None]] = None,
+        on_eject: Optional[Callable[[str, float], bool]] = None,
+    ):
+        self._tokens: Dict[str, TokenHealth] = {}
+        self._pool_ttfb: Optional[float] = None
+        self._penalties: Dict[str, int] = {}
+        self._on_penalty = on_penalty
+        self._on_eject = on_eject
+
+    # === 配置 ===
+
+    @staticmethod
+    def _conf(key: str, default: float) -> float:
+        return float(setting.grok_config.get(key, default))
+
+    # === 记录 ===
+
+    def record_success(self, sso: str, ttfb: Optional[float] = None, duration: Optional[float] = None) -> None:
+        """请求成功（ttfb/duration 为秒，未知时传 None）"""
+        alpha = self._conf("token_health_alpha", DEFAULT_ALPHA)
+        health = self._tokens.setdefault(sso, TokenHealth())
+        health.requests += 1
+        health.error_rate = _ewma(health.error_rate, 0.0, alpha)
+        health.last_success = int(time.time() * 1000)
+        if ttfb is not None:
+            health.ttfb = _ewma(health.ttfb, ttfb, alpha)
+            self._pool_ttfb = _ewma(self._pool_ttfb, ttfb, alpha / 4)
+        if duration is not None:
+            health.duration = _ewma(health.duration, duration, alpha)
+        self._evaluate(sso, health)
+
+    def record_error(self, sso: str, status: Any, penalize: bool = True) -> None:
+        """请求失败（status 为上游状态码或错误码；penalize=False 时只计数，不计入错误率）"""
+        health = self._tokens.setdefault(sso, TokenHealth())
+        if penalize:
+            health.requests += 1
+            health.error_rate = _ewma(health.error_rate, 1.0, self._conf("token_health_alpha", DEFAULT_ALPHA))
+        key = str(status)
+        health.errors[key] = health.errors.get(key, 0) + 1
+        health.last_error = int(time.time() * 1000)
+        self._evaluate(sso, health)
+
+    def forget(self, sso: str) -> None:
+        """Token被删除"""
+        self._tokens.pop(sso, None)
+        self._penalties.pop(sso, None)
+
+    # === 评分 ===
+
+    def score(self, sso: str) -> float:
+        health = self._tokens.get(sso)
+        if health is None or health.requests < self._conf("token_health_min_samples", DEFAULT_MIN_SAMPLES):
+            return 1.0
+        latency = 1.0
+        if health.ttfb and self._pool_ttfb:
+            latency = min(1.0, self._pool_ttfb / health.ttfb)
+        return max(0.0, (1.0 - health.error_rate) * latency)
+
+    def penalty(self, sso: str) -> int:
+        """健康分档位（0 最健康）"""
+        return self._penalties.get(sso, 0)
+
+    def _evaluate(self, sso: str, health: TokenHealth) -> None:
+        if health.requests >= self._conf("token_health_min_samples", DEFAULT_MIN_SAMPLES):
+            slow = (
+                health.ttfb is not None and self._pool_ttfb is not None
+                and health.ttfb >= self._pool_ttfb * self._conf("token_health_eject_latency_factor", DEFAULT_EJECT_LATENCY_FACTOR)
+            )
+            if slow or health.error_rate >= self._conf("token_health_eject_error_rate", DEFAULT_EJECT_ERROR_RATE):
+                self._eject(sso, health)
+
+        penalty = min(HEALTH_BUCKETS - 1, int((1.0 - self.score(sso)) * HEALTH_BUCKETS))
+        if penalty != self._penalties.get(sso, 0):
+            if penalty:
+                self._penalties[sso] = penalty
+            else:
+                self._penalties.pop(sso, None)
+            if self._on_penalty:
+                self._on_penalty(sso, penalty)
+
+    def _eject(self, sso: str, health: TokenHealth) -> None:
+        if not self._on_eject:
+            return
+        if not self._on_eject(sso, self._conf("token_health_eject_seconds", DEFAULT_EJECT_SECONDS)):
+            return
+        health.ejections += 1
+        # 到期后以减半的错误率/回到池平均的延迟重新试用，连续失败会再次被剔除
+        health.error_rate /= 2
+        if health.ttfb is not None and self._pool_ttfb:
+            health.ttfb = self._pool_ttfb
+
+    def max_ejected(self, total: int) -> int:
+        """允许同时剔除的Token数"""
+        return int(total * self._conf("token_health_max_eject_ratio", DEFAULT_MAX_EJECT_RATIO))
+
+    # === 统计 ===
+
+    def snapshot(self, sso: str) -> Optional[Dict[str, Any]]:
+        health = self._tokens.get(sso)
+        if health is None:
+            return None
+        return {
+            "score": round(self.score(sso), 3),
+            "requests": health.requests,
+            "ttfb_ms": round(health.ttfb * 1000) if health.ttfb is not None else None,
+            "duration_ms": round(health.duration * 1000) if health.duration is not None else None,
+            "error_rate": round(health.error_rate, 3),
+            "errors": dict(health.errors),
+            "last_success": health.last_success,
+            "last_error": health.last_error,
+            "ejections": health.ejections,
+        }
+
+    def snapshots(self) -> Dict[str, Dict[str, Any]]:
+        return {sso: self.snapshot(sso) for sso in self._tokens}
@@ -0,0 +1,188 @@
+"""Token选择索引 - 按(Token类型, 额度字段)维护的增量堆，选择复杂度 O(log n)"""
+
+import heapq
+from itertools import count
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+
+# 参与选择的额度字段
+QUOTA_FIELDS = ("remainingQueries", "heavyremainingQueries")
+
+# 堆元素: (在途请求数, 健康分档, 优先级, -剩余次数, 插入序号, 版本, sso, 剩余次数)
+_Entry = Tuple[int, int, int, int, int, int, str, int]
+
+# 堆大小超过Token数的倍数时清理过期条目
+_COMPACT_FACTOR = 2
+_COMPACT_MIN = 64
+
+
+class TokenIndex:
+    """Token选择索引
+
+    选择顺序：
+    - 在途请求（租约）少者优先，达到 max_load 的Token不参与选择
+    - 其次健康分档低（首包快、错误少）者优先
+    - 冷却中（park）的Token不参与选择，解除后（unpark）重新入堆
+    - 再次未使用（剩余 -1）优先，按加入顺序
+    - 再次剩余次数多者优先，相同则按加入顺序
+    - 已失效、失败次数过多、剩余为 0 的Token不入堆
+
+    每次修改Token时调用 update() 推入新版本条目，旧条目在出堆时按版本号惰性丢弃，
+    选择时无需复制或遍历全部Token。
+    """
+
+    def __init__(self, max_failures: int, max_load: int = 0):
+        self._max_failures = max_failures
+        self.max_load = max_load  # 单Token最大在途请求数，0 表示不限
+        self._heaps: Dict[Tuple[str, str], List[_Entry]] = {}
+        self._records: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._loads: Dict[str, int] = {}
+        self._parked: Set[str] = set()
+        self._penalties: Dict[str, int] = {}
+        self._versions: Dict[Tuple[str, str], int] = {}
+        self._seq: Dict[Tuple[str, str], int] = {}
+        self._sizes: Dict[str, int] = {}
+        self._counter = count()
+
+    # === 维护 ===
+
+    def rebuild(self, token_data: Dict[str, Dict[str, Any]]) -> None:
+        """根据完整数据重建索引（加载/重新加载后调用，在途请求数、健康分档与冷却状态保留）"""
+        self._heaps.clear()
+        self._records.clear()
+        self._versions.clear()
+        self._seq.clear()
+        self._sizes.clear()
+        self._counter = count()
+        for token_type, tokens in token_data.items():
+            for sso, data in tokens.items():
+                self.update(token_type, sso, data)
+
+    def update(self, token_type: str, sso: str, data: Optional[Dict[str, Any]]) -> None:
+        """Token新增/修改/删除（data为None）后调用"""
+        key = (token_type, sso)
+        version = self._versions.get(key, 0) + 1
+        self._versions[key] = version
+        if data is None:
+            self._records.pop(key, None)
+            if self._seq.pop(key, None) is not None:
+                self._sizes[token_type] -= 1
+            return
+
+        self._records[key] = data
+
+        seq = self._seq.get(key)
+        if seq is None:
+            seq = self._seq[key] = next(self._counter)
+            self._sizes[token_type] = self._sizes.get(token_type, 0) + 1
+
+        load = self._loads.get(sso, 0)
+        penalty = self._penalties.get(sso, 0)
+        eligible = (
+            data.get("status") != "expired"
+            and data.get("failedCount", 0) < self._max_failures
+            and (self.max_load <= 0 or load < self.max_load)
+            and sso not in self._parked
+        )
+        for field in QUOTA_FIELDS:
+            heap_key = (token_type, field)
+            heap = self._heaps.setdefault(heap_key, [])
+            if not eligible:
+                continue
+            remaining = int(data.get(field, -1))
+            if remaining == -1:
+                entry = (load, penalty, 0, 0, seq, version, sso, remaining)
+            elif remaining > 0:
+                entry = (load, penalty, 1, -remaining, seq, version, sso, remaining)
+            else:
+                continue
+            heapq.heappush(heap, entry)
+            self._maybe_compact(heap_key)
+
+    def set_load(self, sso: str, load: int) -> None:
+        """更新Token的在途请求数并重新排序"""
+        if load > 0:
+            self._loads[sso] = load
+        else:
+            self._loads.pop(sso, None)
+        self._refresh(sso)
+
+    def set_penalty(self, sso: str, penalty: int) -> None:
+        """更新Token的健康分档并重新排序"""
+        if penalty == self._penalties.get(sso, 0):
+            return
+        if penalty > 0:
+            self._penalties[sso] = penalty
+        else:
+            self._penalties.pop(sso, None)
+        self._refresh(sso)
+
+    def park(self, sso: str) -> None:
+        """Token进入冷却，暂不参与选择"""
+        if sso not in self._parked:
+            self._parked.add(sso)
+            self._refresh(sso)
+
+    def unpark(self, sso: str) -> None:
+        """Token冷却结束，重新参与选择"""
+        if sso in self._parked:
+            self._parked.discard(sso)
+            self._refresh(sso)
+
+    def _refresh(self, sso: str) -> None:
+        for token_type in list(self._sizes):
+            data = self._records.get((token_type, sso))
+            if data is not None:
+                self.update(token_type, sso, data)
+
+    def set_max_load(self, max_load: int) -> None:
+        """修改单Token在途上限（需要重排全部条目）"""
+        if max_load == self.max_load:
+            return
+        self.max_load = max_load
+        records = list(self._records.items())
+        for (token_type, sso), data in records:
+            self.update(token_type, sso, data)
+
+    def get_load(self, sso: str) -> int:
+        return self._loads.get(sso, 0)
+
+    def _is_current(self, token_type: str, entry: _Entry) -> bool:
+        return self._versions.get((token_type, entry[6])) == entry[5]
+
+    def _maybe_compact(self, heap_key: Tuple[str, str]) -> None:
+        """过期条目过多时丢弃并重建堆（每个Token在每个堆中至多一条有效条目）"""
+        heap = self._heaps[heap_key]
+        token_type = heap_key[0]
+        if len(heap) <= max(_COMPACT_MIN, self._sizes.get(token_type, 0) * _COMPACT_FACTOR):
+            return
+        heap[:] = [e for e in heap if self._is_current(token_type, e)]
+        heapq.heapify(heap)
+
+    # === 选择 ===
+
+    def select(self, token_type: str, field: str, skip: Optional[Iterable[str]] = None) -> Tuple[Optional[str], Optional[int]]:
+        """选择最佳Token，返回 (sso, 剩余次数)；skip 中的Token会被跳过但保留在索引中"""
+        heap_key = (token_type, field)
+        heap = self._heaps.get(heap_key)
+        if not heap:
+            return None, None
+
+        skip_set: Set[str] = skip if isinstance(skip, set) else set(skip or ())
+        skipped: List[_Entry] = []
+        result: Tuple[Optional[str], Optional[int]] = (None, None)
+
+        while heap:
+            entry = heap[0]
+            if not self._is_current(token_type, entry):
+                heapq.heappop(heap)
+                continue
+            if entry[6] in skip_set:
+                skipped.append(heapq.heappop(heap))
+                continue
+            result = (entry[6], entry[7])
+            break
+
+        for entry in skipped:
+            heapq.heappush(heap, entry)
+        return result
@@ -0,0 +1,179 @@
+"""Token等待队列 - 无可用Token时有界排队等待，而不是立即返回 NO_AVAILABLE_TOKEN"""
+
+import asyncio
+import heapq
+import math
+import time
+from itertools import count
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import setting
+from app.core.exception import GrokApiException
+
+
+# 默认值
+DEFAULT_QUEUE_SIZE = 0  # 最大排队请求数，0 表示关闭排队（默认关闭）
+DEFAULT_QUEUE_TIMEOUT = 10.0  # 单个请求最长等待时间（秒）
+DEFAULT_QUEUE_ORDER = "fifo"  # fifo: 先到先得; priority: 按优先级（数值小者优先）再按到达顺序
+POLL_INTERVAL = 0.5  # 未被唤醒时的重试间隔（秒），覆盖冷却到期/额度恢复等无通知的情况
+
+# 队列元素: (优先级, 到达序号, 交付结果, 获取函数, 未被领取时的清理回调)
+_Waiter = Tuple[int, int, asyncio.Future, Callable[[], Awaitable[Any]], Optional[Callable[[Any], Awaitable[None]]]]
+
+
+class TokenWaitQueue:
+    """Token等待队列
+
+    - 每个Token池（额度字段）一个队列，同一队列的等待者竞争同一批Token，队首无法获得时其后也无法获得
+    - 选择失败（NO_AVAILABLE_TOKEN）的请求进入有界队列，在截止时间内等待租约释放或冷却到期；
+      队列非空时同一池的新请求直接排队，不与等待者争抢
+    - 租约释放、冷却到期、额度更新时 notify() 只为队首等待者获取Token并直接交给它，
+      成功后继续下一位，队首仍无法获得时停止；另由队首以 POLL_INTERVAL 兜底轮询
+    - 队列已满时立即拒绝（QUEUE_FULL，对应 429 + Retry-After）；等待超时则返回原错误
+    """
+
+    def __init__(self):
+        self._heap: List[_Waiter] = []
+        self._counter = count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._renotify = False  # 交付进行中又收到通知
+        self._avg_wait: Optional[float] = None  # 成功等待耗时 EWMA，用于估算 Retry-After
+        self._stats: Dict[str, int] = {"queued": 0, "served": 0, "timeout": 0, "rejected": 0}
+
+    # === 配置 ===
+
+    @staticmethod
+    def max_size() -> int:
+        return max(0, int(setting.grok_config.get("token_queue_size", DEFAULT_QUEUE_SIZE)))
+
+    @staticmethod
+    def _timeout() -> float:
+        return max(0.0, float(setting.grok_config.get("token_queue_timeout", DEFAULT_QUEUE_TIMEOUT)))
+
+    @staticmethod
+    def _ordered() -> bool:
+        return setting.grok_config.get("token_queue_order", DEFAULT_QUEUE_ORDER) == "priority"
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size() > 0 and self._timeout() > 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    # === 等待 ===
+
+    def retry_after(self) -> int:
+        """建议客户端的重试间隔（秒）"""
+        return max(1, math.ceil(self._avg_wait if self._avg_wait is not None else POLL_INTERVAL))
+
+    async def wait(
+        self,
+        attempt: Callable[[], Awaitable[Any]],
+        error: GrokApiException,
+        priority: int = 0,
+        discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> Any:
+        """排队直到轮到自己且 attempt() 成功；attempt 抛出 NO_AVAILABLE_TOKEN 表示仍无可用Token
+
+        Args:
+            attempt: 获取函数，由队列在轮到该等待者时调用
+            error: 等待超时时抛出的错误
+            priority: priority 模式下的优先级，数值小者优先
+            discard: 获取成功但等待者已离开（超时/取消）时的清理回调
+        """
+        if len(self._heap) >= self.max_size():
+            self._stats["rejected"] += 1
+            retry_after = self.retry_after()
+            raise GrokApiException(
+                "请求排队已满，请稍后重试",
+                "QUEUE_FULL",
+                {**error.details, "queued": len(self._heap), "retry_after": retry_after}
+            )
+
+        self._stats["queued"] += 1
+        started = time.monotonic()
+        deadline = started + self._timeout()
+        future = asyncio.get_running_loop().create_future()
+        waiter: _Waiter = (priority if self._ordered() else 0, next(self._counter), future, attempt, discard)
+        heapq.heappush(self._heap, waiter)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeout"] += 1
+                    raise error
+                try:
+                    result = await asyncio.wait_for(asyncio.shield(future), min(POLL_INTERVAL, remaining))
+                except asyncio.TimeoutError:
+                    # 兜底轮询（冷却到期/额度恢复等无通知的情况）只由队首发起
+                    if self._heap and self._heap[0] is waiter:
+                        self.notify()
+                    continue
+
+                waited = time.monotonic() - started
+                self._avg_wait = waited if self._avg_wait is None else self._avg_wait + 0.2 * (waited - self._avg_wait)
+                self._stats["served"] += 1
+                return result
+        finally:
+            self._remove(waiter)
+            if not future.done():
+                future.cancel()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        for i, item in enumerate(self._heap):
+            if item[1] == waiter[1]:
+                self._heap[i] = self._heap[-1]
+                self._heap.pop()
+                if i < len(self._heap):
+                    heapq.heapify(self._heap)
+                return
+
+    def notify(self) -> None:
+        """可能有Token可用了：为队首等待者获取Token（已在交付中则交付结束前再检查一次）"""
+        if not self._heap:
+            return
+        if self._dispatcher is not None and not self._dispatcher.done():
+            self._renotify = True
+            return
+        try:
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+        except RuntimeError:
+            # 不在事件循环中（如解释器退出时回收租约），由队首轮询兜底
+            pass
+
+    async def _dispatch(self) -> None:
+        """按队列顺序交付：队首获取成功则交给它并继续下一位，失败则停止"""
+        while self._heap:
+            self._renotify = False
+            waiter = self._heap[0]
+            future, attempt, discard = waiter[2], waiter[3], waiter[4]
+            try:
+                result = await attempt()
+            except Exception as e:
+                if isinstance(e, GrokApiException) and e.error_code == "NO_AVAILABLE_TOKEN":
+                    if self._renotify:
+                        continue
+                    return
+                # 其他错误交给该等待者
+                self._remove(waiter)
+                if not future.done():
+                    future.set_exception(e)
+                continue
+
+            self._remove(waiter)
+            if future.done():
+                # 等待者已离开：交还获取到的Token
+                if discard:
+                    await discard(result)
+                continue
+            future.set_result(result)
+
+    # === 统计 ===
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "waiting": len(self._heap),
+            "avg_wait": round(self._avg_wait, 3) if self._avg_wait is not None else None,
+        }
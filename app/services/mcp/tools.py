@@ -45,25 +45,29 @@ async def ask_grok_impl(
 
         # 收集所有流式响应块
         content_parts = []
-        async for chunk in response_iterator:
-            if isinstance(chunk, bytes):
-                chunk = chunk.decode('utf-8')
+        try:
+            async for chunk in response_iterator:
+                if isinstance(chunk, bytes):
+                    chunk = chunk.decode('utf-8')
 
-            # 解析SSE格式
-            if chunk.startswith("data: "):
-                data_str = chunk[6:].strip()
-                if data_str == "[DONE]":
-                    break
+                # 解析SSE格式
+                if chunk.startswith("data: "):
+                    data_str = chunk[6:].strip()
+                    if data_str == "[DONE]":
+                        break
 
-                try:
-                    data = json.loads(data_str)
-                    choices = data.get("choices", [])
-                    if choices:
-                        delta = choices[0].get("delta", {})
-                        if content := delta.get("content"):
-                            content_parts.append(content)
-                except json.JSONDecodeError:
-                    continue
+                    try:
+                        data = json.loads(data_str)
+                        choices = data.get("choices", [])
+                        if choices:
+                            delta = choices[0].get("delta", {})
+                            if content := delta.get("content"):
+                                content_parts.append(content)
+                    except json.JSONDecodeError:
+                        continue
+        finally:
+            # 提前结束（[DONE]）时也要关闭流，释放上游连接与Token租约
+            await response_iterator.aclose()
 
         result = "".join(content_parts)
         logger.info(f"[MCP] ask_grok 完成, 响应长度: {len(result)}")
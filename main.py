@@ -40,13 +40,14 @@ async def lifespan(app: FastAPI):
     启动顺序:
     1. 初始化核心服务 (storage, settings, token_manager)
     2. 异步加载 token 数据
-    3. 启动批量保存任务
+    3. 启动批量保存任务与额度巡检任务
     4. 启动MCP服务生命周期
     
     关闭顺序 (LIFO):
     1. 关闭MCP服务生命周期
-    2. 关闭批量保存任务并刷新数据
-    3. 关闭核心服务
+    2. 关闭额度巡检任务、批量保存任务并刷新数据
+    3. 关闭HTTP会话池
+    4. 关闭核心服务
     """
     # --- 启动过程 ---
     # 1. 初始化核心服务
@@ -74,6 +75,8 @@ async def lifespan(app: FastAPI):
     
     # 4. 启动批量保存任务
     await token_manager.start_batch_save()
+    from app.services.grok.quota_sweeper import quota_sweeper
+    quota_sweeper.start()
 
     # 5. 管理MCP服务的生命周期
     mcp_lifespan_context = mcp_app.lifespan(app)
@@ -90,11 +93,16 @@ async def lifespan(app: FastAPI):
         await mcp_lifespan_context.__aexit__(None, None, None)
         logger.info("[MCP] MCP服务已关闭")
         
-        # 2. 关闭批量保存任务并刷新数据
+        # 2. 关闭额度巡检任务、批量保存任务并刷新数据
+        await quota_sweeper.stop()
         await token_manager.shutdown()
         logger.info("[Token] Token管理器已关闭")
         
-        # 3. 关闭核心服务
+        # 3. 关闭HTTP会话池
+        from app.core.session_pool import session_pool
+        await session_pool.close()
+
+        # 4. 关闭核心服务
         await storage_manager.close()
         logger.info("[Grok2API] 应用关闭成功")
 
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+SSE 帧编码微基准
+
+对比 process_stream 原先的逐块 pydantic 编码（三个模型 + uuid4 + time.time + model_dump_json + str）
+与 SSEEncoder 的预编译前缀字节拼接，统计每秒可编码的分片数；分片内容取自中英混合的模拟回答。
+
+用法:
+    python test/bench_sse_encode.py
+    python test/bench_sse_encode.py --chunks 2000 --rounds 50
+"""
+
+import argparse
+import sys
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.models.openai_schema import (  # noqa: E402
+    OpenAIChatCompletionChunkChoice,
+    OpenAIChatCompletionChunkMessage,
+    OpenAIChatCompletionChunkResponse,
+)
+from app.services.grok.processer import SSEEncoder  # noqa: E402
+
+MODEL = "grok-4-mini-thinking-tahoe"
+TOKENS = ["The", " quick", " 狐狸", " jumps", " over", " \"lazy\"", " dog", ".\n", "代码", "\t<b>"]
+
+
+def legacy_chunk(content: str, finish: str = None) -> str:
+    """原实现: 每个分片构造 pydantic 模型"""
+    chunk_data = OpenAIChatCompletionChunkResponse(
+        id=f"chatcmpl-{uuid.uuid4()}",
+        created=int(time.time()),
+        model=MODEL,
+        choices=[OpenAIChatCompletionChunkChoice(
+            index=0,
+            delta=OpenAIChatCompletionChunkMessage(
+                role="assistant",
+                content=content
+            ) if content else {},
+            finish_reason=finish
+        )]
+    )
+    return f"data: {chunk_data.model_dump_json()}\n\n"
+
+
+def run_legacy(chunks: int) -> int:
+    size = 0
+    for i in range(chunks):
+        size += len(legacy_chunk(TOKENS[i % len(TOKENS)]).encode())
+    return size + len(legacy_chunk("", "stop").encode())
+
+
+def run_encoder(chunks: int) -> int:
+    encoder = SSEEncoder(MODEL)
+    size = 0
+    for i in range(chunks):
+        size += len(encoder.chunk(TOKENS[i % len(TOKENS)]))
+    return size + len(encoder.chunk("", "stop"))
+
+
+def bench(fn, chunks: int, rounds: int) -> float:
+    """返回每秒分片数（取多轮中最快一轮）"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(chunks)
+        best = min(best, time.perf_counter() - start)
+    return (chunks + 1) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SSE 帧编码微基准")
+    parser.add_argument("--chunks", type=int, default=2000, help="每条流的分片数")
+    parser.add_argument("--rounds", type=int, default=20, help="重复轮数")
+    args = parser.parse_args()
+
+    legacy = bench(run_legacy, args.chunks, args.rounds)
+    encoder = bench(run_encoder, args.chunks, args.rounds)
+
+    print(f"{'实现':<10} | {'分片/秒':>12} | {'单流耗时(ms)':>12}")
+    print("-" * 42)
+    for name, rate in (("pydantic", legacy), ("SSEEncoder", encoder)):
+        print(f"{name:<10} | {rate:>12,.0f} | {(args.chunks + 1) / rate * 1000:>12.2f}")
+    print(f"\n加速比: {encoder / legacy:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
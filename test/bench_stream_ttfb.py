@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+流式首包延迟(TTFB)基准测试
+
+在本地启动一个模拟Grok的NDJSON流式服务，并发打开 10~500 条流，
+经 UpstreamStream + GrokResponseProcessor.process_stream 完整处理，
+统计每条流的首个SSE帧耗时。其中混入若干"慢流"（长时间不出数据），
+用于验证单条慢流不会拖住事件循环上的其他请求。
+
+用法:
+    python test/bench_stream_ttfb.py
+    python test/bench_stream_ttfb.py --levels 10,100,500 --slow 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import orjson
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+from app.core.session_pool import session_pool  # noqa: E402
+from app.services.grok.processer import GrokResponseProcessor  # noqa: E402
+from app.services.grok.stream import UpstreamStream  # noqa: E402
+
+
+def _line(token: str) -> bytes:
+    return orjson.dumps({"result": {"response": {"token": token, "isThinking": False}}}) + b"\n"
+
+
+async def _handle_stream(request: web.Request) -> web.StreamResponse:
+    """模拟上游: 首包延迟后按固定间隔输出token"""
+    first_delay = float(request.query.get("first", "0.05"))
+    interval = float(request.query.get("interval", "0.01"))
+    tokens = int(request.query.get("tokens", "20"))
+
+    resp = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await resp.prepare(request)
+    await asyncio.sleep(first_delay)
+    for i in range(tokens):
+        await resp.write(_line(f"t{i} "))
+        await asyncio.sleep(interval)
+    await resp.write_eof()
+    return resp
+
+
+async def _consume(url: str) -> float:
+    """完整消费一条流，返回首帧耗时(秒)"""
+    start = time.perf_counter()
+    handle = await session_pool.checkout()
+    response = await handle.session.get(url, stream=True, timeout=120)
+    ttfb = None
+    async for _ in GrokResponseProcessor.process_stream(UpstreamStream(response, handle.release), ""):
+        if ttfb is None:
+            ttfb = time.perf_counter() - start
+    return ttfb if ttfb is not None else time.perf_counter() - start
+
+
+async def run_level(base: str, concurrency: int, slow: int) -> list:
+    """运行一个并发级别"""
+    fast_url = f"{base}/stream?first=0.05&interval=0.01&tokens=20"
+    slow_url = f"{base}/stream?first=5&interval=0.5&tokens=4"
+
+    slow_tasks = [asyncio.create_task(_consume(slow_url)) for _ in range(slow)]
+    await asyncio.sleep(0.05)
+    results = await asyncio.gather(*[_consume(fast_url) for _ in range(concurrency)])
+    for task in slow_tasks:
+        task.cancel()
+    await asyncio.gather(*slow_tasks, return_exceptions=True)
+    return results
+
+
+def _pct(values: list, p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="流式首包延迟基准测试")
+    parser.add_argument("--levels", default="10,50,100,250,500", help="并发级别，逗号分隔")
+    parser.add_argument("--slow", type=int, default=3, help="同时存在的慢流数量")
+    parser.add_argument("--port", type=int, default=18765, help="模拟上游端口")
+    args = parser.parse_args()
+
+    app = web.Application()
+    app.router.add_get("/stream", _handle_stream)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port, backlog=2048).start()
+    base = f"http://127.0.0.1:{args.port}"
+
+    print(f"{'并发':>6} | {'P50(ms)':>8} | {'P95(ms)':>8} | {'P99(ms)':>8} | {'最大(ms)':>8}")
+    print("-" * 52)
+    try:
+        for level in [int(x) for x in args.levels.split(",") if x]:
+            ttfb = await run_level(base, level, args.slow)
+            print(
+                f"{level:>6} | {statistics.median(ttfb)*1000:>8.1f} | {_pct(ttfb, 0.95)*1000:>8.1f} | "
+                f"{_pct(ttfb, 0.99)*1000:>8.1f} | {max(ttfb)*1000:>8.1f}"
+            )
+        stats = session_pool.stats()
+        print(f"\n会话命中: {stats['session_hits']}/{stats['requests']} (新建 {stats['created']})")
+    finally:
+        await session_pool.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
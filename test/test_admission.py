@@ -0,0 +1,80 @@
+import asyncio
+import unittest
+
+
+def _controller(limit: int, queue_size: int = 10, timeout: float = 5.0, adaptive: bool = True):
+    from app.core.admission import AdmissionController
+
+    return AdmissionController("test", lambda: limit, lambda: queue_size, lambda: timeout, adaptive=adaptive)
+
+
+class TestAdmissionController(unittest.TestCase):
+    def test_queues_beyond_limit_and_rejects_when_full(self) -> None:
+        from app.core.exception import GrokApiException
+
+        async def run():
+            controller = _controller(limit=2, queue_size=1)
+            first = await controller.acquire()
+            second = await controller.acquire()
+
+            waiter = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            self.assertEqual(controller.stats()["queue_depth"], 1)
+
+            with self.assertRaises(GrokApiException) as ctx:
+                await controller.acquire()
+            self.assertEqual(ctx.exception.error_code, "QUEUE_FULL")
+
+            first.release()
+            third = await waiter
+            self.assertEqual(controller.stats()["inflight"], 2)
+            self.assertEqual(controller.stats()["rejected"], 1)
+            second.release()
+            third.release()
+
+        asyncio.run(run())
+
+    def test_overload_shrinks_limit_and_success_recovers_it(self) -> None:
+        async def run():
+            controller = _controller(limit=20)
+            permit = await controller.acquire()
+            permit.release(overloaded=True)
+            shrunk = controller.stats()["limit"]
+            self.assertLess(shrunk, 20)
+
+            # 充分使用上限的正常请求逐步恢复到配置值
+            for _ in range(400):
+                permits = [await controller.acquire() for _ in range(int(controller.stats()["limit"]))]
+                for p in permits:
+                    p.release(latency=0.1)
+            self.assertEqual(controller.stats()["limit"], 20)
+
+        asyncio.run(run())
+
+
+    def test_try_acquire_and_latency_sample(self) -> None:
+        from app.core.admission import bind_permit, note_latency
+
+        async def run():
+            controller = _controller(limit=1)
+            permit = await controller.acquire()
+            # 已达上限：对冲等额外请求不排队，直接放弃
+            self.assertIsNone(controller.try_acquire())
+
+            # 只有作用域内记录的上游延迟作为样本
+            note_latency(5.0)
+            self.assertIsNone(permit.latency)
+            with bind_permit(permit):
+                note_latency(0.2)
+            permit.release(latency=permit.latency)
+            self.assertEqual(controller.stats()["latency_short"], 0.2)
+
+            extra = controller.try_acquire()
+            self.assertIsNotNone(extra)
+            extra.release()
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import random
+import unittest
+from unittest import mock
+
+
+class _Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestTimingWheel(unittest.TestCase):
+    def test_expires_each_key_once_at_deadline(self) -> None:
+        from app.services.grok.cooldown import TimingWheel
+
+        rng = random.Random(3)
+        clock = _Clock()
+        wheel = TimingWheel(tick=1.0, slots=16, clock=clock)
+        deadlines = {}
+        for i in range(300):
+            deadlines[i] = clock.now + rng.uniform(0, 100)
+            wheel.add(i, deadlines[i])
+
+        # 改期与移除
+        for i in range(0, 300, 7):
+            deadlines[i] = clock.now + rng.uniform(0, 100)
+            wheel.add(i, deadlines[i])
+        for i in range(0, 300, 11):
+            wheel.remove(i)
+            deadlines.pop(i)
+
+        seen = set()
+        while clock.now < 1120:
+            clock.now += rng.uniform(0.1, 20)
+            for key in wheel.advance():
+                self.assertNotIn(key, seen)
+                self.assertLessEqual(deadlines[key], clock.now)
+                seen.add(key)
+            # 到期后至多晚一个刻度
+            for key, deadline in deadlines.items():
+                if deadline + 1.0 <= clock.now:
+                    self.assertIn(key, seen)
+        self.assertEqual(seen, set(deadlines))
+        self.assertEqual(len(wheel), 0)
+
+
+class TestCooldownScheduler(unittest.TestCase):
+    def test_parked_token_leaves_index_and_returns(self) -> None:
+        from app.services.grok.cooldown import CooldownScheduler
+        from app.services.grok.token_index import TokenIndex
+
+        clock = _Clock()
+        index = TokenIndex(max_failures=3)
+        for sso, remaining in (("a", 50), ("b", 10)):
+            index.update("ssoNormal", sso, {"remainingQueries": remaining, "failedCount": 0})
+        scheduler = CooldownScheduler(on_park=index.park, on_expire=index.unpark, clock=clock)
+
+        self.assertEqual(scheduler.park("a", 30), 30)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries")[0], "b")
+
+        clock.now += 29
+        self.assertEqual(scheduler.advance(), [])
+        clock.now += 2
+        self.assertEqual(scheduler.advance(), ["a"])
+        self.assertEqual(index.select("ssoNormal", "remainingQueries")[0], "a")
+
+    def test_backoff_doubles_until_forgiven(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.cooldown import CooldownScheduler
+
+        conf = {"token_cooldown_seconds": 10, "token_cooldown_max_seconds": 35}
+        with mock.patch.dict(setting.grok_config, conf):
+            clock = _Clock()
+            scheduler = CooldownScheduler(clock=clock)
+
+            delays = []
+            for _ in range(4):
+                delays.append(scheduler.park("a"))
+                clock.now += 100
+                scheduler.advance()
+            self.assertTrue(8 <= delays[0] <= 10)
+            self.assertTrue(16 <= delays[1] <= 20)
+            self.assertTrue(28 <= delays[3] <= 35)
+
+            scheduler.forgive("a")
+            self.assertLessEqual(scheduler.park("a"), 10)
+
+            # 健康度剔除等不计入退避次数的暂停不会让下一次限流冷却翻倍
+            scheduler.forgive("a")
+            clock.now += 100
+            scheduler.advance()
+            scheduler.park("a", 5, strike=False)
+            clock.now += 100
+            scheduler.advance()
+            self.assertLessEqual(scheduler.park("a"), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
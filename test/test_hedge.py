@@ -0,0 +1,111 @@
+import asyncio
+import unittest
+from unittest import mock
+
+
+class TestHedgedStream(unittest.TestCase):
+    def test_backup_wins_and_slow_primary_is_cancelled(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.hedge import HedgePolicy, hedged_stream
+
+        closed = []
+
+        async def upstream(name, delay):
+            try:
+                await asyncio.sleep(delay)
+                yield f"{name}-1"
+                yield f"{name}-2"
+            finally:
+                closed.append(name)
+
+        async def run():
+            policy = HedgePolicy()
+            policy._credit = 1.0
+
+            async def backup():
+                return upstream("backup", 0.0)
+
+            return [chunk async for chunk in hedged_stream(upstream("primary", 5.0), backup, policy)], policy
+
+        with mock.patch.dict(setting.grok_config, {"hedge_min_delay": 0.05, "hedge_budget_ratio": 0.0}):
+            chunks, policy = asyncio.run(run())
+
+        self.assertEqual(chunks, ["backup-1", "backup-2"])
+        self.assertEqual(sorted(closed), ["backup", "primary"])
+        stats = policy.stats()
+        self.assertEqual((stats["hedged"], stats["backup_won"]), (1, 1))
+
+    def test_budget_limits_hedges(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.hedge import HedgePolicy, hedged_stream
+
+        started = []
+
+        async def upstream(delay):
+            await asyncio.sleep(delay)
+            yield "data"
+
+        async def run():
+            policy = HedgePolicy()
+
+            async def backup():
+                started.append(1)
+                return upstream(0.0)
+
+            for _ in range(3):
+                [chunk async for chunk in hedged_stream(upstream(0.1), backup, policy)]
+            return policy
+
+        with mock.patch.dict(setting.grok_config, {"hedge_min_delay": 0.01, "hedge_budget_ratio": 0.5}):
+            policy = asyncio.run(run())
+
+        # 每个请求积累 0.5 次额度：3 个慢请求中只有第 2 个能对冲
+        self.assertEqual(len(started), 1)
+        self.assertEqual(policy.stats()["budget_denied"], 2)
+
+
+    def test_failed_first_frame_does_not_win(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.hedge import HedgePolicy, hedged_stream
+        from app.services.grok.processer import FailureFrame
+
+        async def timed_out():
+            await asyncio.sleep(0.1)
+            yield FailureFrame(b"stop", "STREAM_TIMEOUT")
+
+        async def slow_backup():
+            await asyncio.sleep(0.2)
+            yield "backup-1"
+
+        async def run():
+            policy = HedgePolicy()
+            policy._credit = 1.0
+
+            async def backup():
+                return slow_backup()
+
+            return [chunk async for chunk in hedged_stream(timed_out(), backup, policy)], policy
+
+        with mock.patch.dict(setting.grok_config, {"hedge_min_delay": 0.05, "hedge_budget_ratio": 0.0}):
+            chunks, policy = asyncio.run(run())
+
+        self.assertEqual(chunks, ["backup-1"])
+        self.assertEqual(policy.stats()["backup_won"], 1)
+
+        # 没有其他路可等时照常转发失败帧，但不计入首包延迟
+        async def alone():
+            policy = HedgePolicy()
+            chunks = [chunk async for chunk in hedged_stream(timed_out(), backup_none, policy)]
+            return chunks, policy
+
+        async def backup_none():
+            return None
+
+        with mock.patch.dict(setting.grok_config, {"hedge_min_delay": 5.0}):
+            chunks, policy = asyncio.run(alone())
+        self.assertEqual(chunks, [b"stop"])
+        self.assertEqual(len(policy._samples), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import asyncio
+import base64
+import os
+import unittest
+from unittest import mock
+
+
+class _FakeImage:
+    def __init__(self, data: bytes, sizes):
+        self._data = data
+        self._sizes = sizes
+        self.closed = False
+
+    async def aiter_bytes(self):
+        pos = 0
+        for size in self._sizes:
+            yield self._data[pos:pos + size]
+            pos += size
+        yield self._data[pos:]
+
+    async def aclose(self):
+        self.closed = True
+
+
+class TestStreamingBase64(unittest.TestCase):
+    def test_incremental_encoding_matches_full_encoding(self) -> None:
+        from app.services.grok.cache import image_cache_service
+
+        data = os.urandom(50_000)
+        upstream = _FakeImage(data, [1, 2, 4, 5, 7000, 16384, 3])
+
+        async def open_stream(path, token):
+            return upstream
+
+        async def run():
+            return [part async for part in image_cache_service.stream_base64("/u/x.png", "")]
+
+        with mock.patch.object(image_cache_service, "_open_stream", open_stream):
+            parts = asyncio.run(run())
+
+        self.assertEqual(parts[0], "data:image/png;base64,")
+        self.assertEqual("".join(parts[1:]), base64.b64encode(data).decode())
+        self.assertLessEqual(max(len(part) for part in parts), 8192)
+        self.assertTrue(upstream.closed)
+        self.assertIsNone(image_cache_service.get_cached("/u/x.png"))
+
+    def test_stream_falls_back_to_assets_url(self) -> None:
+        from app.services.grok.cache import image_cache_service
+        from app.services.grok.processer import GrokResponseProcessor
+
+        async def open_stream(path, token):
+            raise RuntimeError("下载失败，状态码: 404")
+
+        async def run():
+            return "".join([part async for part in GrokResponseProcessor._stream_image_base64("u/x.png", "")])
+
+        with mock.patch.object(image_cache_service, "_open_stream", open_stream):
+            self.assertEqual(asyncio.run(run()), "![Generated Image](https://assets.grok.com/u/x.png)\n")
+
+
+    def test_failures_before_and_after_first_block(self) -> None:
+        from app.services.grok.cache import image_cache_service
+        from app.services.grok.processer import GrokResponseProcessor
+
+        class _Broken(_FakeImage):
+            def __init__(self, before):
+                super().__init__(b"", [])
+                self._before = before
+
+            async def aiter_bytes(self):
+                for chunk in self._before:
+                    yield chunk
+                raise ConnectionError("连接中断")
+
+        def run(upstream):
+            async def open_stream(path, token):
+                return upstream
+
+            async def collect():
+                return [part async for part in GrokResponseProcessor._stream_image_base64("u/x.png", "")]
+
+            with mock.patch.object(image_cache_service, "_open_stream", open_stream):
+                return asyncio.run(collect())
+
+        # 第一块数据到达前失败：尚未输出任何内容，整体回退为上游地址
+        self.assertEqual(run(_Broken([])), ["![Generated Image](https://assets.grok.com/u/x.png)\n"])
+
+        # 开始输出后失败：只结束当前图片，不再追加回退内容
+        parts = run(_Broken([b"abc", b"def"]))
+        self.assertEqual(parts[0], "![Generated Image](data:image/png;base64,YWJj")
+        self.assertEqual(parts[1:], ["ZGVm", ")\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
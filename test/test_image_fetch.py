@@ -0,0 +1,41 @@
+import asyncio
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class TestImageFetch(unittest.TestCase):
+    def test_images_are_fetched_concurrently_in_order_with_fallback(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.cache import image_cache_service
+        from app.services.grok.processer import GrokResponseProcessor
+
+        delays = {"/u/a.jpg": 0.2, "/u/b.jpg": 0.05, "/u/slow.jpg": 5.0}
+
+        async def download_image(path, token):
+            await asyncio.sleep(delays[path])
+            return Path("/tmp") / path.strip("/")
+
+        async def run():
+            started = time.monotonic()
+            content = await GrokResponseProcessor._append_images("图片:", ["u/a.jpg", "u/b.jpg", "u/slow.jpg"], "")
+            return content, time.monotonic() - started
+
+        with mock.patch.object(image_cache_service, "download_image", download_image), \
+                mock.patch.object(GrokResponseProcessor, "_fetch_sem", None), \
+                mock.patch.dict(setting.global_config, {"image_mode": "url", "base_url": "", "image_fetch_timeout": 0.3}):
+            content, elapsed = asyncio.run(run())
+
+        # 并发下载：总耗时约为单张超时，而不是各张耗时之和
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(content.split("\n"), [
+            "图片:",
+            "![Generated Image](/images/u-a.jpg)",
+            "![Generated Image](/images/u-b.jpg)",
+            "![Generated Image](https://assets.grok.com/u/slow.jpg)",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
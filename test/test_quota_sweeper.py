@@ -0,0 +1,60 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+
+class TestQuotaSweeper(unittest.TestCase):
+    def test_single_sweeper_is_elected(self) -> None:
+        from app.core.storage import FileStorage
+
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = FileStorage(Path(tmp))
+
+            async def run():
+                first = await storage.acquire_lease("quota_sweeper", "w1", 60)
+                second = await storage.acquire_lease("quota_sweeper", "w2", 60)
+                renewed = await storage.acquire_lease("quota_sweeper", "w1", 0.01)
+                await asyncio.sleep(0.02)
+                # 持有者停止续期，过期后由其他 worker 接替
+                takeover = await storage.acquire_lease("quota_sweeper", "w2", 60)
+                return first, second, renewed, takeover
+
+            self.assertEqual(asyncio.run(run()), (True, False, True, True))
+
+    def test_checks_are_capped_and_rotated(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.quota_sweeper import QuotaSweeper
+        from app.services.grok.token import token_manager
+
+        tokens = {f"t{i}": {"remainingQueries": 0 if i % 2 else -1, "status": "active", "failedCount": 0}
+                  for i in range(6)}
+        checked = []
+
+        async def refresh(auth_token, model):
+            checked.append(auth_token.split("sso=")[-1])
+
+        async def run():
+            sweeper = QuotaSweeper()
+            rounds = []
+            for _ in range(3):
+                checked.clear()
+                await sweeper.sweep()
+                rounds.append(sorted(checked))
+            return rounds
+
+        conf = {"quota_sweep_max_tokens": 2, "quota_sweep_jitter": 0.0}
+        with mock.patch.dict(setting.grok_config, conf), \
+                mock.patch.object(token_manager, "token_data", {"ssoNormal": tokens, "ssoSuper": {}}), \
+                mock.patch("app.services.grok.quota_sweeper.rate_limit_refresher.refresh", refresh):
+            rounds = asyncio.run(run())
+
+        # 每轮最多 2 项；耗尽的Token优先，之后按上次复查时间轮转，三轮覆盖全部
+        self.assertEqual(rounds[0], ["t1", "t3"])
+        self.assertTrue(all(len(r) == 2 for r in rounds))
+        self.assertEqual(sorted(sum(rounds, [])), sorted(tokens))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import asyncio
+import unittest
+
+
+class _Resp:
+    def __init__(self, status: int, headers: dict = None) -> None:
+        self.status_code = status
+        self.headers = headers or {}
+
+
+class TestRetryEngine(unittest.TestCase):
+    def _engine(self):
+        from app.core.retry import RetryEngine, TokenBucket
+
+        engine = RetryEngine()
+        engine._bucket = TokenBucket(1000.0, 1000)
+        engine._refresh_bucket = lambda: None
+        return engine
+
+    def _run(self, coro):
+        return asyncio.run(coro)
+
+    def test_parse_retry_after_seconds_and_date(self) -> None:
+        from email.utils import formatdate
+        import time
+        from app.core.retry import parse_retry_after
+
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after(""))
+        self.assertIsNone(parse_retry_after("soon"))
+        delay = parse_retry_after(formatdate(time.time() + 30, usegmt=True))
+        self.assertTrue(25 <= delay <= 31)
+
+    def test_retries_status_codes_until_success(self) -> None:
+        engine = self._engine()
+        statuses = iter([429, 429, 200])
+
+        async def send(proxy):
+            return _Resp(next(statuses))
+
+        async def run():
+            return await engine.execute(send, tag="T", retry_codes=[429], max_attempts=5)
+
+        response = self._run(run())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(engine.stats()["T"]["attempts"], 3)
+        self.assertEqual(engine.stats()["T"]["recovered"], 1)
+
+    def test_request_budget_is_shared_across_calls(self) -> None:
+        from app.core.retry import retry_scope
+
+        engine = self._engine()
+        calls = []
+
+        async def send(proxy):
+            calls.append(proxy)
+            return _Resp(401)
+
+        async def run():
+            with retry_scope(limit=2):
+                first = await engine.execute(send, tag="A", retry_codes=[401], max_attempts=10)
+                second = await engine.execute(send, tag="B", retry_codes=[401], max_attempts=10)
+            return first, second
+
+        first, second = self._run(run())
+        self.assertEqual(first.status_code, 401)
+        self.assertEqual(second.status_code, 401)
+        # 预算2次重试: A用掉2次(共3次尝试)，B只剩首次尝试
+        self.assertEqual(len(calls), 4)
+        self.assertEqual(engine.stats()["B"]["gave_up_budget"], 1)
+
+    def test_retry_after_above_limit_gives_up(self) -> None:
+        engine = self._engine()
+
+        async def send(proxy):
+            return _Resp(429, {"Retry-After": "3600"})
+
+        response = self._run(engine.execute(send, tag="T", retry_codes=[429], max_attempts=5))
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(engine.stats()["T"]["attempts"], 1)
+        self.assertEqual(engine.stats()["T"]["gave_up_retry_after"], 1)
+
+    def test_token_bucket_caps_retry_rate(self) -> None:
+        from app.core.retry import TokenBucket
+
+        bucket = TokenBucket(rate=0.0, burst=2)
+        self.assertTrue(bucket.try_take())
+        self.assertTrue(bucket.try_take())
+        self.assertFalse(bucket.try_take())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+
+class TestSSEEncoder(unittest.TestCase):
+    def test_frames_match_pydantic_output(self) -> None:
+        from app.models.openai_schema import (
+            OpenAIChatCompletionChunkChoice,
+            OpenAIChatCompletionChunkMessage,
+            OpenAIChatCompletionChunkResponse,
+        )
+        from app.services.grok.processer import SSEEncoder
+
+        encoder = SSEEncoder("grok-4-mini-thinking-tahoe")
+        encoder.set_model("grok-4")
+        for content, finish in (("引号\"与\n换行\t<b>", None), ("", "stop"), ("出错", "error")):
+            expected = OpenAIChatCompletionChunkResponse(
+                id=encoder._id,
+                created=encoder._created,
+                model="grok-4",
+                choices=[OpenAIChatCompletionChunkChoice(
+                    index=0,
+                    delta=OpenAIChatCompletionChunkMessage(role="assistant", content=content) if content else {},
+                    finish_reason=finish,
+                )],
+            )
+            self.assertEqual(encoder.chunk(content, finish), f"data: {expected.model_dump_json()}\n\n".encode())
+
+    def test_id_is_stable_within_a_stream(self) -> None:
+        import orjson
+        from app.services.grok.processer import SSEEncoder
+
+        encoder = SSEEncoder("grok-4")
+        ids = {orjson.loads(encoder.chunk(text)[6:])["id"] for text in ("a", "b", "c")}
+        self.assertEqual(len(ids), 1)
+        self.assertNotEqual(ids, {orjson.loads(SSEEncoder("grok-4").chunk("a")[6:])["id"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import asyncio
+import unittest
+from unittest import mock
+
+import orjson
+
+
+class _FakeUpstream:
+    """按 (延迟, token, 是否思考) 输出 NDJSON 行的模拟上游"""
+
+    def __init__(self, events):
+        self._events = events
+        self.closed = False
+
+    async def aiter_lines(self):
+        for delay, token, thinking in self._events:
+            if delay:
+                await asyncio.sleep(delay)
+            yield orjson.dumps({"result": {"response": {"token": token, "isThinking": thinking}}})
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _contents(frames):
+    out = []
+    for frame in frames:
+        body = frame[6:].strip()
+        if body == b"[DONE]":
+            continue
+        delta = orjson.loads(body)["choices"][0]["delta"]
+        if delta:
+            out.append(delta["content"])
+    return out
+
+
+class TestDeltaCoalescing(unittest.TestCase):
+    def _run(self, events, api_key=None):
+        from app.services.grok.processer import DeltaCoalescer, GrokResponseProcessor
+
+        async def run():
+            DeltaCoalescer.configure(api_key)
+            upstream = _FakeUpstream(events)
+            frames = [frame async for frame in GrokResponseProcessor.process_stream(upstream, "")]
+            self.assertTrue(upstream.closed)
+            return _contents(frames)
+
+        return asyncio.run(run())
+
+    def test_deltas_are_merged_and_flushed_on_deadline_and_boundary(self) -> None:
+        from app.core.config import setting
+
+        events = [(0, "想", True), (0, "一想", True)]
+        events += [(0, f"t{i} ", False) for i in range(10)]
+        events += [(0.2, "尾", False), (0, "巴", False)]
+
+        with mock.patch.dict(setting.grok_config, {"stream_coalesce_ms": 0, "show_thinking": True}):
+            self.assertEqual(len(self._run(events)), len(events))
+
+        with mock.patch.dict(setting.grok_config, {
+            "stream_coalesce_ms": 50, "stream_coalesce_bytes": 4096, "show_thinking": True,
+        }):
+            contents = self._run(events)
+
+        answer = "".join(f"t{i} " for i in range(10))
+        # 思考内容在切换到回答时发送；回答在缓冲到期（上游停顿期间）发送；其余在流结束前发送
+        self.assertEqual(contents, ["<think>\n想一想", "\n</think>\n" + answer, "尾巴"])
+
+    def test_per_key_override(self) -> None:
+        from app.core.config import setting
+
+        events = [(0, f"t{i}", False) for i in range(6)]
+        with mock.patch.dict(setting.grok_config, {
+            "stream_coalesce_ms": 0,
+            "stream_coalesce_keys": {"sk-batch": {"ms": 1000, "bytes": 4}},
+        }):
+            self.assertEqual(len(self._run(events, "sk-interactive")), 6)
+            self.assertEqual(self._run(events, "sk-batch"), ["t0t1", "t2t3", "t4t5"])
+
+
+if __name__ == "__main__":
+    unittest.main()
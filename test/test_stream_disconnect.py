@@ -0,0 +1,58 @@
+import asyncio
+import time
+import unittest
+
+
+class TestGuardDisconnect(unittest.TestCase):
+    def test_disconnect_cancels_upstream_read(self) -> None:
+        from app.services.grok.processer import GrokResponseProcessor
+
+        closed = []
+
+        async def upstream():
+            try:
+                yield "data: first\n\n"
+                await asyncio.sleep(30)
+                yield "data: never\n\n"
+            finally:
+                closed.append(True)
+
+        async def receive():
+            await asyncio.sleep(0.05)
+            return {"type": "http.disconnect"}
+
+        async def run():
+            before = GrokResponseProcessor.stream_stats()["cancelled"]
+            started = time.monotonic()
+            chunks = [chunk async for chunk in GrokResponseProcessor.guard_disconnect(upstream(), receive)]
+            return chunks, time.monotonic() - started, GrokResponseProcessor.stream_stats()["cancelled"] - before
+
+        chunks, elapsed, cancelled = asyncio.run(run())
+
+        self.assertEqual(chunks, ["data: first\n\n"])
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(closed, [True])
+        self.assertEqual(cancelled, 1)
+
+    def test_completed_stream_is_not_cancelled(self) -> None:
+        from app.services.grok.processer import GrokResponseProcessor
+
+        async def upstream():
+            yield "a"
+            yield "b"
+
+        async def receive():
+            await asyncio.sleep(30)
+
+        async def run():
+            return [chunk async for chunk in GrokResponseProcessor.guard_disconnect(upstream(), receive)]
+
+        before = GrokResponseProcessor.stream_stats()
+        self.assertEqual(asyncio.run(run()), ["a", "b"])
+        after = GrokResponseProcessor.stream_stats()
+        self.assertEqual(after["completed"] - before["completed"], 1)
+        self.assertEqual(after["cancelled"], before["cancelled"])
+
+
+if __name__ == "__main__":
+    unittest.main()
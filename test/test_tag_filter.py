@@ -0,0 +1,80 @@
+import asyncio
+import random
+import unittest
+from unittest import mock
+
+import orjson
+
+
+# 按上游实际分片方式记录的对话 token 序列
+RECORDED_CITATION = [
+    "东京", "是日本的首都", "<grok", ":render", " type=\"render_inline_citation\">",
+    "<argument", " name=\"citation_id\">", "2", "</argument>", "</grok:", "render>", "，人口约", "1400万。",
+]
+RECORDED_ARTIFACT = [
+    "示例代码如下：\n", "<xai", "Artifact artifact_id=\"a1\" title=\"hello.py\" contentType=\"text/python\">",
+    "print(", "'hi')", "</xaiArt", "ifact>", "\n运行即可。",
+]
+RECORDED_TOOL_CARD = [
+    "<xai:tool_usage_card>", "<xai:tool_usage_card_id>", "7f3e", "</xai:tool_usage_card_id>",
+    "<xai:tool_name>web_search</xai:tool_name>", "</xai:tool_usage_card", ">", "搜索完成。",
+]
+TAGS = ["xaiartifact", "xai:tool_usage_card", "grok:render"]
+
+
+def _filter(tokens, tags=TAGS):
+    from app.services.grok.tag_filter import StreamTagFilter, TagMatcher
+
+    stream = StreamTagFilter(TagMatcher(tags))
+    return "".join(stream.feed(token) for token in tokens) + stream.flush()
+
+
+class TestStreamTagFilter(unittest.TestCase):
+    def test_recorded_streams(self) -> None:
+        self.assertEqual(_filter(RECORDED_CITATION), "东京是日本的首都，人口约1400万。")
+        self.assertEqual(_filter(RECORDED_ARTIFACT), "示例代码如下：\n\n运行即可。")
+        self.assertEqual(_filter(RECORDED_TOOL_CARD), "搜索完成。")
+
+    def test_any_chunking_gives_the_same_output(self) -> None:
+        text = "".join(RECORDED_CITATION + RECORDED_ARTIFACT + RECORDED_TOOL_CARD)
+        expected = _filter([text])
+        rng = random.Random(7)
+        for _ in range(300):
+            cuts = sorted(rng.sample(range(1, len(text)), rng.randint(1, 30)))
+            tokens = [text[a:b] for a, b in zip([0] + cuts, cuts + [len(text)])]
+            self.assertEqual(_filter(tokens), expected)
+
+    def test_similar_names_and_plain_text_are_kept(self) -> None:
+        self.assertEqual(_filter(["a <grok:renderer>b</grok:renderer> 1<2"]), "a <grok:renderer>b</grok:renderer> 1<2")
+        self.assertEqual(_filter(["x<grok:render/>y"]), "xy")
+        # 流结束时未构成标签的暂存内容照常输出，未闭合的标签片段丢弃
+        self.assertEqual(_filter(["结尾 <xai"]), "结尾 <xai")
+        self.assertEqual(_filter(["正文<xaiArtifact>未闭合"]), "正文")
+        self.assertEqual(_filter(["<xaiArtifact>x</xaiArtifact>"], tags=[""]), "<xaiArtifact>x</xaiArtifact>")
+
+    def test_process_stream_filters_split_tags(self) -> None:
+        from app.core.config import setting
+        from app.services.grok.processer import GrokResponseProcessor
+
+        class Upstream:
+            async def aiter_lines(self):
+                for token in RECORDED_CITATION:
+                    yield orjson.dumps({"result": {"response": {"token": token, "isThinking": False}}})
+
+            async def aclose(self):
+                pass
+
+        async def run():
+            frames = [frame async for frame in GrokResponseProcessor.process_stream(Upstream(), "")]
+            parts = []
+            for frame in frames[:-1]:
+                delta = orjson.loads(frame[6:])["choices"][0]["delta"]
+                parts.append(delta.get("content", ""))
+            return "".join(parts)
+
+        with mock.patch.dict(setting.grok_config, {"filtered_tags": ",".join(TAGS), "stream_coalesce_ms": 0}):
+            self.assertEqual(asyncio.run(run()), "东京是日本的首都，人口约1400万。")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+
+
+class TestHealthTracker(unittest.TestCase):
+    def test_slow_token_ranks_below_fast_tokens(self) -> None:
+        from app.services.grok.token_health import HealthTracker
+        from app.services.grok.token_index import TokenIndex
+
+        index = TokenIndex(max_failures=3)
+        # slow 剩余最多，按额度会被优先选中
+        for sso, remaining in (("slow", 90), ("fast1", 50), ("fast2", 40)):
+            index.update("ssoNormal", sso, {"remainingQueries": remaining, "failedCount": 0})
+        tracker = HealthTracker(on_penalty=index.set_penalty)
+
+        for _ in range(10):
+            tracker.record_success("fast1", ttfb=0.5)
+            tracker.record_success("fast2", ttfb=0.5)
+            tracker.record_success("slow", ttfb=1.5)
+
+        self.assertGreater(tracker.penalty("slow"), 0)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries")[0], "fast1")
+
+    def test_error_rate_ejects_and_rate_limit_does_not(self) -> None:
+        from app.services.grok.token_health import HealthTracker
+
+        ejected = []
+        tracker = HealthTracker(on_eject=lambda sso, seconds: ejected.append(sso) or True)
+
+        for _ in range(10):
+            tracker.record_error("limited", 429, penalize=False)
+        self.assertEqual(ejected, [])
+        self.assertEqual(tracker.snapshot("limited")["errors"], {"429": 10})
+
+        for _ in range(10):
+            tracker.record_error("broken", 500)
+        self.assertIn("broken", ejected)
+        self.assertLess(tracker.snapshot("broken")["error_rate"], 1.0)
+
+
+class TestLeaseOutcome(unittest.TestCase):
+    def test_failure_frames_are_recorded_as_errors(self) -> None:
+        import asyncio
+        import time
+        from unittest import mock
+
+        from app.services.grok.client import GrokClient
+        from app.services.grok.processer import SSE_DONE, FailureFrame
+
+        class Lease:
+            sso = "a"
+
+            def release(self):
+                pass
+
+        async def upstream(*frames):
+            for frame in frames:
+                yield frame
+
+        async def run(*frames):
+            async for _ in GrokClient._hold_lease(upstream(*frames), Lease(), time.monotonic()):
+                pass
+
+        with mock.patch("app.services.grok.client.token_manager") as tm:
+            asyncio.run(run(b"data: x\n\n", SSE_DONE))
+            asyncio.run(run(FailureFrame(b"data: stop\n\n", "STREAM_TIMEOUT"), SSE_DONE))
+
+        self.assertEqual(tm.record_success.call_count, 1)
+        tm.record_error.assert_called_once_with("a", "STREAM_TIMEOUT")
+
+
+
+class TestEjectionReadmit(unittest.TestCase):
+    def test_ejected_token_is_readmitted_without_new_requests(self) -> None:
+        import asyncio
+        from unittest import mock
+
+        from app.services.grok.token import token_manager
+
+        state = dict(token_manager.__dict__)
+        readmitted = []
+
+        async def run():
+            token_manager._shutdown = False
+            token_manager._ejected = set()
+            token_manager._cooldown._on_expire = readmitted.append
+            token_manager._cooldown.park("ejected", 0.05, strike=False)
+            self.assertNotIn("ejected", token_manager._cooldown._strikes)
+            task = asyncio.create_task(token_manager._cooldown_worker())
+            # 时间轮刻度为 1 秒
+            await asyncio.sleep(1.2)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        try:
+            with mock.patch("app.services.grok.token.COOLDOWN_TICK", 0.01):
+                asyncio.run(run())
+        finally:
+            token_manager._cooldown._on_expire = token_manager._readmit
+            token_manager.__dict__.clear()
+            token_manager.__dict__.update(state)
+        self.assertEqual(readmitted, ["ejected"])
+
+
+if __name__ == "__main__":
+    unittest.main()
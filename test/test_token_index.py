@@ -0,0 +1,91 @@
+import random
+import unittest
+
+
+def _scan(tokens: dict, field: str, skip: set, max_failures: int):
+    """原 select_token 的线性扫描实现（对照）"""
+    unused, used = [], []
+    for key, data in tokens.items():
+        if key in skip or data.get("status") == "expired" or data.get("failedCount", 0) >= max_failures:
+            continue
+        remaining = int(data.get(field, -1))
+        if remaining == -1:
+            unused.append(key)
+        elif remaining > 0:
+            used.append((key, remaining))
+    if unused:
+        return unused[0], -1
+    if used:
+        used.sort(key=lambda x: x[1], reverse=True)
+        return used[0]
+    return None, None
+
+
+class TestTokenIndex(unittest.TestCase):
+    def test_matches_linear_scan_under_random_mutations(self) -> None:
+        from app.services.grok.token_index import TokenIndex
+
+        rng = random.Random(7)
+        tokens = {}
+        index = TokenIndex(max_failures=3)
+        field = "remainingQueries"
+
+        for step in range(3000):
+            op = rng.random()
+            key = f"t{rng.randrange(200)}"
+            if op < 0.25:
+                tokens[key] = {"remainingQueries": -1, "heavyremainingQueries": -1, "failedCount": 0, "status": "active"}
+                index.update("ssoNormal", key, tokens[key])
+            elif op < 0.35:
+                tokens.pop(key, None)
+                index.update("ssoNormal", key, None)
+            elif key in tokens:
+                data = tokens[key]
+                if op < 0.8:
+                    data[field] = rng.choice([0, 1, 5, 5, 20, 80])
+                elif op < 0.9:
+                    data["failedCount"] = data.get("failedCount", 0) + 1
+                elif op < 0.95:
+                    data["failedCount"] = 0
+                else:
+                    data["status"] = "expired"
+                index.update("ssoNormal", key, data)
+
+            skip = set(rng.sample(sorted(tokens), min(3, len(tokens)))) if step % 7 == 0 and tokens else set()
+            expected = _scan(tokens, field, skip, 3)
+            got = index.select("ssoNormal", field, skip)
+            self.assertEqual(got, expected, f"step {step}")
+
+    def test_rebuild_keeps_insertion_order(self) -> None:
+        from app.services.grok.token_index import TokenIndex
+
+        index = TokenIndex(max_failures=3)
+        index.rebuild({
+            "ssoNormal": {"a": {"remainingQueries": 3}, "b": {"remainingQueries": -1}, "c": {"remainingQueries": -1}},
+            "ssoSuper": {"d": {"remainingQueries": 9}},
+        })
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), ("b", -1))
+        self.assertEqual(index.select("ssoNormal", "remainingQueries", {"b", "c"}), ("a", 3))
+        self.assertEqual(index.select("ssoNormal", "remainingQueries", {"a", "b", "c"}), (None, None))
+        self.assertEqual(index.select("ssoSuper", "remainingQueries"), ("d", 9))
+
+    def test_prefers_least_loaded_and_respects_max_load(self) -> None:
+        from app.services.grok.token_index import TokenIndex
+
+        index = TokenIndex(max_failures=3)
+        index.rebuild({"ssoNormal": {"a": {"remainingQueries": -1}, "b": {"remainingQueries": 50}}})
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), ("a", -1))
+
+        index.set_load("a", 1)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), ("b", 50))
+        index.set_load("b", 2)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), ("a", -1))
+
+        index.set_max_load(1)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), (None, None))
+        index.set_load("a", 0)
+        self.assertEqual(index.select("ssoNormal", "remainingQueries"), ("a", -1))
+
+
+if __name__ == "__main__":
+    unittest.main()
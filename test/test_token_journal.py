@@ -0,0 +1,80 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+import orjson
+
+
+def _record(remaining: int) -> dict:
+    return {"remainingQueries": remaining, "heavyremainingQueries": -1, "status": "active", "failedCount": 0}
+
+
+class TestFileStorageJournal(unittest.TestCase):
+    def setUp(self) -> None:
+        from app.core.storage import FileStorage
+
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = FileStorage(Path(self._tmp.name))
+        asyncio.run(self.storage.init_db())
+
+    def tearDown(self) -> None:
+        self._tmp.cleanup()
+
+    def test_changes_are_journaled_replayed_and_compacted(self) -> None:
+        storage = self.storage
+
+        async def run():
+            data = {"ssoNormal": {"a": _record(-1), "b": _record(5)}, "ssoSuper": {}}
+            await storage.save_tokens(data)
+            snapshot = storage.token_file.read_bytes()
+
+            full, _, cursor = await storage.read_token_changes(None)
+            self.assertEqual(full["ssoNormal"], data["ssoNormal"])
+
+            # 只追加变化的记录，快照不变
+            data["ssoNormal"]["b"]["remainingQueries"] = 4
+            del data["ssoNormal"]["a"]
+            await storage.save_token_changes(data, [("ssoNormal", "b"), ("ssoNormal", "a")])
+            self.assertEqual(storage.token_file.read_bytes(), snapshot)
+
+            full, entries, cursor = await storage.read_token_changes(cursor)
+            self.assertIsNone(full)
+            self.assertEqual(entries, [("ssoNormal", "b", _record(4)), ("ssoNormal", "a", None)])
+
+            # 崩溃时残留的不完整行被忽略
+            with open(storage.token_journal, "ab") as f:
+                f.write(b'{"t": "ssoNormal", "s": "c", "d"')
+            loaded = await storage.load_tokens()
+            self.assertEqual(loaded["ssoNormal"], {"b": _record(4)})
+
+            # 压缩后快照包含全部变化，日志清空，读取方获得完整数据
+            await storage.compact_tokens()
+            self.assertEqual(storage.token_journal.stat().st_size, 0)
+            self.assertEqual(orjson.loads(storage.token_file.read_bytes())["ssoNormal"], {"b": _record(4)})
+            full, _, _ = await storage.read_token_changes(cursor)
+            self.assertEqual(full["ssoNormal"], {"b": _record(4)})
+
+        asyncio.run(run())
+
+    def test_append_after_torn_tail_is_not_lost(self) -> None:
+        storage = self.storage
+
+        async def run():
+            data = {"ssoNormal": {"a": _record(1)}, "ssoSuper": {}}
+            await storage.save_tokens(data)
+
+            # 崩溃残留半行后继续追加
+            with open(storage.token_journal, "ab") as f:
+                f.write(b'{"t": "ssoNormal", "s": "x", "d"')
+            data["ssoNormal"]["b"] = _record(2)
+            await storage.save_token_changes(data, [("ssoNormal", "b")])
+
+            loaded = await storage.load_tokens()
+            self.assertEqual(loaded["ssoNormal"], {"a": _record(1), "b": _record(2)})
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
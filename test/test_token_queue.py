@@ -0,0 +1,169 @@
+import asyncio
+import unittest
+from unittest import mock
+
+
+class TestTokenWaitQueue(unittest.TestCase):
+    def test_waiters_are_served_in_order_and_overflow_is_rejected(self) -> None:
+        from app.core.config import setting
+        from app.core.exception import GrokApiException
+        from app.services.grok.token_queue import TokenWaitQueue
+
+        async def run():
+            queue = TokenWaitQueue()
+            free = []
+            served = []
+
+            async def attempt(name):
+                if not free:
+                    raise GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+                free.pop()
+                served.append(name)
+                return name
+
+            error = GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+            waiters = []
+            for name in ("a", "b"):
+                waiters.append(asyncio.create_task(queue.wait(lambda n=name: attempt(n), error)))
+                await asyncio.sleep(0)
+
+            with self.assertRaises(GrokApiException) as ctx:
+                await queue.wait(lambda: attempt("c"), error)
+            self.assertEqual(ctx.exception.error_code, "QUEUE_FULL")
+            self.assertGreaterEqual(ctx.exception.details["retry_after"], 1)
+
+            for _ in waiters:
+                free.append(1)
+                queue.notify()
+                await asyncio.sleep(0.01)
+            await asyncio.gather(*waiters)
+            self.assertEqual(served, ["a", "b"])
+            self.assertEqual(queue.stats()["served"], 2)
+
+        conf = {"token_queue_size": 2, "token_queue_timeout": 5.0, "token_queue_order": "fifo"}
+        with mock.patch.dict(setting.grok_config, conf):
+            asyncio.run(run())
+
+    def test_times_out_with_original_error(self) -> None:
+        from app.core.config import setting
+        from app.core.exception import GrokApiException
+        from app.services.grok.token_queue import TokenWaitQueue
+
+        async def attempt():
+            raise GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+
+        async def run():
+            queue = TokenWaitQueue()
+            with self.assertRaises(GrokApiException) as ctx:
+                await queue.wait(attempt, GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN"))
+            self.assertEqual(ctx.exception.error_code, "NO_AVAILABLE_TOKEN")
+            self.assertEqual(len(queue), 0)
+
+        with mock.patch.dict(setting.grok_config, {"token_queue_size": 2, "token_queue_timeout": 0.2}):
+            asyncio.run(run())
+
+
+    def test_notify_hands_token_to_head_only(self) -> None:
+        from app.core.config import setting
+        from app.core.exception import GrokApiException
+        from app.services.grok.token_queue import TokenWaitQueue
+
+        async def run():
+            queue = TokenWaitQueue()
+            free = []
+            calls = []
+
+            async def attempt(name):
+                calls.append(name)
+                if not free:
+                    raise GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+                return free.pop()
+
+            error = GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+            waiters = []
+            for name in ("a", "b", "c"):
+                waiters.append(asyncio.create_task(queue.wait(lambda n=name: attempt(n), error)))
+                await asyncio.sleep(0)
+
+            # 释放一个Token：交给队首 a，b 尝试失败后停止，c 不被唤醒
+            free.append("t1")
+            queue.notify()
+            self.assertEqual(await waiters[0], "t1")
+            await asyncio.sleep(0.01)
+            self.assertEqual(calls, ["a", "b"])
+            self.assertEqual(len(queue), 2)
+
+            # 获取期间队首离开：交还获取到的Token，继续交给下一位
+            for task in waiters[1:]:
+                task.cancel()
+            await asyncio.gather(*waiters[1:], return_exceptions=True)
+            gate = asyncio.Event()
+            discarded = []
+
+            async def slow():
+                await gate.wait()
+                return "t2"
+
+            async def discard(token):
+                discarded.append(token)
+
+            head = asyncio.create_task(queue.wait(slow, error, discard=discard))
+            late = asyncio.create_task(queue.wait(lambda: attempt("e"), error))
+            await asyncio.sleep(0)
+            queue.notify()
+            await asyncio.sleep(0)
+            head.cancel()
+            free.append("t3")
+            gate.set()
+            self.assertEqual(await late, "t3")
+            self.assertEqual(discarded, ["t2"])
+            self.assertEqual(len(queue), 0)
+
+        conf = {"token_queue_size": 5, "token_queue_timeout": 5.0, "token_queue_order": "fifo"}
+        with mock.patch.dict(setting.grok_config, conf):
+            asyncio.run(run())
+
+    def test_new_requests_queue_behind_waiters_of_the_same_pool(self) -> None:
+        from app.core.config import setting
+        from app.core.exception import GrokApiException
+        from app.services.grok.token import token_manager
+        from app.services.grok.token_queue import TokenWaitQueue
+
+        calls = []
+
+        async def acquire_now(model, exclude=None):
+            calls.append(model)
+            if model == "grok-4-heavy":
+                raise GrokApiException("没有可用Token", "NO_AVAILABLE_TOKEN")
+            return model
+
+        async def run():
+            heavy = asyncio.create_task(token_manager.acquire("grok-4-heavy"))
+            await asyncio.sleep(0)
+            self.assertEqual(calls, ["grok-4-heavy"])
+
+            # 同一池：不抢先选择，wait=False 直接失败，否则排到队尾
+            with self.assertRaises(GrokApiException):
+                await token_manager.acquire("grok-4-heavy", wait=False)
+            second = asyncio.create_task(token_manager.acquire("grok-4-heavy"))
+            await asyncio.sleep(0)
+            self.assertEqual(calls, ["grok-4-heavy"])
+            self.assertEqual(token_manager.queue_stats()["waiting"], 2)
+
+            # 其他池不受影响：可立即选择，故障转移/对冲（wait=False）照常进行
+            self.assertEqual(await token_manager.acquire("grok-3"), "grok-3")
+            self.assertEqual(await token_manager.acquire("grok-3", wait=False), "grok-3")
+
+            for task in (heavy, second):
+                task.cancel()
+            await asyncio.gather(heavy, second, return_exceptions=True)
+
+        queues = {"remainingQueries": TokenWaitQueue(), "heavyremainingQueries": TokenWaitQueue()}
+        conf = {"token_queue_size": 5, "token_queue_timeout": 5.0}
+        with mock.patch.dict(setting.grok_config, conf), \
+                mock.patch.object(token_manager, "_queues", queues), \
+                mock.patch.object(token_manager, "_acquire_now", acquire_now):
+            asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
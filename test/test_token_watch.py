@@ -0,0 +1,123 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import orjson
+
+
+class TestTokenFileWatch(unittest.TestCase):
+    def setUp(self) -> None:
+        from app.services.grok.token import token_manager
+
+        self.tm = token_manager
+        self._state = dict(token_manager.__dict__)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tm.token_file = Path(self._tmp.name) / "token.json"
+        self.tm._storage = None
+        self.tm._dirty = set()
+
+    def tearDown(self) -> None:
+        self.tm.__dict__.clear()
+        self.tm.__dict__.update(self._state)
+        self._tmp.cleanup()
+
+    def _write(self, data: dict, bump: int) -> None:
+        self.tm.token_file.write_bytes(orjson.dumps(data))
+        st = self.tm.token_file.stat()
+        os.utime(self.tm.token_file, ns=(st.st_atime_ns, st.st_mtime_ns + bump))
+
+    def test_merges_changed_records_and_keeps_local_unsaved(self) -> None:
+        tm = self.tm
+
+        async def run():
+            self._write({"ssoNormal": {"a": {"remainingQueries": 5}, "b": {"remainingQueries": 5}}, "ssoSuper": {}}, 0)
+            await tm._load_data()
+            self.assertEqual(await tm._check_file_changes(), 0)
+
+            # 本进程修改 a（未保存）
+            await tm.update_limits("a", normal=1)
+
+            # 其他进程修改 a、b 并新增 c
+            self._write({
+                "ssoNormal": {
+                    "a": {"remainingQueries": 40},
+                    "b": {"remainingQueries": 7},
+                    "c": {"remainingQueries": -1},
+                },
+                "ssoSuper": {},
+            }, 10_000_000)
+            self.assertEqual(await tm._check_file_changes(), 2)
+
+            self.assertEqual(tm.token_data["ssoNormal"]["a"]["remainingQueries"], 1)
+            self.assertEqual(tm.token_data["ssoNormal"]["b"]["remainingQueries"], 7)
+            self.assertEqual(tm.select_token("grok-3"), "c")
+
+            # 文件未变化时不重复解析
+            self.assertEqual(await tm._check_file_changes(), 0)
+
+        asyncio.run(run())
+
+
+class TestJournalPrediction(unittest.TestCase):
+    def setUp(self) -> None:
+        from app.core.storage import FileStorage
+        from app.services.grok.token import token_manager
+
+        self.tm = token_manager
+        self._state = dict(token_manager.__dict__)
+        self._tmp = tempfile.TemporaryDirectory()
+        self.storage = FileStorage(Path(self._tmp.name))
+        asyncio.run(self.storage.init_db())
+        self.tm._storage = self.storage
+        self.tm._dirty = set()
+        self.tm._predicted = {}
+        self.tm._inflight = {}
+        self.tm._disk_snapshot = {}
+
+    def tearDown(self) -> None:
+        self.tm.__dict__.clear()
+        self.tm.__dict__.update(self._state)
+        self._tmp.cleanup()
+
+    def test_watcher_keeps_open_predictions(self) -> None:
+        from app.core.storage import FileStorage
+
+        tm = self.tm
+        other = FileStorage(self.storage.data_dir)
+        record = {"remainingQueries": 20, "heavyremainingQueries": -1, "status": "active", "failedCount": 0}
+
+        async def run():
+            await self.storage.save_tokens({"ssoNormal": {"a": dict(record)}, "ssoSuper": {}})
+            await tm._load_data()
+            remaining = lambda: tm.token_data["ssoNormal"]["a"]["remainingQueries"]
+
+            # 预扣 4 次并保存，变更检测不会把本进程写入的记录再合并回来
+            lease = await tm.acquire("grok-4-expert", wait=False)
+            self.assertEqual(remaining(), 16)
+            self.assertIn(("ssoNormal", "a"), tm._dirty)
+            await tm._save_data()
+            self.assertEqual(await tm._check_journal_changes(), 0)
+            self.assertEqual(remaining(), 16)
+
+            # 其他进程的修改照常合并，但预扣未结清的额度字段保留本地值
+            await other.save_token_changes({"ssoNormal": {"a": {**record, "note": "x"}}}, [("ssoNormal", "a")])
+            self.assertEqual(await tm._check_journal_changes(), 1)
+            self.assertEqual(tm.token_data["ssoNormal"]["a"]["note"], "x")
+            self.assertEqual(remaining(), 16)
+
+            # 退回后恢复为 20，而不是在被重置的值上再加一次
+            await lease.refund()
+            lease.release()
+            self.assertEqual(remaining(), 20)
+            await tm._save_data()
+            await tm._check_journal_changes()
+            self.assertEqual((await other.load_tokens())["ssoNormal"]["a"]["remainingQueries"], 20)
+            self.assertEqual(remaining(), 20)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()